@@ -0,0 +1,154 @@
+"""
+Benchmark del archivo columnar (columnar.py) frente a guardar las mismas lecturas en SQLite
+Genera una flota sintética: nodos que reportan cada minuto con algo de retraso variable,
+temperatura y humedad con una décima de resolución, campos dispersos (solo algunos nodos
+miden suelo o luz) y ubicación fija o, en los móviles, con deriva de GPS.
+
+Mide bytes por lectura de:
+  - la tabla datos_sensor en SQLite (con sus índices, como la tabla viva o un archivo .db)
+  - el archivo columnar tal como lo deja archivar_datos (lotes y compactación final)
+y las lecturas por segundo al codificar, decodificar todo y leer un nodo un día.
+
+Uso: python benchmarks/bench_archivo_columnar.py [nodos] [dias]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert  # noqa: E402
+
+import columnar  # noqa: E402
+import database  # noqa: E402
+
+INICIO = datetime(2025, 3, 1)
+
+
+def generar(nodos, dias, semilla=7):
+    """Lecturas de la flota en orden de llegada, con ids consecutivos como en datos_sensor."""
+    aleatorio = random.Random(semilla)
+    flota = []
+    for i in range(nodos):
+        flota.append({
+            'nodeId': f'nodo-{i:03d}',
+            'suelo': i % 3 == 0,
+            'luz': i % 3 == 1,
+            'movil': i % 5 == 0,
+            'reloj': i % 2 == 0,  # Firmware que envía su propio timestamp
+            'temperatura': aleatorio.uniform(12, 30),
+            'humedad': aleatorio.uniform(40, 90),
+            'suelo_valor': aleatorio.uniform(20, 60),
+            'lat': 4.6 + aleatorio.uniform(-0.2, 0.2),
+            'lon': -74.08 + aleatorio.uniform(-0.2, 0.2),
+            'desfase': aleatorio.uniform(0, 60),
+        })
+    eventos = []
+    for minuto in range(dias * 1440):
+        for nodo in flota:
+            t = INICIO + timedelta(seconds=minuto * 60 + nodo['desfase'] + aleatorio.uniform(0, 0.4))
+            eventos.append((t, nodo))
+    eventos.sort(key=lambda e: e[0])
+    filas = []
+    for i, (t, nodo) in enumerate(eventos, start=1):
+        nodo['temperatura'] += aleatorio.choice((-0.1, 0, 0, 0, 0.1))
+        nodo['humedad'] += aleatorio.choice((-0.2, -0.1, 0, 0, 0, 0.1, 0.2))
+        fila = {
+            'id': i, 'nodeId': nodo['nodeId'], 'fecha_creacion': t,
+            'timestamp': int(t.timestamp()) if nodo['reloj'] else None,
+            'temperatura': round(nodo['temperatura'], 1), 'humedad': round(nodo['humedad'], 1),
+            'soil_moisture': None, 'light': None, 'percentage': None, 'lat': None, 'lon': None,
+        }
+        if nodo['suelo']:
+            nodo['suelo_valor'] += aleatorio.choice((-0.5, 0, 0, 0.5))
+            fila['soil_moisture'] = round(nodo['suelo_valor'], 1)
+        if nodo['luz']:
+            hora = t.hour + t.minute / 60
+            luz = max(0.0, 1000 * (1 - abs(hora - 13) / 7)) if 6 <= hora <= 20 else 0.0
+            fila['light'] = float(round(luz))
+            fila['percentage'] = float(round(luz / 10))
+        if nodo['movil']:
+            nodo['lat'] += aleatorio.uniform(-1e-5, 1e-5)
+            nodo['lon'] += aleatorio.uniform(-1e-5, 1e-5)
+            fila['lat'], fila['lon'] = round(nodo['lat'], 6), round(nodo['lon'], 6)
+        elif i % 10 == 0:
+            fila['lat'], fila['lon'] = round(nodo['lat'], 6), round(nodo['lon'], 6)
+        filas.append(fila)
+    return filas
+
+
+def bytes_sqlite(filas, ruta):
+    motor = create_engine(f'sqlite:///{ruta}')
+    database.DatosSensor.__table__.create(bind=motor)
+    with motor.begin() as conn:
+        for i in range(0, len(filas), 5000):
+            conn.execute(insert(database.DatosSensor.__table__), filas[i:i + 5000])
+    with motor.connect() as conn:
+        conn.exec_driver_sql('VACUUM')
+    motor.dispose()
+    return os.path.getsize(ruta)
+
+
+def bytes_por_columna(ruta):
+    lector = columnar.abrir(ruta)
+    totales = Counter()
+    for bloque in lector.bloques:
+        for i, nombre in enumerate(columnar.COLUMNAS):
+            _, largo = columnar._COLUMNA.unpack_from(lector._mapa, bloque.inicio + i * columnar._COLUMNA.size)
+            totales[nombre] += largo
+    return totales
+
+
+def main():
+    nodos = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    dias = int(sys.argv[2]) if len(sys.argv) > 2 else 7
+    filas = generar(nodos, dias)
+    n = len(filas)
+    print(f"{nodos} nodos, {dias} días: {n} lecturas")
+    with tempfile.TemporaryDirectory() as tmp:
+        tamano_sqlite = bytes_sqlite(filas, os.path.join(tmp, 'datos.db'))
+
+        ruta = os.path.join(tmp, 'datos.col')
+        inicio = time.perf_counter()
+        for i in range(0, n, 5000):
+            columnar.agregar(ruta, filas[i:i + 5000])
+        tiempo_lotes = time.perf_counter() - inicio
+        tamano_lotes = os.path.getsize(ruta)
+        inicio = time.perf_counter()
+        columnar.compactar(ruta)
+        tiempo_compactar = time.perf_counter() - inicio
+        tamano_col = os.path.getsize(ruta)
+
+        lector = columnar.abrir(ruta)
+        inicio = time.perf_counter()
+        leidas = lector.leer()
+        tiempo_leer = time.perf_counter() - inicio
+        iguales = [{k: f[k] for k in sorted(f)} for f in leidas] == [{k: f[k] for k in sorted(f)} for f in filas]
+        dia = INICIO + timedelta(days=dias // 2)
+        inicio = time.perf_counter()
+        un_dia = lector.leer(dia, dia + timedelta(days=1) - timedelta(microseconds=1), 'nodo-001', True)
+        tiempo_dia = time.perf_counter() - inicio
+        por_columna = bytes_por_columna(ruta)
+        columnar.olvidar(ruta)
+
+    print(f"{'almacenamiento':<28} {'bytes':>12} {'bytes/lectura':>14} {'reducción':>10}")
+    for nombre, tamano in (('SQLite datos_sensor + índices', tamano_sqlite),
+                           ('columnar (lotes de 5000)', tamano_lotes),
+                           ('columnar compactado', tamano_col)):
+        print(f"{nombre:<28} {tamano:>12} {tamano / n:>14.2f} {tamano_sqlite / tamano:>9.1f}x")
+    print("bytes/lectura por columna: " + ', '.join(
+        f"{c}={por_columna[c] / n:.2f}" for c in columnar.COLUMNAS if por_columna[c]))
+    print(f"codificar en lotes: {n / tiempo_lotes:,.0f} lecturas/s; compactar: {n / tiempo_compactar:,.0f} lecturas/s")
+    print(f"decodificar todo: {n / tiempo_leer:,.0f} lecturas/s; un nodo un día ({len(un_dia)} lecturas): "
+          f"{tiempo_dia * 1000:.1f} ms")
+    print(f"ida y vuelta sin pérdidas: {'sí' if iguales else 'NO'}")
+    if not iguales or tamano_sqlite / tamano_col < 10:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark del costo de las métricas (metricas.py) en el camino de las peticiones
+Ejecuta la misma carga en dos procesos, con AGROLINK_METRICAS=0 y =1, y compara los
+microsegundos por operación:
+  - GET /api/dashboard ya armado (la petición más barata que consulta algo en memoria)
+  - GET /api/datos con If-None-Match (304: sin vista ni consultas)
+  - POST /datos (guardar una lectura: ~6 consultas y un commit)
+  - evento 'suscribir' de Socket.IO
+Además mide las primitivas sueltas (contador, histograma, registro de ingesta).
+benchmarks/suite.py mide lo mismo de punta a punta, pero con más ruido que diferencia.
+
+Uso: python benchmarks/bench_metricas.py [repeticiones] [rondas]
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+
+def _medir(funcion, repeticiones):
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        funcion()
+    return (time.perf_counter() - inicio) / repeticiones * 1e6
+
+
+def carga(repeticiones):
+    """Corre dentro del proceso hijo; imprime un JSON {operación: µs}."""
+    from app import app, socketio
+    import database
+
+    cliente = app.test_client()
+    with app.app_context():
+        database.guardar_datos_sensor_lote([
+            {'node_id': f'nodo{i % 50}', 'temperatura': 20.0, 'humedad': 55.0, 'lat': 4.6, 'lon': -74.0}
+            for i in range(2000)
+        ])
+    cliente.get('/api/dashboard')
+    etag = cliente.get('/api/datos').headers['ETag']
+    sio = socketio.test_client(app)
+    sio.get_received()
+    lectura = {'nodeId': 'nodo1', 'temperatura': 21.5, 'humedad': 60.0}
+    resultados = {
+        'GET /api/dashboard': _medir(lambda: cliente.get('/api/dashboard'), repeticiones),
+        'GET /api/datos (304)': _medir(lambda: cliente.get('/api/datos', headers={'If-None-Match': etag}),
+                                       repeticiones),
+        'POST /datos': _medir(lambda: cliente.post('/datos', json=lectura), repeticiones // 4),
+        "socketio 'suscribir'": _medir(lambda: sio.emit('suscribir', {'todos': True}), repeticiones),
+    }
+    sio.disconnect()
+    print(json.dumps(resultados))
+
+
+def primitivas(repeticiones):
+    from metricas import Instrumentacion
+    instrumentacion = Instrumentacion()
+    print(f"{'primitiva':<40} {'µs':>8}")
+    for nombre, funcion in (
+            ('Contador.inc con 3 etiquetas', lambda: instrumentacion.peticiones.inc(1, '/datos', 'POST', '200')),
+            ('Histograma.observar con 2 etiquetas',
+             lambda: instrumentacion.duracion_peticiones.observar(0.003, '/datos', 'POST')),
+            ('registrar_ingesta', lambda: instrumentacion.registrar_ingesta(1))):
+        print(f"{nombre:<40} {_medir(funcion, repeticiones):>8.2f}")
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == '--carga':
+        carga(int(sys.argv[2]))
+        return
+    repeticiones = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    rondas = int(sys.argv[2]) if len(sys.argv) > 2 else 6
+    primitivas(repeticiones * 25)
+    medidas = {'0': [], '1': []}
+    with tempfile.TemporaryDirectory() as tmp:
+        for ronda in range(rondas):
+            # Alternar el orden reparte el calentamiento de la máquina entre ambos
+            for activa in (('0', '1') if ronda % 2 == 0 else ('1', '0')):
+                entorno = dict(os.environ, AGROLINK_METRICAS=activa, AGROLINK_DIFUSION_VENTANA_MS='0',
+                               AGROLINK_RETENCION_INTERVALO='0',
+                               AGROLINK_DATABASE_URL=f"sqlite:///{os.path.join(tmp, f'm{ronda}{activa}.db')}")
+                salida = subprocess.run([sys.executable, __file__, '--carga', str(repeticiones)], env=entorno,
+                                        cwd=RAIZ, capture_output=True, text=True, check=True).stdout
+                medidas[activa].append(json.loads(salida.strip().splitlines()[-1]))
+    # El mínimo de las rondas: el ruido de la máquina solo suma tiempo
+    print(f"\n{'operación (mínimo de ' + str(rondas) + ' rondas)':<40} {'sin µs':>8} {'con µs':>8} {'dif':>8}")
+    for operacion in medidas['0'][0]:
+        sin = min(m[operacion] for m in medidas['0'])
+        con = min(m[operacion] for m in medidas['1'])
+        print(f"{operacion:<40} {sin:>8.1f} {con:>8.1f} {(con - sin) / sin * 100:>+7.1f}%")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Micro-benchmark del normalizador de payloads
+Compara normalizador.normalizar_payload con la normalización que hacía recibir_datos
+(diccionario de alias reconstruido por petición y búsqueda alias por alias).
+
+Uso: python benchmarks/bench_normalizador.py [repeticiones]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from normalizador import normalizar_payload  # noqa: E402
+
+
+def _parse_maybe_float_anterior(val):
+    if val is None:
+        return None
+    if isinstance(val, (int, float)):
+        try:
+            return float(val)
+        except Exception:
+            return None
+    if isinstance(val, str):
+        s = val.strip().lower()
+        if s in ('no data', 'nodata', 'none', '', 'null'):
+            return None
+        try:
+            return float(s)
+        except ValueError:
+            return None
+    return None
+
+
+def normalizar_anterior(data):
+    """Copia de la normalización original de recibir_datos (sin E/S)."""
+    if data.get('nodeId', '').lower() == 'gateway' and 'ip' in data and all(k not in data for k in ['temperatura','temperature','temp','t','humedad','humidity','hum','h','soil_moisture','light','luz','lux','l','percentage','luz_porcentaje','light_percentage','porcentaje','pct','lat','latitude','latitud','lon','longitude','longitud','lng']):
+        return 'gateway', data.get('ip')
+    campos_alias = {
+        'temperatura': ('temperature', 'temp', 't'),
+        'humedad': ('humidity', 'hum', 'h'),
+        'light': ('luz', 'lux', 'l'),
+        'percentage': ('luz_porcentaje', 'light_percentage', 'porcentaje', 'pct'),
+        'lat': ('latitude', 'latitud', 'y'),
+        'lon': ('longitude', 'longitud', 'lng', 'x')
+    }
+    for canon, aliases in campos_alias.items():
+        if canon in data:
+            data[canon] = _parse_maybe_float_anterior(data[canon])
+        else:
+            for alt in aliases:
+                if alt in data:
+                    data[canon] = _parse_maybe_float_anterior(data.pop(alt))
+                    break
+    if 'soil_moisture' in data:
+        data['soil_moisture'] = _parse_maybe_float_anterior(data['soil_moisture'])
+    gateway_ip_payload = None
+    for k in ('gateway_ip', 'ip', 'gatewayIP'):
+        if k in data and data.get(k):
+            gateway_ip_payload = str(data.get(k))
+            break
+    valores = [data.get(k) for k in ('temperatura', 'humedad', 'soil_moisture', 'light', 'percentage', 'lat', 'lon')]
+    node_id = data.get('nodeId') or data.get('node_id') or 'unknown'
+    if gateway_ip_payload and all(v is None for v in valores) and data.get('timestamp') is None:
+        return 'gateway', gateway_ip_payload
+    return 'dato', (valores, node_id, data.get('timestamp'))
+
+
+PAYLOADS = {
+    'numerico': {'nodeId': 'nodo1', 'temperatura': 23.4, 'humedad': 61.0, 'soil_moisture': 512, 'timestamp': 1700000000},
+    'alias': {'nodeId': 'nodo2', 't': 23.4, 'h': 61, 'lux': 830.5, 'pct': 72, 'lat': 4.66, 'lng': -74.05},
+    'cadenas': {'nodeId': 'nodo3', 'temperature': ' 23.4 ', 'humidity': 'no data', 'light': 'NULL', 'latitude': '4.66', 'longitude': '-74.05'},
+    'gateway': {'nodeId': 'gateway', 'ip': '192.168.1.10'},
+}
+
+
+def main():
+    repeticiones = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    print(f"{'payload':<10} {'anterior (µs)':>14} {'normalizador (µs)':>18} {'aceleración':>12}")
+    for nombre, payload in PAYLOADS.items():
+        # El código anterior modifica el dict recibido: copiar en ambos para comparar igual
+        # Mínimo de varias repeticiones: el menos afectado por ruido del sistema
+        t_ant = min(timeit.repeat(lambda: normalizar_anterior(dict(payload)), number=repeticiones, repeat=5))
+        t_nue = min(timeit.repeat(lambda: normalizar_payload(dict(payload)), number=repeticiones, repeat=5))
+        print(f"{nombre:<10} {t_ant / repeticiones * 1e6:>14.2f} {t_nue / repeticiones * 1e6:>18.2f} {t_ant / t_nue:>11.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Benchmark de la serialización de listados: objetos ORM + to_dict + json frente a
+tuplas FilaDato + filas_a_dicts (o formato compacto) + orjson
+
+Mide el camino completo de /api/datos sin caché (consulta, conversión y codificación)
+para páginas de distinto tamaño, y el tamaño de la respuesta en cada formato.
+
+Uso: python benchmarks/bench_serializacion.py [filas_en_bd] [repeticiones]
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+
+import database  # noqa: E402
+import serializacion  # noqa: E402
+
+NODOS = [f'nodo{i}' for i in range(20)]
+
+
+def crear_app(ruta_db):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{ruta_db}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Sin caché de recientes: todas las páginas salen de la base de datos
+    app.config['CACHE_MAX_RECIENTES'] = 0
+    app.json = serializacion.ProveedorJSON(app)
+    database.inicializar_db(app)
+    return app
+
+
+def medir(funcion, repeticiones):
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        cuerpo = funcion()
+    return (time.perf_counter() - inicio) / repeticiones * 1000, len(cuerpo)
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    repeticiones = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    print(f"orjson: {'sí' if serializacion.orjson else 'no (json estándar)'}")
+    with tempfile.TemporaryDirectory() as tmp:
+        app = crear_app(os.path.join(tmp, 'bench.db'))
+        with app.app_context():
+            database.guardar_datos_sensor_lote([
+                {'node_id': NODOS[i % len(NODOS)], 'temperatura': 20.0 + i % 50 / 10, 'humedad': 55.5,
+                 'light': 300.0 if i % 3 == 0 else None, 'percentage': 30.0 if i % 3 == 0 else None,
+                 'lat': 4.6 if i % 4 == 0 else None, 'lon': -74.0 if i % 4 == 0 else None, 'timestamp': 1700000000 + i}
+                for i in range(total)
+            ])
+            print(f"{'filas':>6} {'camino':<32} {'ms':>8} {'bytes':>9} {'aceleración':>12}")
+            for limit in (100, 1000, 5000):
+                def orm():
+                    datos = database.DatosSensor.query.order_by(
+                        database.DatosSensor.fecha_creacion.desc()).limit(limit).all()
+                    return json.dumps([d.to_dict() for d in datos], separators=(',', ':'), sort_keys=True)
+
+                def tuplas():
+                    return app.json.response(serializacion.filas_a_dicts(
+                        database.obtener_filas_paginadas(limit=limit))).get_data()
+
+                def compacto():
+                    return app.json.response({'columnas': serializacion.filas_a_columnas(
+                        database.obtener_filas_paginadas(limit=limit))}).get_data()
+
+                base = None
+                for nombre, funcion in (('ORM + to_dict + json', orm), ('FilaDato + filas_a_dicts', tuplas),
+                                        ('FilaDato + format=compact', compacto)):
+                    ms, tamano = medir(funcion, repeticiones)
+                    base = base or ms
+                    print(f"{limit:>6} {nombre:<32} {ms:>8.2f} {tamano:>9} {base / ms:>11.1f}x")
+                    database.db.session.remove()
+            database.db.engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Benchmark de lecturas y escrituras concurrentes sobre SQLite por perfil de almacenamiento
+Varios hilos guardan lecturas con guardar_dato_sensor mientras otros consultan como
+los endpoints del panel (página por cursor y conteo por nodo, sin pasar por la caché).
+Compara el perfil 'clasico' (diario de rollback, como antes) con los perfiles WAL.
+
+Uso: python benchmarks/bench_sqlite_concurrencia.py [segundos] [escritores] [lectores]
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+
+import database  # noqa: E402
+
+NODOS = [f'nodo{i}' for i in range(10)]
+
+
+def crear_app(ruta_db, perfil):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{ruta_db}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLITE_PERFIL'] = perfil
+    database.inicializar_db(app)
+    return app
+
+
+def _escritor(app, fin, resultado, semilla):
+    i = semilla
+    with app.app_context():
+        while time.monotonic() < fin:
+            inicio = time.perf_counter()
+            try:
+                database.guardar_dato_sensor(temperatura=20.0 + i % 10, humedad=50.0, node_id=NODOS[i % len(NODOS)],
+                                             lat=4.6, lon=-74.0)
+                resultado['escrituras'] += 1
+                resultado['latencias'].append(time.perf_counter() - inicio)
+            except OperationalError:
+                resultado['bloqueos'] += 1
+            i += 1
+        database.db.session.remove()
+
+
+def _lector(app, fin, resultado, semilla):
+    i = semilla
+    with app.app_context():
+        while time.monotonic() < fin:
+            nodo = NODOS[i % len(NODOS)]
+            try:
+                database.obtener_datos_cursor(limit=50, node_id=nodo)
+                database.contar_registros(node_id=nodo)
+                resultado['lecturas'] += 1
+            except OperationalError:
+                resultado['bloqueos'] += 1
+            database.db.session.remove()
+            i += 1
+
+
+def medir(perfil, segundos, escritores, lectores):
+    with tempfile.TemporaryDirectory() as tmp:
+        app = crear_app(os.path.join(tmp, 'bench.db'), perfil)
+        with app.app_context():
+            database.guardar_datos_sensor_lote([
+                {'node_id': NODOS[i % len(NODOS)], 'temperatura': 20.0, 'humedad': 50.0} for i in range(5000)
+            ])
+            pragmas = database.configuracion_sqlite()
+        resultados = [{'escrituras': 0, 'lecturas': 0, 'bloqueos': 0, 'latencias': []}
+                      for _ in range(escritores + lectores)]
+        fin = time.monotonic() + segundos
+        hilos = [threading.Thread(target=_escritor, args=(app, fin, resultados[i], i)) for i in range(escritores)]
+        hilos += [threading.Thread(target=_lector, args=(app, fin, resultados[escritores + i], i))
+                  for i in range(lectores)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        with app.app_context():
+            database.db.engine.dispose()
+    total = {clave: sum(r[clave] for r in resultados) for clave in ('escrituras', 'lecturas', 'bloqueos')}
+    latencias = sorted(x for r in resultados for x in r['latencias'])
+    total['p95_ms'] = latencias[int(len(latencias) * 0.95)] * 1000 if latencias else 0
+    return total, pragmas
+
+
+def main():
+    segundos = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    escritores = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    lectores = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+    print(f"{segundos:g} s, {escritores} escritores, {lectores} lectores")
+    print(f"{'perfil':<12} {'escrituras/s':>13} {'p95 escr. (ms)':>15} {'lecturas/s':>11} {'bloqueos':>9}  pragmas")
+    for perfil in ('clasico', 'wal', 'wal_seguro'):
+        total, pragmas = medir(perfil, segundos, escritores, lectores)
+        print(f"{perfil:<12} {total['escrituras'] / segundos:>13.0f} {total['p95_ms']:>15.1f} "
+              f"{total['lecturas'] / segundos:>11.0f} "
+              f"{total['bloqueos']:>9}  {pragmas['journal_mode']}/sync={pragmas['synchronous']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Benchmark del contenido de la página principal con muchos nodos
+Compara consultas y milisegundos por vista de:
+  - el cálculo antiguo de "/" (obtener_campos_nodo + obtener_ultima_ubicacion por nodo)
+  - construir_tablero() con las cachés vacías (resumen de nodos desde estado_nodo)
+  - ResumenTablero.obtener() ya armado para la versión actual
+  - GET / y GET /api/dashboard con el cliente de pruebas
+
+Uso: python benchmarks/bench_tablero.py [nodos] [lecturas_por_nodo] [repeticiones]
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def medir(funcion, repeticiones, consultas):
+    antes = consultas[0]
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        funcion()
+    return (time.perf_counter() - inicio) / repeticiones * 1000, (consultas[0] - antes) / repeticiones
+
+
+def main():
+    nodos = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    por_nodo = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    repeticiones = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['AGROLINK_DATABASE_URL'] = f"sqlite:///{os.path.join(tmp, 'tablero.db')}"
+        os.environ['AGROLINK_DIFUSION_VENTANA_MS'] = '0'
+        os.environ['AGROLINK_RETENCION_INTERVALO'] = '0'
+        from sqlalchemy import event
+        from app import app, resumen_tablero
+        import database
+        import tablero
+
+        consultas = [0]
+        with app.app_context():
+            database.guardar_datos_sensor_lote([
+                {'node_id': f'nodo{i % nodos:04d}', 'temperatura': 20.0, 'humedad': 50.0 if i % 2 else None,
+                 'light': 300.0 if i % 3 == 0 else None, 'lat': 4.6 + i % nodos * 1e-4, 'lon': -74.08}
+                for i in range(nodos * por_nodo)
+            ])
+            event.listen(database.db.engine, 'before_cursor_execute',
+                         lambda *_: consultas.__setitem__(0, consultas[0] + 1))
+
+            def antiguo():
+                # Lo que hacía "/" antes del resumen por nodo: dos consultas por nodo
+                for node_id in database.obtener_nodos_unicos():
+                    tablero.etiquetas_sensores(database.obtener_campos_nodo(node_id))
+                    database.obtener_ultima_ubicacion(node_id)
+
+            def en_frio():
+                database.cache.invalidar()
+                tablero.construir_tablero()
+
+            print(f"{nodos} nodos, {nodos * por_nodo} lecturas")
+            print(f"{'camino':<40} {'ms/vista':>10} {'consultas':>10}")
+            for nombre, funcion in (('por nodo (antiguo)', antiguo),
+                                    ('construir_tablero, cachés vacías', en_frio),
+                                    ('ResumenTablero.obtener, armado', resumen_tablero.obtener)):
+                ms, n = medir(funcion, repeticiones, consultas)
+                print(f"{nombre:<40} {ms:>10.2f} {n:>10.1f}")
+                database.db.session.remove()
+
+        cliente = app.test_client()
+        for nombre, url in (('GET / (página completa)', '/'), ('GET /api/dashboard', '/api/dashboard')):
+            ms, n = medir(lambda: cliente.get(url), repeticiones, consultas)
+            print(f"{nombre:<40} {ms:>10.2f} {n:>10.1f}")
+        with app.app_context():
+            database.db.engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Verifica que las consultas frecuentes de database.py usen índices
+Ejecuta cada función de lectura sobre una base SQLite temporal, captura el SQL que
+emite y revisa su EXPLAIN QUERY PLAN: falla si hay un recorrido completo de
+datos_sensor sin índice o un ordenamiento temporal (USE TEMP B-TREE). Las consultas
+espaciales ordenan lo que cae en varios rangos de geohash, así que en ellas (y en el
+trayecto de un nodo) se exige que alguna de sus sentencias recorra el índice esperado
+y ninguna la tabla entera.
+
+Uso: python benchmarks/planes_consulta.py
+"""
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+import database  # noqa: E402
+
+
+def crear_app(ruta_db):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{ruta_db}'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    database.inicializar_db(app)
+    return app
+
+
+CONSULTAS = {
+    'obtener_ultimo_dato': lambda: database.obtener_ultimo_dato(node_id='nodo1'),
+    'obtener_datos_paginados': lambda: database.obtener_datos_paginados(limit=100, offset=0, node_id='nodo1'),
+    'obtener_campos_nodo': lambda: database.obtener_campos_nodo('nodo1'),
+    'obtener_ultima_ubicacion': lambda: database.obtener_ultima_ubicacion('nodo1'),
+    'obtener_datos_cursor': lambda: database.obtener_datos_cursor(
+        limit=20, cursor=database.obtener_datos_cursor(limit=20, node_id='nodo1')[1], node_id='nodo1'),
+    'contar_registros': lambda: database.contar_registros(node_id='nodo1'),
+    'obtener_todos_datos': lambda: database.obtener_todos_datos(limit=100),
+    'obtener_nodos_unicos': lambda: database.obtener_nodos_unicos(),
+}
+
+# Consulta -> índice que debe usar
+CONSULTAS_ESPACIALES = {
+    'obtener_nodos_en_area': (lambda: database.obtener_nodos_en_area(4.5, -74.1, 4.7, -73.9),
+                              'ix_estado_nodo_geohash'),
+    'obtener_lecturas_en_radio': (lambda: database.obtener_lecturas_en_radio(4.6, -74.0, 500, limit=50),
+                                  'ix_datos_sensor_geohash'),
+    'obtener_trayecto': (lambda: database.obtener_trayecto('campo7', datetime(2000, 1, 1), None, zoom=14),
+                         'ix_trayecto_nodo_fecha'),
+}
+
+TABLAS_ESPACIALES = ('datos_sensor', 'estado_nodo', 'trayecto_nodo')
+
+
+def capturar_sql(consulta, tablas):
+    """SELECT sobre alguna de las tablas que emite consulta(), con sus parámetros."""
+    capturadas = []
+
+    def capturar(conn, cursor, sql, parametros, context, executemany):
+        if any(t in sql for t in tablas) and sql.lstrip().upper().startswith('SELECT'):
+            capturadas.append((sql, parametros))
+
+    event.listen(database.db.engine, 'before_cursor_execute', capturar)
+    try:
+        consulta()
+    finally:
+        event.remove(database.db.engine, 'before_cursor_execute', capturar)
+    return capturadas
+
+
+def main():
+    fallos = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        app = crear_app(os.path.join(tmp, 'planes.db'))
+        with app.app_context():
+            database.guardar_datos_sensor_lote([
+                {'node_id': f'nodo{i % 5}', 'temperatura': 20.0 + i % 7, 'lat': 4.6 if i % 3 else None, 'lon': -74.0}
+                for i in range(500)
+            ])
+            # Nodos repartidos por una zona, para que estado_nodo no sea trivial de recorrer
+            database.guardar_datos_sensor_lote([
+                {'node_id': f'campo{i}', 'lat': 4.0 + (i // 30) * 0.1, 'lon': -75.0 + (i % 30) * 0.1}
+                for i in range(600)
+            ])
+            database.db.session.execute(database.text('ANALYZE'))
+            for nombre, consulta in CONSULTAS.items():
+                for sql, parametros in capturar_sql(consulta, ('datos_sensor',)):
+                    plan = database.explicar_consulta(sql, parametros)
+                    # SCAN ... USING INDEX es aceptable (recorre el índice en orden y corta en el LIMIT)
+                    malo = [p for p in plan if p == 'SCAN datos_sensor' or 'TEMP B-TREE' in p]
+                    estado = 'FALLA' if malo else 'ok'
+                    fallos += bool(malo)
+                    print(f"[{estado}] {nombre}: {' | '.join(plan)}")
+            for nombre, (consulta, indice) in CONSULTAS_ESPACIALES.items():
+                planes = [database.explicar_consulta(sql, parametros)
+                          for sql, parametros in capturar_sql(consulta, TABLAS_ESPACIALES)]
+                malo = not any(indice in p for plan in planes for p in plan) or \
+                    any(p in [f'SCAN {t}' for t in TABLAS_ESPACIALES] for plan in planes for p in plan)
+                fallos += malo
+                for plan in planes:
+                    print(f"[{'FALLA' if malo else 'ok'}] {nombre}: {' | '.join(plan)}")
+    if fallos:
+        print(f"{fallos} consulta(s) sin índice")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
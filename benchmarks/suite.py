@@ -0,0 +1,479 @@
+"""
+Suite de benchmarks de ingesta y consultas de AgroLink con flotas sintéticas
+Genera una flota (nodos, campos por nodo, lecturas por segundo, deriva de GPS), llena
+datos_sensor hasta cada escala pedida y en cada una mide con el cliente de pruebas de Flask:
+  - ingesta: POST /datos (y /datos/batch) desde varios hilos, lecturas/s y latencia p50/p99
+  - difusión: dashboards de Socket.IO simulados (test_client), costo de conectar y de
+    emitir cada lectura a N clientes
+  - páginas: /, /ver, /nodo/<id>, /api/datos y /api/dashboard con las cachés frías y calientes
+El resultado se guarda en JSON (benchmarks/resultados/ por defecto) con el commit y el
+entorno, para comparar entre commits:
+
+    python benchmarks/suite.py ejecutar --filas 10000,1000000,10000000
+    python benchmarks/suite.py ejecutar --nodos 50 --filas 10000 --salida base.json
+    python benchmarks/suite.py comparar base.json nuevo.json
+
+Las variables AGROLINK_* del entorno se respetan (p. ej. AGROLINK_INGESTA_ASINCRONA=1);
+por defecto la difusión es inmediata (AGROLINK_DIFUSION_VENTANA_MS=0) para medir su costo
+dentro de cada petición.
+"""
+import contextlib
+import json
+import math
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import click
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+CAMPOS = ('temperatura', 'humedad', 'soil_moisture', 'light', 'percentage')
+# Valor inicial y paso máximo del paseo aleatorio de cada campo
+_RANGOS = {
+    'temperatura': (22.0, 0.3),
+    'humedad': (60.0, 1.0),
+    'soil_moisture': (40.0, 0.5),
+    'light': (500.0, 25.0),
+    'percentage': (50.0, 2.0),
+}
+# Metros por grado de latitud
+_METROS_GRADO = 111320.0
+
+
+class Flota:
+    """
+    Flota sintética de nodos
+
+    Cada nodo mide campos_por_nodo campos (rotando sobre CAMPOS para que haya variedad),
+    una fracción con_gps envía ubicación con una deriva de jitter_m metros alrededor de
+    su posición, y la flota completa produce lecturas_por_segundo lecturas.
+    """
+
+    def __init__(self, nodos=100, campos_por_nodo=2, lecturas_por_segundo=50.0, jitter_m=5.0, con_gps=0.5,
+                 semilla=7):
+        self.nodos = nodos
+        self.campos_por_nodo = max(1, min(campos_por_nodo, len(CAMPOS)))
+        self.lecturas_por_segundo = lecturas_por_segundo
+        self.jitter_m = jitter_m
+        self.con_gps = con_gps
+        aleatorio = random.Random(semilla)
+        self._campos = [tuple(CAMPOS[(i + k) % len(CAMPOS)] for k in range(self.campos_por_nodo))
+                        for i in range(nodos)]
+        self._gps = [aleatorio.random() < con_gps for _ in range(nodos)]
+        self._posiciones = [(4.66 + aleatorio.uniform(-0.01, 0.01), -74.06 + aleatorio.uniform(-0.01, 0.01))
+                            for _ in range(nodos)]
+        self._semilla = semilla
+
+    def node_id(self, i):
+        return f'nodo-{i % self.nodos:04d}'
+
+    def parametros(self):
+        return {
+            'nodos': self.nodos,
+            'campos_por_nodo': self.campos_por_nodo,
+            'lecturas_por_segundo': self.lecturas_por_segundo,
+            'jitter_m': self.jitter_m,
+            'con_gps': self.con_gps,
+            'semilla': self._semilla
+        }
+
+    def lecturas(self, desde, cantidad, aleatorio=None):
+        """
+        Lecturas desde la número desde (la lectura i es del nodo i % nodos)
+
+        Returns:
+            list: dicts con nodeId, los campos del nodo y lat/lon si tiene GPS
+        """
+        aleatorio = aleatorio or random.Random(self._semilla + desde)
+        jitter = self.jitter_m / _METROS_GRADO
+        resultado = []
+        for i in range(desde, desde + cantidad):
+            nodo = i % self.nodos
+            lectura = {'nodeId': self.node_id(nodo)}
+            for campo in self._campos[nodo]:
+                base, paso = _RANGOS[campo]
+                lectura[campo] = round(base + aleatorio.uniform(-10, 10) * paso, 2)
+            if self._gps[nodo]:
+                lat, lon = self._posiciones[nodo]
+                lectura['lat'] = round(lat + aleatorio.gauss(0, jitter), 7)
+                lectura['lon'] = round(lon + aleatorio.gauss(0, jitter), 7)
+            resultado.append(lectura)
+        return resultado
+
+
+# ==================== Utilidades ====================
+
+def percentil(valores, p):
+    """Percentil p (0-100) por rango más cercano de una lista ya ordenada."""
+    if not valores:
+        return 0.0
+    return valores[min(len(valores) - 1, max(0, math.ceil(p / 100 * len(valores)) - 1))]
+
+
+def resumen_latencias(segundos):
+    """p50, p99 y máximo en milisegundos."""
+    valores = sorted(segundos)
+    return {
+        'p50_ms': round(percentil(valores, 50) * 1000, 3),
+        'p99_ms': round(percentil(valores, 99) * 1000, 3),
+        'max_ms': round((valores[-1] if valores else 0) * 1000, 3)
+    }
+
+
+@contextlib.contextmanager
+def silencio():
+    """Descarta lo que imprimen las rutas (mensajes de depuración) mientras se mide."""
+    with open(os.devnull, 'w') as nulo, contextlib.redirect_stdout(nulo):
+        yield
+
+
+def _git(*args):
+    try:
+        return subprocess.run(['git', *args], cwd=RAIZ, capture_output=True, text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def entorno():
+    """Commit, rama y máquina donde se ejecutó la suite."""
+    return {
+        'commit': _git('rev-parse', 'HEAD'),
+        'rama': _git('rev-parse', '--abbrev-ref', 'HEAD'),
+        'cambios_sin_commit': bool(_git('status', '--porcelain', '--untracked-files=no')),
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'cpus': os.cpu_count(),
+        'sqlite': sqlite3.sqlite_version,
+        'variables': {k: v for k, v in sorted(os.environ.items()) if k.startswith('AGROLINK_')}
+    }
+
+
+# ==================== Carga de datos ====================
+
+# Todas las filas del INSERT llevan las mismas columnas (executemany)
+_COLUMNAS_LECTURA = ('nodeId',) + CAMPOS + ('lat', 'lon', 'geohash')
+
+
+def poblar(database, flota, hasta, inicio, tamano_lote=50000):
+    """
+    Agrega filas a datos_sensor (INSERT directo, sin pasar por la ingesta) hasta tener hasta filas
+
+    Las fechas van de inicio en adelante al ritmo de la flota. Después reconstruye el estado
+    por nodo, los resúmenes y las estadísticas como lo haría la ingesta.
+
+    Returns:
+        float: segundos que tomó
+    """
+    from sqlalchemy import func, insert, select
+    import geo
+    tabla = database.DatosSensor.__table__
+    actuales = database.db.session.execute(select(func.count()).select_from(tabla)).scalar()
+    if actuales >= hasta:
+        return 0.0
+    comienzo = time.perf_counter()
+    paso = 1.0 / flota.lecturas_por_segundo
+    aleatorio = random.Random(actuales)
+    for desde in range(actuales, hasta, tamano_lote):
+        filas = []
+        for i, lectura in enumerate(flota.lecturas(desde, min(tamano_lote, hasta - desde), aleatorio), start=desde):
+            fila = dict.fromkeys(_COLUMNAS_LECTURA)
+            fila.update(lectura)
+            if fila['lat'] is not None and fila['lon'] is not None:
+                fila['geohash'] = geo.geohash(fila['lat'], fila['lon'])
+            fila['fecha_creacion'] = inicio + timedelta(seconds=i * paso)
+            fila['timestamp'] = int(fila['fecha_creacion'].replace(tzinfo=timezone.utc).timestamp())
+            filas.append(fila)
+        database.db.session.execute(insert(tabla), filas)
+        database.db.session.commit()
+    database.reconstruir_estado_nodos()
+    database.reconstruir_resumenes()
+    database.reconstruir_estadisticas()
+    return time.perf_counter() - comienzo
+
+
+# ==================== Mediciones ====================
+
+def medir_ingesta(app, flota, lecturas, hilos, lote=1, desde=0):
+    """
+    POST /datos (lote=1) o /datos/batch (lote>1) desde varios hilos con su propio cliente
+
+    Returns:
+        dict: lecturas/s, peticiones/s, latencias por petición y errores
+    """
+    pendientes = [flota.lecturas(desde + i, lote) for i in range(0, lecturas, lote)]
+    latencias = [[] for _ in range(hilos)]
+    errores = [0] * hilos
+
+    def trabajar(n):
+        cliente = app.test_client()
+        for cuerpo in pendientes[n::hilos]:
+            inicio = time.perf_counter()
+            if lote == 1:
+                r = cliente.post('/datos', json=cuerpo[0])
+            else:
+                r = cliente.post('/datos/batch', json=cuerpo)
+            latencias[n].append(time.perf_counter() - inicio)
+            if r.status_code not in (200, 202):
+                errores[n] += 1
+
+    trabajadores = [threading.Thread(target=trabajar, args=(n,)) for n in range(hilos)]
+    inicio = time.perf_counter()
+    with silencio():
+        for t in trabajadores:
+            t.start()
+        for t in trabajadores:
+            t.join()
+    segundos = time.perf_counter() - inicio
+    peticiones = len(pendientes)
+    return {
+        'lecturas': lecturas,
+        'hilos': hilos,
+        'lote': lote,
+        'segundos': round(segundos, 3),
+        'lecturas_por_segundo': round(lecturas / segundos, 1),
+        'peticiones_por_segundo': round(peticiones / segundos, 1),
+        'errores': sum(errores),
+        **resumen_latencias([x for lista in latencias for x in lista])
+    }
+
+
+def medir_difusion(app, socketio, flota, clientes, lecturas, desde=0):
+    """
+    Abre dashboards simulados y mide cuánto cuesta cada POST /datos con ellos conectados
+
+    La mitad de los dashboards se suscribe a un nodo (como /nodo/<id>) y el resto queda
+    en la sala general (como / y /ver).
+
+    Returns:
+        list: por cantidad de clientes, latencia de conexión, de ingesta y mensajes entregados
+    """
+    resultados = []
+    base_ms = None
+    cliente_http = app.test_client()
+    for n in clientes:
+        conexiones = []
+        tiempos_conexion = []
+        with silencio():
+            for i in range(n):
+                inicio = time.perf_counter()
+                dashboard = socketio.test_client(app)
+                if i % 2:
+                    dashboard.emit('suscribir', {'nodeId': flota.node_id(i)})
+                tiempos_conexion.append(time.perf_counter() - inicio)
+                dashboard.get_received()
+                conexiones.append(dashboard)
+            latencias = []
+            for lectura in flota.lecturas(desde, lecturas):
+                inicio = time.perf_counter()
+                cliente_http.post('/datos', json=lectura)
+                latencias.append(time.perf_counter() - inicio)
+            desde += lecturas
+            entregados = sum(len(d.get_received()) for d in conexiones)
+            for dashboard in conexiones:
+                dashboard.disconnect()
+        latencia = resumen_latencias(latencias)
+        medio_ms = sum(latencias) / len(latencias) * 1000
+        # La mediana es más estable que la media frente a checkpoints y recolecciones de basura
+        base_ms = latencia['p50_ms'] if base_ms is None else base_ms
+        resultados.append({
+            'clientes': n,
+            'conexion': resumen_latencias(tiempos_conexion) if n else None,
+            'ingesta': latencia,
+            'ingesta_media_ms': round(medio_ms, 3),
+            'mensajes_entregados': entregados,
+            'mensajes_por_lectura': round(entregados / lecturas, 2),
+            # Costo adicional de emitir a los clientes, repartido por mensaje entregado
+            'costo_por_mensaje_us': round((latencia['p50_ms'] - base_ms) * 1000 / (entregados / lecturas), 2)
+            if entregados else None
+        })
+    return resultados
+
+
+def medir_paginas(app, flota, repeticiones):
+    """
+    Tiempo de respuesta de las páginas y APIs de lectura
+
+    caliente: cachés cargadas (lo normal entre dos escrituras); frio: antes de cada petición
+    se vacía la caché de lecturas y sube la versión de los datos (lo que pasa tras una escritura
+    en otro proceso, o la primera visita).
+    """
+    import database
+    rutas = ('/', '/ver', f'/nodo/{flota.node_id(0)}', '/api/datos?limit=100', '/api/dashboard')
+    cliente = app.test_client()
+    resultado = {}
+    with silencio():
+        for ruta in rutas:
+            medidas = {}
+            for modo in ('frio', 'caliente'):
+                tiempos = []
+                tamano = 0
+                for _ in range(repeticiones):
+                    if modo == 'frio':
+                        database.cache.invalidar()
+                        database.version_datos.incrementar()
+                    inicio = time.perf_counter()
+                    r = cliente.get(ruta)
+                    tiempos.append(time.perf_counter() - inicio)
+                    tamano = len(r.data)
+                medidas[modo] = {**resumen_latencias(tiempos), 'bytes': tamano, 'status': r.status_code}
+            resultado[ruta] = medidas
+    return resultado
+
+
+# ==================== Comandos ====================
+
+@click.group()
+def cli():
+    """Benchmarks de AgroLink."""
+
+
+@cli.command()
+@click.option('--nodos', default=100, show_default=True, help='Nodos de la flota.')
+@click.option('--campos', 'campos_por_nodo', default=2, show_default=True, help='Campos que mide cada nodo (1-5).')
+@click.option('--ritmo', 'lecturas_por_segundo', default=50.0, show_default=True,
+              help='Lecturas por segundo de toda la flota (espaciado de las fechas al llenar).')
+@click.option('--jitter', 'jitter_m', default=5.0, show_default=True, help='Deriva del GPS en metros.')
+@click.option('--con-gps', default=0.5, show_default=True, help='Fracción de nodos que envían ubicación.')
+@click.option('--filas', default='10000,1000000,10000000', show_default=True,
+              help='Escalas de datos_sensor a medir, separadas por comas.')
+@click.option('--lecturas', default=2000, show_default=True, help='Lecturas enviadas por POST en cada escala.')
+@click.option('--hilos', default=4, show_default=True, help='Hilos que envían a /datos.')
+@click.option('--lote', default=100, show_default=True, help='Tamaño de lote para /datos/batch (0 = no medir).')
+@click.option('--clientes', default='0,10,100', show_default=True,
+              help='Dashboards de Socket.IO simulados, separados por comas (el primero es la base).')
+@click.option('--lecturas-difusion', default=200, show_default=True, help='Lecturas por cantidad de clientes.')
+@click.option('--repeticiones', default=20, show_default=True, help='Peticiones por página y modo.')
+@click.option('--db', 'ruta_db', default=None,
+              help='Base SQLite a usar (se reutiliza si ya tiene filas; por defecto una temporal).')
+@click.option('--salida', default=None, help='Archivo JSON de resultados (por defecto benchmarks/resultados/).')
+@click.option('--semilla', default=7, show_default=True)
+def ejecutar(nodos, campos_por_nodo, lecturas_por_segundo, jitter_m, con_gps, filas, lecturas, hilos, lote,
+             clientes, lecturas_difusion, repeticiones, ruta_db, salida, semilla):
+    """Llena la base hasta cada escala y mide ingesta, difusión y páginas."""
+    escalas = sorted(int(x) for x in filas.split(',') if x.strip())
+    cantidades_clientes = [int(x) for x in clientes.split(',') if x.strip()]
+    flota = Flota(nodos, campos_por_nodo, lecturas_por_segundo, jitter_m, con_gps, semilla)
+    with tempfile.TemporaryDirectory() as tmp:
+        ruta_db = os.path.abspath(ruta_db) if ruta_db else os.path.join(tmp, 'suite.db')
+        os.environ['AGROLINK_DATABASE_URL'] = f'sqlite:///{ruta_db}'
+        os.environ.setdefault('AGROLINK_DIFUSION_VENTANA_MS', '0')
+        os.environ.setdefault('AGROLINK_RETENCION_INTERVALO', '0')
+        with silencio():
+            from app import app, socketio
+            import database
+
+        resultado = {
+            'suite': 'agrolink',
+            'formato': 1,
+            'fecha': datetime.now().isoformat(timespec='seconds'),
+            'entorno': entorno(),
+            'parametros': {
+                'flota': flota.parametros(),
+                'lecturas': lecturas, 'hilos': hilos, 'lote': lote, 'clientes': cantidades_clientes,
+                'lecturas_difusion': lecturas_difusion, 'repeticiones': repeticiones
+            },
+            'escalas': []
+        }
+        # Las fechas terminan cerca de ahora, como en una instalación en uso
+        inicio = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=escalas[-1] / lecturas_por_segundo) if escalas else None
+        enviadas = 0
+        for escala in escalas:
+            click.echo(f'== {escala} filas')
+            with app.app_context():
+                llenado = poblar(database, flota, escala, inicio)
+                total = database.contar_registros()
+            click.echo(f'   base llena ({total} filas, {llenado:.1f} s)')
+            medidas = {'filas': escala, 'filas_reales': total, 'segundos_llenado': round(llenado, 1)}
+
+            medidas['ingesta'] = medir_ingesta(app, flota, lecturas, hilos, desde=enviadas)
+            enviadas += lecturas
+            click.echo(f"   POST /datos: {medidas['ingesta']['lecturas_por_segundo']} lecturas/s, "
+                       f"p50 {medidas['ingesta']['p50_ms']} ms, p99 {medidas['ingesta']['p99_ms']} ms")
+            if lote > 1:
+                medidas['ingesta_lote'] = medir_ingesta(app, flota, lecturas, hilos, lote=lote, desde=enviadas)
+                enviadas += lecturas
+                click.echo(f"   POST /datos/batch ({lote}): {medidas['ingesta_lote']['lecturas_por_segundo']} "
+                           f"lecturas/s, p99 {medidas['ingesta_lote']['p99_ms']} ms")
+
+            medidas['difusion'] = medir_difusion(app, socketio, flota, cantidades_clientes, lecturas_difusion,
+                                                 desde=enviadas)
+            enviadas += lecturas_difusion * len(cantidades_clientes)
+            for d in medidas['difusion']:
+                click.echo(f"   {d['clientes']:>4} dashboards: ingesta media {d['ingesta_media_ms']} ms, "
+                           f"{d['mensajes_por_lectura']} mensajes/lectura, "
+                           f"{d['costo_por_mensaje_us']} µs/mensaje")
+
+            medidas['paginas'] = medir_paginas(app, flota, repeticiones)
+            for ruta, m in medidas['paginas'].items():
+                click.echo(f"   GET {ruta:<22} frío p50 {m['frio']['p50_ms']:>8} ms  "
+                           f"caliente p50 {m['caliente']['p50_ms']:>8} ms  ({m['caliente']['bytes']} bytes)")
+            resultado['escalas'].append(medidas)
+        with app.app_context():
+            database.db.session.remove()
+            database.db.engine.dispose()
+
+    if not salida:
+        directorio = os.path.join(RAIZ, 'benchmarks', 'resultados')
+        os.makedirs(directorio, exist_ok=True)
+        commit = (resultado['entorno']['commit'] or 'sin-git')[:10]
+        salida = os.path.join(directorio, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{commit}.json")
+    with open(salida, 'w', encoding='utf-8') as f:
+        json.dump(resultado, f, indent=2, ensure_ascii=False)
+    click.echo(f'Resultados en {salida}')
+
+
+# Claves que son parámetros de la medición, no resultados
+_PARAMETROS = frozenset(('lecturas', 'hilos', 'lote', 'segundos', 'status', 'clientes'))
+
+
+def _aplanar(valor, prefijo=''):
+    """{ruta.de.claves: número} de las hojas numéricas de un resultado."""
+    if isinstance(valor, dict):
+        for clave, v in valor.items():
+            yield from _aplanar(v, f'{prefijo}.{clave}' if prefijo else str(clave))
+    elif isinstance(valor, list):
+        for i, v in enumerate(valor):
+            # Las listas de difusión se identifican por la cantidad de clientes
+            clave = f"clientes={v['clientes']}" if isinstance(v, dict) and 'clientes' in v else str(i)
+            yield from _aplanar(v, f'{prefijo}[{clave}]')
+    elif isinstance(valor, (int, float)) and not isinstance(valor, bool):
+        yield prefijo, valor
+
+
+@cli.command()
+@click.argument('base', type=click.File(encoding='utf-8'))
+@click.argument('nuevo', type=click.File(encoding='utf-8'))
+@click.option('--umbral', default=5.0, show_default=True, help='Solo mostrar cambios mayores a este porcentaje.')
+def comparar(base, nuevo, umbral):
+    """Compara dos resultados JSON escala por escala (cambio porcentual de cada medida)."""
+    a, b = json.load(base), json.load(nuevo)
+    click.echo(f"base:  {a['entorno'].get('commit')} ({a['fecha']})")
+    click.echo(f"nuevo: {b['entorno'].get('commit')} ({b['fecha']})")
+    escalas_b = {e['filas']: e for e in b['escalas']}
+    for escala in a['escalas']:
+        otra = escalas_b.get(escala['filas'])
+        if otra is None:
+            continue
+        click.echo(f"== {escala['filas']} filas")
+        valores_b = dict(_aplanar(otra))
+        for clave, valor_a in _aplanar(escala):
+            valor_b = valores_b.get(clave)
+            if valor_b is None or clave.startswith(('filas', 'segundos_llenado')) or \
+                    clave.rsplit('.', 1)[-1] in _PARAMETROS:
+                continue
+            cambio = (valor_b - valor_a) / valor_a * 100 if valor_a else 0.0
+            if abs(cambio) >= umbral:
+                click.echo(f"   {clave:<60} {valor_a:>12g} -> {valor_b:<12g} {cambio:+7.1f}%")
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,136 @@
+"""
+Verifica las respuestas condicionales y comprimidas de app.py con el cliente de pruebas de Flask
+Sobre una base SQLite temporal comprueba que:
+  - /api/datos y las páginas llevan ETag y Last-Modified y responden 304 mientras no hay escrituras
+  - Last-Modified no se envía hasta que termina el segundo de la última escritura (otra
+    escritura en ese segundo no cambiaría la fecha y If-Modified-Since daría un 304 viejo)
+  - guardar una lectura o eliminarla cambia el ETag (200 con el contenido nuevo)
+  - el JSON se comprime con gzip (o brotli si está instalado) y se descomprime igual
+  - los estáticos llevan ?v= en la URL y Cache-Control con max-age largo
+y mide cuánto tarda una petición que regenera la respuesta frente a una que acaba en 304.
+
+Uso: python benchmarks/verificar_cache_http.py [lecturas] [repeticiones]
+"""
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def comprobar(condicion, mensaje, fallos):
+    print(f"  [{'ok' if condicion else 'FALLA'}] {mensaje}")
+    if not condicion:
+        fallos.append(mensaje)
+
+
+def medir(cliente, url, cabeceras, repeticiones):
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        cliente.get(url, headers=cabeceras)
+    return (time.perf_counter() - inicio) / repeticiones * 1000
+
+
+def main():
+    lecturas = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    repeticiones = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    fallos = []
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['AGROLINK_DATABASE_URL'] = f"sqlite:///{os.path.join(tmp, 'http.db')}"
+        os.environ['AGROLINK_DIFUSION_VENTANA_MS'] = '0'
+        os.environ['AGROLINK_RETENCION_INTERVALO'] = '0'
+        # Sin caché de recientes: sin 304 cada petición consulta la base de datos
+        os.environ['AGROLINK_CACHE_MAX_RECIENTES'] = '0'
+        from app import app
+        import database
+        import respuestas
+
+        with app.app_context():
+            database.guardar_datos_sensor_lote([
+                {'node_id': f'nodo{i % 10}', 'temperatura': 20.0 + i % 7, 'humedad': 60.0,
+                 'lat': 4.6, 'lon': -74.0, 'timestamp': 1700000000 + i}
+                for i in range(lecturas)
+            ])
+        cliente = app.test_client()
+        url = '/api/datos?limit=500'
+
+        # Escribir al principio de un segundo: la respuesta inmediata cae en el mismo segundo
+        time.sleep(1 - time.time() % 1)
+        with app.app_context():
+            database.guardar_dato_sensor(temperatura=21.0, node_id='nodo1')
+        inmediata = cliente.get(url)
+        comprobar(inmediata.status_code == 200 and inmediata.headers.get('ETag')
+                  and 'Last-Modified' not in inmediata.headers,
+                  'sin Last-Modified en el mismo segundo de la escritura', fallos)
+        time.sleep(1.1)
+        primera = cliente.get(url)
+        etag = primera.headers.get('ETag')
+        comprobar(primera.status_code == 200 and etag and primera.headers.get('Last-Modified'),
+                  'la primera respuesta lleva ETag y Last-Modified', fallos)
+        segunda = cliente.get(url, headers={'If-None-Match': etag})
+        comprobar(segunda.status_code == 304 and not segunda.data, '304 sin cuerpo con el mismo ETag', fallos)
+        por_fecha = cliente.get(url, headers={'If-Modified-Since': primera.headers['Last-Modified']})
+        comprobar(por_fecha.status_code == 304, '304 con If-Modified-Since', fallos)
+        # Sin el resumen del tablero, / sale como esqueleto sin ETag; /api/dashboard lo arma
+        esqueleto = cliente.get('/')
+        comprobar(esqueleto.status_code == 200 and 'ETag' not in esqueleto.headers
+                  and esqueleto.cache_control.no_store, '/: el esqueleto sale sin ETag (no-store)', fallos)
+        cliente.get('/api/dashboard')
+        for pagina in ('/', '/ver', '/nodo/nodo1'):
+            r = cliente.get(pagina)
+            r2 = cliente.get(pagina, headers={'If-None-Match': r.headers.get('ETag', '')})
+            comprobar(r.status_code == 200 and r2.status_code == 304, f'{pagina}: 200 y luego 304', fallos)
+
+        with app.app_context():
+            nuevo = database.guardar_dato_sensor(temperatura=99.0, node_id='nodo1')
+            nuevo_id = nuevo.id
+        tras_guardar = cliente.get(url, headers={'If-None-Match': etag})
+        comprobar(tras_guardar.status_code == 200 and tras_guardar.headers['ETag'] != etag
+                  and tras_guardar.get_json()[0]['id'] == nuevo_id,
+                  'guardar_dato_sensor cambia el ETag y la respuesta trae la lectura nueva', fallos)
+        etag = tras_guardar.headers['ETag']
+        with app.app_context():
+            database.eliminar_dato(nuevo_id)
+        tras_eliminar = cliente.get(url, headers={'If-None-Match': etag})
+        comprobar(tras_eliminar.status_code == 200 and tras_eliminar.get_json()[0]['id'] != nuevo_id,
+                  'eliminar_dato cambia el ETag', fallos)
+
+        sin_comprimir = cliente.get(url)
+        comprimida = cliente.get(url, headers={'Accept-Encoding': 'gzip'})
+        comprobar(comprimida.headers.get('Content-Encoding') == 'gzip'
+                  and json.loads(gzip.decompress(comprimida.data)) == sin_comprimir.get_json()
+                  and 'Accept-Encoding' in comprimida.headers.get('Vary', ''),
+                  f'gzip: {len(sin_comprimir.data)} -> {len(comprimida.data)} bytes', fallos)
+        if respuestas.brotli is not None:
+            br = cliente.get(url, headers={'Accept-Encoding': 'gzip, br'})
+            comprobar(br.headers.get('Content-Encoding') == 'br'
+                      and json.loads(respuestas.brotli.decompress(br.data)) == sin_comprimir.get_json(),
+                      f'brotli: {len(br.data)} bytes', fallos)
+        else:
+            print('  brotli no instalado: solo gzip')
+
+        with app.test_request_context():
+            from flask import url_for
+            url_css = url_for('static', filename='styles.css')
+        estatico = cliente.get(url_css)
+        comprobar('v=' in url_css and estatico.cache_control.max_age == app.config['SEND_FILE_MAX_AGE_DEFAULT'],
+                  f'{url_css}: max-age={estatico.cache_control.max_age}', fallos)
+        estatico.close()
+
+        etag = cliente.get(url).headers['ETag']
+        ms_200 = medir(cliente, url, {'Accept-Encoding': 'gzip'}, repeticiones)
+        ms_304 = medir(cliente, url, {'If-None-Match': etag}, repeticiones)
+        print(f"  {url}: regenerar {ms_200:.2f} ms, 304 {ms_304:.2f} ms ({ms_200 / ms_304:.1f}x)")
+        with app.app_context():
+            database.db.session.remove()
+            database.db.engine.dispose()
+    if fallos:
+        print(f"{len(fallos)} comprobación(es) fallida(s)")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
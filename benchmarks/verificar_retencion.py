@@ -0,0 +1,183 @@
+"""
+Verifica la retención de database.py sobre una base SQLite temporal
+Genera lecturas repartidas en varios meses, aplica una política (crudos 90 días,
+archivo mensual, minutos 30 días) y comprueba que:
+  - las lecturas vencidas salen de datos_sensor y quedan en datos_sensor_AAAAMM.col/.db
+  - obtener_datos_por_fecha / iterar_datos devuelven lo mismo que antes de archivar,
+    abriendo solo los archivos de los meses que toca el rango
+  - las estadísticas acumuladas siguen coincidiendo con el recálculo, también tras borrar
+    de la tabla viva el máximo de un nodo cuyo mínimo está archivado
+  - borrar una lectura de un día partido por la retención recalcula sus resúmenes con lo archivado
+  - se podan los resúmenes por minuto y el vacuum incremental devuelve páginas al disco
+
+Uso: python benchmarks/verificar_retencion.py [lecturas]
+"""
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+from sqlalchemy import bindparam  # noqa: E402
+
+import database  # noqa: E402
+
+AHORA = datetime(2025, 7, 15, 12, 0, 0)
+DIAS = 240
+
+
+def comprobar(condicion, mensaje, fallos):
+    print(f"  [{'ok' if condicion else 'FALLA'}] {mensaje}")
+    if not condicion:
+        fallos.append(mensaje)
+
+
+def crear_app(tmp, formato):
+    app = Flask(__name__, instance_path=tmp)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tmp, 'retencion.db')}"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['RETENCION_DIAS_CRUDOS'] = 90
+    app.config['RETENCION_DIAS_RESUMEN'] = {'m': 30}
+    app.config['RETENCION_PAGINAS_VACUUM'] = 100000
+    app.config['ARCHIVO_FORMATO'] = formato
+    database.inicializar_db(app)
+    return app
+
+
+def tamano_base(tmp):
+    """Tamaño del archivo principal tras volcar el WAL."""
+    with database.db.engine.connect() as conn:
+        conn.exec_driver_sql('PRAGMA wal_checkpoint(TRUNCATE)')
+    return os.path.getsize(os.path.join(tmp, 'retencion.db'))
+
+
+def poblar(lecturas):
+    """Lecturas repartidas uniformemente en los DIAS anteriores a AHORA."""
+    tabla = database.DatosSensor.__table__
+    paso = timedelta(days=DIAS) / lecturas
+    registros = [{'node_id': f'nodo{i % 5}', 'temperatura': 10.0 + i % 17, 'humedad': None if i % 3 else 55.0}
+                 for i in range(lecturas)]
+    # Un mínimo único en la lectura más antigua (queda archivada), para borrar_extremo_vivo
+    registros[0]['temperatura'] = -5.0
+    guardados = database.guardar_datos_sensor_lote(registros)
+    # Fechas en el pasado (guardar_dato_sensor siempre usa la hora actual)
+    database.db.session.execute(
+        tabla.update().where(tabla.c.id == bindparam('b_id')).values(fecha_creacion=bindparam('b_fecha')),
+        [{'b_id': d.id, 'b_fecha': AHORA - timedelta(days=DIAS) + paso * i} for i, d in enumerate(guardados)]
+    )
+    database.db.session.commit()
+    database.reconstruir_resumenes()
+    database.reconstruir_estadisticas()
+
+
+def borrar_extremo_vivo():
+    """
+    Guarda y borra con eliminar_dato una lectura viva que es el máximo de nodo0: el borrado
+    recalcula min/max, y el mínimo de nodo0 (único, de poblar) ya solo está en el archivo.
+    """
+    dato = database.guardar_dato_sensor(node_id='nodo0', temperatura=99.0)
+    return database.eliminar_dato(dato.id)
+
+
+def borrar_en_corte():
+    """
+    Borra la lectura viva más antigua de nodo1, cuyo día quedó partido por la retención, y
+    compara sus resúmenes por hora y día con los de reconstruir_resumenes (viva + archivo)
+
+    Returns:
+        bool: True si el recálculo tras el borrado coincide con la reconstrucción
+    """
+    dato = database.DatosSensor.query.filter_by(nodeId='nodo1').order_by(
+        database.DatosSensor.fecha_creacion).first()
+    t = database._epoch(dato.fecha_creacion)
+    inicios = {nivel: t - t % database.NIVELES_RESUMEN[nivel] for nivel in ('h', 'd')}
+    database.eliminar_dato(dato.id)
+
+    def resumenes():
+        return sorted((r.nivel, r.campo, r.cantidad, round(r.suma, 6), r.minimo, r.maximo)
+                      for nivel, inicio in inicios.items()
+                      for r in database.ResumenSerie.query.filter_by(nivel=nivel, nodeId='nodo1', inicio=inicio))
+
+    recalculados = resumenes()
+    database.reconstruir_resumenes()
+    return bool(recalculados) and recalculados == resumenes()
+
+
+def verificar(formato, lecturas, fallos):
+    with tempfile.TemporaryDirectory() as tmp:
+        app = crear_app(tmp, formato)
+        with app.app_context():
+            poblar(lecturas)
+            rango = (datetime(2025, 1, 10), datetime(2025, 5, 20))
+            antes = [d.to_dict() for d in database.obtener_datos_por_fecha(*rango)]
+            antes_bloques = [tuple(f) for b in database.iterar_datos(fecha_inicio=rango[0], fecha_fin=rango[1])
+                             for f in b]
+            tamano_antes = tamano_base(tmp)
+
+            resultado = database.aplicar_retencion(AHORA)
+            print(f"  {resultado['filas_archivadas']} filas archivadas, {resultado['resumenes_podados']} "
+                  f"resúmenes podados, {resultado['paginas_liberadas']} páginas liberadas")
+            limite = AHORA - timedelta(days=90)
+            quedan = database.db.session.query(database.func.min(database.DatosSensor.fecha_creacion)).scalar()
+            comprobar(quedan is None or quedan >= limite, 'datos_sensor solo conserva los últimos 90 días', fallos)
+            comprobar(resultado['filas_archivadas'] + database.contar_registros() == lecturas,
+                      'ninguna lectura perdida (archivo + tabla viva)', fallos)
+            archivos = database.particiones_archivadas()
+            comprobar(len(archivos) >= 5, f'{len(archivos)} archivos mensuales', fallos)
+            tocados = database.particiones_archivadas(*rango)
+            comprobar([inicio.month for inicio, _, _ in tocados] == [1, 2, 3, 4],
+                      'el rango solo abre los archivos de ene-abr', fallos)
+            despues = [d.to_dict() for d in database.obtener_datos_por_fecha(*rango)]
+            comprobar(despues == antes, f'obtener_datos_por_fecha igual tras archivar ({len(despues)} filas)', fallos)
+            despues_bloques = [tuple(f) for b in database.iterar_datos(fecha_inicio=rango[0], fecha_fin=rango[1])
+                               for f in b]
+            comprobar(despues_bloques == antes_bloques, 'iterar_datos igual tras archivar', fallos)
+            comprobar(database.verificar_estadisticas() == [], 'estadísticas == recálculo (viva + archivo)', fallos)
+            # min/max se recalculan con lo archivado (si no, se perdería el mínimo archivado)
+            comprobar(borrar_extremo_vivo() and database.verificar_estadisticas() == [],
+                      'estadísticas == recálculo tras borrar el máximo de un nodo de la tabla viva', fallos)
+            estado = database.obtener_resumen_nodos()
+            database.reconstruir_estado_nodos()
+            comprobar({n: e['total_registros'] for n, e in estado.items()} ==
+                      {n: e['total_registros'] for n, e in database.obtener_resumen_nodos().items()},
+                      'conteo por nodo reconstruido incluye lo archivado', fallos)
+            resumen = database.ResumenSerie
+            minutos = resumen.query.filter(
+                resumen.nivel == 'm', resumen.inicio < database._epoch(AHORA - timedelta(days=30))
+            ).count()
+            comprobar(minutos == 0, 'resúmenes por minuto de más de 30 días podados', fallos)
+            comprobar(database.configuracion_sqlite().get('auto_vacuum') == 2, 'auto_vacuum incremental', fallos)
+            tamano_despues = tamano_base(tmp)
+            print(f"  base: {tamano_antes / 1e6:.1f} MB -> {tamano_despues / 1e6:.1f} MB")
+            comprobar(tamano_despues < tamano_antes, 'la base encoge tras el vacuum incremental', fallos)
+
+            # Un borrado en el día que cortó la retención recalcula ese día con la parte archivada
+            comprobar(borrar_en_corte(), 'resúmenes recalculados tras borrar == reconstrucción (viva + archivo)',
+                      fallos)
+            segunda = database.aplicar_retencion(AHORA)
+            comprobar(segunda['filas_archivadas'] == 0, 'una segunda pasada no archiva nada', fallos)
+            borrados = database.eliminar_archivos_vencidos(AHORA - timedelta(days=200))
+            comprobar(len(borrados) >= 1 and len(database.particiones_archivadas()) == len(archivos) - len(borrados),
+                      f'{len(borrados)} archivo(s) vencido(s) borrado(s)', fallos)
+            database.db.session.remove()
+            database.db.engine.dispose()
+        for _, _, ruta in database.particiones_archivadas():
+            if not database._es_columnar(ruta):
+                database._motor_archivo(ruta).dispose()
+
+
+def main():
+    lecturas = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    fallos = []
+    for formato in database.EXTENSIONES_ARCHIVO:
+        print(f'Archivo {formato}')
+        verificar(formato, lecturas, fallos)
+    if fallos:
+        print(f"{len(fallos)} comprobación(es) fallida(s)")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
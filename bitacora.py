@@ -0,0 +1,138 @@
+"""
+Bitácora (logging) de AgroLink
+Todos los módulos escriben en loggers 'agrolink.<módulo>' con niveles en lugar de print:
+los payloads recibidos van en DEBUG (no cuestan nada con el nivel por defecto) y los
+errores en WARNING/ERROR. Cada línea es estructurada (clave=valor o JSON) y un mismo
+mensaje repetido se limita a unas pocas líneas por intervalo, con el número de líneas
+suprimidas en la siguiente que sale.
+
+    log = obtener_logger('app')
+    log.warning('No se pudo emitir por SocketIO', extra=campos(error=str(e)))
+"""
+import json
+import logging
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+RAIZ = 'agrolink'
+FORMATOS = ('texto', 'json')
+
+
+def obtener_logger(modulo):
+    """Logger 'agrolink.<modulo>'; hereda nivel, formato y límite de configurar_bitacora()."""
+    return logging.getLogger(f'{RAIZ}.{modulo}')
+
+
+def campos(**valores):
+    """Campos estructurados para el argumento extra= de un mensaje."""
+    return {'campos': valores}
+
+
+class LimiteRepeticiones(logging.Filter):
+    """
+    Deja pasar como máximo `rafaga` veces cada mensaje por `intervalo` segundos
+
+    El mensaje se identifica por logger, nivel y plantilla (sin los argumentos), así que
+    un error que se repite con cada petición no inunda la salida. La primera línea que
+    sale en el intervalo siguiente lleva el campo 'suprimidos'.
+    """
+
+    def __init__(self, rafaga=10, intervalo=60.0):
+        super().__init__()
+        self.rafaga = rafaga
+        self.intervalo = intervalo
+        self._lock = threading.Lock()
+        self._ventanas = {}  # (logger, nivel, plantilla) -> [inicio, emitidos, suprimidos]
+
+    def filter(self, registro):
+        if self.rafaga <= 0:
+            return True
+        clave = (registro.name, registro.levelno, registro.msg)
+        ahora = time.monotonic()
+        with self._lock:
+            ventana = self._ventanas.get(clave)
+            if ventana is None or ahora - ventana[0] >= self.intervalo:
+                suprimidos = ventana[2] if ventana else 0
+                self._ventanas[clave] = [ahora, 1, 0]
+                if suprimidos:
+                    registro.suprimidos = suprimidos
+                return True
+            if ventana[1] < self.rafaga:
+                ventana[1] += 1
+                return True
+            ventana[2] += 1
+            return False
+
+
+def _campos_registro(registro):
+    valores = dict(getattr(registro, 'campos', None) or {})
+    if getattr(registro, 'suprimidos', 0):
+        valores['suprimidos'] = registro.suprimidos
+    if registro.exc_info:
+        valores['excepcion'] = logging.Formatter().formatException(registro.exc_info)
+    return valores
+
+
+class FormatoTexto(logging.Formatter):
+    """fecha NIVEL logger: mensaje clave=valor ..."""
+
+    def format(self, registro):
+        fecha = datetime.fromtimestamp(registro.created, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3]
+        linea = f"{fecha}Z {registro.levelname} {registro.name}: {registro.getMessage()}"
+        valores = _campos_registro(registro)
+        excepcion = valores.pop('excepcion', None)
+        if valores:
+            linea += ' ' + ' '.join(f'{clave}={_texto_campo(valor)}' for clave, valor in valores.items())
+        if excepcion:
+            linea += '\n' + excepcion
+        return linea
+
+
+def _texto_campo(valor):
+    texto = valor if isinstance(valor, str) else json.dumps(valor, default=str, ensure_ascii=False)
+    return json.dumps(texto, ensure_ascii=False) if (not texto or ' ' in texto or '"' in texto) else texto
+
+
+class FormatoJSON(logging.Formatter):
+    """Un objeto JSON por línea: fecha, nivel, logger, mensaje y los campos del registro."""
+
+    def format(self, registro):
+        linea = {
+            'fecha': datetime.fromtimestamp(registro.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'nivel': registro.levelname,
+            'logger': registro.name,
+            'mensaje': registro.getMessage()
+        }
+        linea.update(_campos_registro(registro))
+        return json.dumps(linea, default=str, ensure_ascii=False)
+
+
+def configurar_bitacora(nivel='INFO', formato='texto', rafaga=10, intervalo=60.0, destino=None):
+    """
+    Configura el logger 'agrolink' (una vez por proceso; llamar de nuevo lo reemplaza)
+
+    Args:
+        nivel: 'DEBUG', 'INFO', 'WARNING' o 'ERROR'
+        formato: 'texto' (clave=valor) o 'json' (una línea JSON por mensaje)
+        rafaga: Máximo de repeticiones de un mismo mensaje por intervalo (0 = sin límite)
+        intervalo: Segundos de la ventana del límite
+        destino: Stream de salida (por defecto sys.stderr)
+
+    Returns:
+        logging.Logger: el logger raíz de AgroLink
+    """
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato de bitácora desconocido: {formato} (usar {', '.join(FORMATOS)})")
+    raiz = logging.getLogger(RAIZ)
+    for manejador in list(raiz.handlers):
+        raiz.removeHandler(manejador)
+    manejador = logging.StreamHandler(destino or sys.stderr)
+    manejador.setFormatter(FormatoJSON() if formato == 'json' else FormatoTexto())
+    manejador.addFilter(LimiteRepeticiones(rafaga, intervalo))
+    raiz.addHandler(manejador)
+    raiz.setLevel(nivel.upper() if isinstance(nivel, str) else nivel)
+    # No duplicar en el logger raíz de Python (werkzeug, engineio, etc. configuran el suyo)
+    raiz.propagate = False
+    return raiz
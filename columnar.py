@@ -0,0 +1,449 @@
+"""
+Formato columnar comprimido para el archivo frío de AgroLink
+Guarda las lecturas archivadas en bloques por nodo y día, columna a columna:
+fechas, ids y timestamps con delta de deltas, y flotantes con XOR al estilo
+Gorilla (un bit si el valor se repite). Los archivos se leen con mmap y solo
+se decodifican los bloques (y columnas) que toca cada consulta.
+
+Estructura de un archivo: una sucesión de bloques, cada uno con
+    cabecera   '<4sHiII': mágico, largo del nodo, día (desde 1970), filas, largo del cuerpo
+    nodo       utf-8 (largo 0xFFFF = nodo nulo)
+    directorio '<BI' por columna: modo (nula, completa, dispersa) y bytes
+    columnas   bits de cada columna; las dispersas empiezan con un mapa de presentes
+Se añade siempre al final: un bloque a medio escribir (corte de luz) se ignora
+al leer y se descarta en la siguiente escritura.
+"""
+import mmap
+import os
+import struct
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+
+MAGICO = b'AGC1'
+
+# Columnas en el orden en que se guardan (nodeId va en la cabecera del bloque)
+COLUMNAS_ENTERAS = ('id', 'fecha_creacion', 'timestamp')
+COLUMNAS_FLOTANTES = ('temperatura', 'humedad', 'soil_moisture', 'light', 'percentage', 'lat', 'lon')
+COLUMNAS = COLUMNAS_ENTERAS + COLUMNAS_FLOTANTES
+
+_CABECERA = struct.Struct('<4sHiII')
+_COLUMNA = struct.Struct('<BI')
+_NODO_NULO = 0xFFFF
+
+# Modos de columna
+_NULA = 0       # Todos los valores nulos: sin datos
+_COMPLETA = 1   # Ningún nulo: solo valores
+_DISPERSA = 2   # Mapa de presentes (un bit por fila) y valores presentes
+
+_EPOCA = datetime(1970, 1, 1)
+_MICRO = timedelta(microseconds=1)
+
+# Delta de deltas: prefijo y bits del valor (zigzag); '0' = igual que el delta anterior
+_CUBETAS_DOD = (('10', 7), ('110', 12), ('1110', 20), ('11110', 32), ('11111', 64))
+
+
+def _zigzag(v):
+    return v * 2 if v >= 0 else -v * 2 - 1
+
+
+def _unzigzag(v):
+    return v // 2 if not v & 1 else -(v + 1) // 2
+
+
+def a_micros(fecha):
+    """datetime sin zona (UTC) -> microsegundos desde 1970."""
+    return (fecha - _EPOCA) // _MICRO
+
+
+def desde_micros(micros):
+    return _EPOCA + timedelta(microseconds=micros)
+
+
+def dia_de(fecha):
+    """Día (desde 1970) de un datetime sin zona."""
+    return (fecha - _EPOCA).days
+
+
+class _EscritorBits:
+    """Acumula campos de bits como texto '0'/'1' y los empaqueta al final (rápido en CPython)."""
+
+    def __init__(self):
+        self._partes = []
+
+    def escribir(self, valor, nbits):
+        if nbits:
+            self._partes.append(format(valor, f'0{nbits}b'))
+
+    def prefijo(self, bits):
+        self._partes.append(bits)
+
+    def a_bytes(self):
+        texto = ''.join(self._partes)
+        if not texto:
+            return b''
+        texto += '0' * (-len(texto) % 8)
+        return int(texto, 2).to_bytes(len(texto) // 8, 'big')
+
+
+class _LectorBits:
+    def __init__(self, datos):
+        self._bits = format(int.from_bytes(datos, 'big'), f'0{len(datos) * 8}b') if datos else ''
+        self._pos = 0
+
+    def leer(self, nbits):
+        inicio = self._pos
+        self._pos += nbits
+        return int(self._bits[inicio:self._pos], 2) if nbits else 0
+
+    def texto(self, nbits):
+        """Los siguientes nbits como texto '0'/'1'."""
+        inicio = self._pos
+        self._pos += nbits
+        return self._bits[inicio:self._pos]
+
+    def bit(self):
+        self._pos += 1
+        return self._bits[self._pos - 1] == '1'
+
+    def unos(self, maximo):
+        """Cuenta unos seguidos (hasta maximo) consumiendo también el cero que los cierra."""
+        n = 0
+        while n < maximo and self.bit():
+            n += 1
+        return n
+
+
+def _codificar_enteros(valores, escritor):
+    anterior = valores[0]
+    escritor.escribir(_zigzag(anterior), 64)
+    delta_anterior = 0
+    for v in valores[1:]:
+        delta = v - anterior
+        dod = delta - delta_anterior
+        if dod == 0:
+            escritor.prefijo('0')
+        else:
+            z = _zigzag(dod)
+            for prefijo, bits in _CUBETAS_DOD:
+                if z < 1 << bits:
+                    escritor.prefijo(prefijo)
+                    escritor.escribir(z, bits)
+                    break
+        anterior, delta_anterior = v, delta
+
+
+def _decodificar_enteros(lector, n):
+    anterior = _unzigzag(lector.leer(64))
+    valores = [anterior]
+    delta = 0
+    for _ in range(n - 1):
+        cubeta = lector.unos(len(_CUBETAS_DOD))
+        if cubeta:
+            delta += _unzigzag(lector.leer(_CUBETAS_DOD[cubeta - 1][1]))
+        anterior += delta
+        valores.append(anterior)
+    return valores
+
+
+def _codificar_flotantes(valores, escritor):
+    bits = struct.unpack(f'<{len(valores)}Q', struct.pack(f'<{len(valores)}d', *valores))
+    anterior = bits[0]
+    escritor.escribir(anterior, 64)
+    ceros_izq, ceros_der = -1, 0
+    for b in bits[1:]:
+        xor = b ^ anterior
+        anterior = b
+        if not xor:
+            escritor.prefijo('0')
+            continue
+        izq = min(64 - xor.bit_length(), 31)
+        der = (xor & -xor).bit_length() - 1
+        if ceros_izq >= 0 and izq >= ceros_izq and der >= ceros_der:
+            # Cabe en la ventana de bits significativos del valor anterior
+            escritor.prefijo('10')
+            escritor.escribir(xor >> ceros_der, 64 - ceros_izq - ceros_der)
+        else:
+            significativos = 64 - izq - der
+            escritor.prefijo('11')
+            escritor.escribir(izq, 5)
+            escritor.escribir(significativos - 1, 6)
+            escritor.escribir(xor >> der, significativos)
+            ceros_izq, ceros_der = izq, der
+
+
+def _decodificar_flotantes(lector, n):
+    anterior = lector.leer(64)
+    bits = [anterior]
+    ceros_izq, ceros_der = 0, 0
+    for _ in range(n - 1):
+        if lector.bit():
+            if lector.bit():
+                ceros_izq = lector.leer(5)
+                ceros_der = 64 - ceros_izq - (lector.leer(6) + 1)
+            anterior ^= lector.leer(64 - ceros_izq - ceros_der) << ceros_der
+        bits.append(anterior)
+    return list(struct.unpack(f'<{n}d', struct.pack(f'<{n}Q', *bits)))
+
+
+def _codificar_columna(valores, flotante):
+    presentes = [v for v in valores if v is not None]
+    if not presentes:
+        return _NULA, b''
+    escritor = _EscritorBits()
+    modo = _COMPLETA
+    if len(presentes) < len(valores):
+        modo = _DISPERSA
+        escritor.prefijo(''.join('0' if v is None else '1' for v in valores))
+    if flotante:
+        _codificar_flotantes([float(v) for v in presentes], escritor)
+    else:
+        _codificar_enteros([int(v) for v in presentes], escritor)
+    return modo, escritor.a_bytes()
+
+
+def _decodificar_columna(modo, datos, n, flotante):
+    if modo == _NULA:
+        return [None] * n
+    lector = _LectorBits(datos)
+    decodificar = _decodificar_flotantes if flotante else _decodificar_enteros
+    if modo == _COMPLETA:
+        return decodificar(lector, n)
+    mapa = lector.texto(n)
+    presentes = iter(decodificar(lector, mapa.count('1')))
+    return [next(presentes) if b == '1' else None for b in mapa]
+
+
+def codificar_bloque(node_id, dia, filas):
+    """
+    Codifica las lecturas de un nodo y un día
+
+    Args:
+        node_id: nodeId común a todas las filas (puede ser None)
+        dia: Día desde 1970 (dia_de(fecha_creacion))
+        filas: Lista de dicts con las COLUMNAS (fecha_creacion como datetime sin zona), ordenada
+
+    Returns:
+        bytes: Bloque listo para añadir a un archivo
+    """
+    directorio = []
+    cuerpo = []
+    for columna in COLUMNAS:
+        if columna == 'fecha_creacion':
+            valores = [a_micros(f['fecha_creacion']) for f in filas]
+        else:
+            valores = [f.get(columna) for f in filas]
+        modo, datos = _codificar_columna(valores, columna in COLUMNAS_FLOTANTES)
+        directorio.append(_COLUMNA.pack(modo, len(datos)))
+        cuerpo.append(datos)
+    nodo = b'' if node_id is None else str(node_id).encode('utf-8')
+    cuerpo = b''.join(directorio) + b''.join(cuerpo)
+    return _CABECERA.pack(MAGICO, _NODO_NULO if node_id is None else len(nodo), dia, len(filas),
+                          len(cuerpo)) + nodo + cuerpo
+
+
+class _Bloque:
+    __slots__ = ('node_id', 'dia', 'filas', 'inicio', 'largo')
+
+    def __init__(self, node_id, dia, filas, inicio, largo):
+        self.node_id = node_id
+        self.dia = dia
+        self.filas = filas
+        self.inicio = inicio  # Desplazamiento del directorio de columnas
+        self.largo = largo
+
+
+class ArchivoColumnar:
+    """Lector de un archivo columnar mapeado en memoria; el índice de bloques se arma al abrir."""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.bloques = []
+        self.tamano = os.path.getsize(ruta) if os.path.exists(ruta) else 0
+        self.tamano_valido = 0
+        self._mapa = None
+        if self.tamano:
+            with open(ruta, 'rb') as f:
+                self._mapa = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._indexar()
+
+    def _indexar(self):
+        mapa, pos = self._mapa, 0
+        while pos + _CABECERA.size <= self.tamano:
+            magico, largo_nodo, dia, filas, largo = _CABECERA.unpack_from(mapa, pos)
+            if magico != MAGICO:
+                break
+            inicio = pos + _CABECERA.size + (0 if largo_nodo == _NODO_NULO else largo_nodo)
+            if inicio + largo > self.tamano:
+                break  # Bloque incompleto al final
+            node_id = None if largo_nodo == _NODO_NULO else mapa[pos + _CABECERA.size:inicio].decode('utf-8')
+            self.bloques.append(_Bloque(node_id, dia, filas, inicio, largo))
+            pos = inicio + largo
+        self.tamano_valido = pos
+
+    def _columnas(self, bloque, columnas):
+        """Decodifica las columnas pedidas de un bloque. Returns: dict columna -> lista de valores."""
+        directorio = [_COLUMNA.unpack_from(self._mapa, bloque.inicio + i * _COLUMNA.size)
+                      for i in range(len(COLUMNAS))]
+        pos = bloque.inicio + len(COLUMNAS) * _COLUMNA.size
+        resultado = {}
+        for columna, (modo, largo) in zip(COLUMNAS, directorio):
+            if columna in columnas:
+                resultado[columna] = _decodificar_columna(modo, self._mapa[pos:pos + largo], bloque.filas,
+                                                          columna in COLUMNAS_FLOTANTES)
+            pos += largo
+        return resultado
+
+    def seleccionar(self, fecha_inicio=None, fecha_fin=None, node_id=None, filtrar_nodo=False):
+        """Bloques que pueden tener filas del rango (y del nodo, si filtrar_nodo)."""
+        dia_inicio = dia_de(fecha_inicio) if fecha_inicio else None
+        dia_fin = dia_de(fecha_fin) if fecha_fin else None
+        return [
+            b for b in self.bloques
+            if (not filtrar_nodo or b.node_id == node_id)
+            and (dia_inicio is None or b.dia >= dia_inicio) and (dia_fin is None or b.dia <= dia_fin)
+        ]
+
+    def iterar(self, fecha_inicio=None, fecha_fin=None, node_id=None, filtrar_nodo=False, columnas=COLUMNAS):
+        """
+        Lecturas del rango [fecha_inicio, fecha_fin] día a día, en orden (fecha_creacion, id)
+
+        Args:
+            fecha_inicio, fecha_fin: datetime sin zona (opcionales, inclusive)
+            node_id, filtrar_nodo: Solo las del nodo node_id (que puede ser None)
+            columnas: Columnas a decodificar además de id, nodeId y fecha_creacion
+
+        Yields:
+            list: dicts con nodeId y las columnas pedidas de un día
+        """
+        columnas = set(columnas) | {'id', 'fecha_creacion'}
+        micros_inicio = a_micros(fecha_inicio) if fecha_inicio else None
+        micros_fin = a_micros(fecha_fin) if fecha_fin else None
+        por_dia = {}
+        for bloque in self.seleccionar(fecha_inicio, fecha_fin, node_id, filtrar_nodo):
+            por_dia.setdefault(bloque.dia, []).append(bloque)
+        for dia in sorted(por_dia):
+            filas = []
+            for bloque in por_dia[dia]:
+                valores = self._columnas(bloque, columnas)
+                fechas = valores['fecha_creacion']
+                # Dentro de un bloque las filas van ordenadas por fecha
+                desde = bisect_left(fechas, micros_inicio) if micros_inicio is not None else 0
+                hasta = bisect_right(fechas, micros_fin) if micros_fin is not None else len(fechas)
+                nombres = list(valores)
+                for i in range(desde, hasta):
+                    fila = {c: valores[c][i] for c in nombres}
+                    fila['fecha_creacion'] = desde_micros(fila['fecha_creacion'])
+                    fila['nodeId'] = bloque.node_id
+                    filas.append(fila)
+            if len(por_dia[dia]) > 1:
+                filas.sort(key=lambda f: (f['fecha_creacion'], f['id']))
+            if filas:
+                yield filas
+
+    def leer(self, *args, **kwargs):
+        """Como iterar(), pero todas las lecturas en una lista."""
+        return [fila for filas in self.iterar(*args, **kwargs) for fila in filas]
+
+    def ids(self, node_id, dia):
+        """Ids ya guardados para un nodo y día."""
+        ids = set()
+        for bloque in self.bloques:
+            if bloque.node_id == node_id and bloque.dia == dia:
+                ids.update(self._columnas(bloque, ('id',))['id'])
+        return ids
+
+    def conteo_por_nodo(self):
+        """Lecturas por nodo, sin decodificar nada (sale del índice)."""
+        conteo = {}
+        for bloque in self.bloques:
+            conteo[bloque.node_id] = conteo.get(bloque.node_id, 0) + bloque.filas
+        return conteo
+
+
+_lectores = {}
+_lock = threading.Lock()
+
+
+def abrir(ruta):
+    """Lector compartido de un archivo; se vuelve a abrir si el archivo cambió de tamaño."""
+    tamano = os.path.getsize(ruta) if os.path.exists(ruta) else 0
+    with _lock:
+        lector = _lectores.get(ruta)
+        if lector is None or lector.tamano != tamano:
+            # El mapa anterior se libera cuando nadie más lo está leyendo
+            lector = _lectores[ruta] = ArchivoColumnar(ruta)
+        return lector
+
+
+def olvidar(ruta):
+    """Descarta el lector en caché (antes de borrar o reemplazar el archivo)."""
+    with _lock:
+        _lectores.pop(ruta, None)
+
+
+def _agrupar(filas):
+    grupos = {}
+    for fila in filas:
+        grupos.setdefault((fila['nodeId'], dia_de(fila['fecha_creacion'])), []).append(fila)
+    for lista in grupos.values():
+        lista.sort(key=lambda f: (f['fecha_creacion'], f['id']))
+    return grupos
+
+
+def agregar(ruta, filas):
+    """
+    Añade lecturas a un archivo (lo crea si no existe), un bloque por nodo y día
+
+    Las filas cuyo id ya está en el archivo se omiten: repetir un archivado
+    interrumpido no duplica lecturas.
+
+    Args:
+        ruta: Ruta del archivo
+        filas: dicts con nodeId y las COLUMNAS (fecha_creacion como datetime sin zona)
+
+    Returns:
+        int: Filas escritas
+    """
+    os.makedirs(os.path.dirname(ruta) or '.', exist_ok=True)
+    lector = abrir(ruta)
+    bloques = []
+    escritas = 0
+    for (node_id, dia), lista in _agrupar(filas).items():
+        existentes = lector.ids(node_id, dia)
+        if existentes:
+            lista = [f for f in lista if f['id'] not in existentes]
+        if lista:
+            bloques.append(codificar_bloque(node_id, dia, lista))
+            escritas += len(lista)
+    if bloques:
+        with open(ruta, 'r+b' if lector.tamano else 'wb') as f:
+            # Descartar un bloque incompleto de una escritura anterior
+            f.truncate(lector.tamano_valido)
+            f.seek(lector.tamano_valido)
+            f.write(b''.join(bloques))
+            f.flush()
+            os.fsync(f.fileno())
+    return escritas
+
+
+def compactar(ruta):
+    """
+    Reescribe el archivo con un único bloque por nodo y día (mejor compresión tras varios añadidos)
+
+    Returns:
+        bool: True si hizo falta reescribirlo
+    """
+    lector = abrir(ruta)
+    claves = [(b.node_id, b.dia) for b in lector.bloques]
+    if len(claves) == len(set(claves)) and lector.tamano_valido == lector.tamano:
+        return False
+    temporal = ruta + '.tmp'
+    with open(temporal, 'wb') as f:
+        for (node_id, dia), lista in sorted(_agrupar(lector.leer()).items(), key=lambda g: (g[0][1], str(g[0][0]))):
+            f.write(codificar_bloque(node_id, dia, lista))
+        f.flush()
+        os.fsync(f.fileno())
+    olvidar(ruta)
+    os.replace(temporal, ruta)
+    return True
@@ -2,11 +2,31 @@
 Módulo de base de datos para AgroLink
 Contiene modelos SQLAlchemy y funciones de acceso a datos
 """
+import base64
+import calendar
+import csv
+import heapq
+import io
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from operator import attrgetter, itemgetter
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime, timezone
-from sqlalchemy import func, text
+from datetime import datetime, timedelta, timezone
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy import event, func, text, insert, inspect, select, table, column, tuple_, and_, or_, bindparam
+
+import columnar
+import geo
+from bitacora import obtener_logger
+from serializacion import FilaDato, fila_dato, texto_fecha
 
 db = SQLAlchemy()
+log = obtener_logger('database')
 
 
 # ==================== MODELO DE DATOS ====================
@@ -22,18 +42,39 @@ class DatosSensor(db.Model):
     # Nuevos campos de ubicación
     lat = db.Column(db.Float, nullable=True)
     lon = db.Column(db.Float, nullable=True)
+    # Geohash de lat/lon (geo.PRECISION caracteres) para las consultas por caja y radio
+    geohash = db.Column(db.String(12), nullable=True)
 
     nodeId = db.Column(db.String(50), nullable=True)
     timestamp = db.Column(db.Integer, nullable=True)
     fecha_creacion = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
 
+    # No es columna: True si la lectura abrió un punto nuevo en el trayecto del nodo
+    movimiento = False
+
+    __table_args__ = (
+        # Casi todas las lecturas filtran por nodo y ordenan por fecha descendente
+        db.Index('ix_datos_sensor_nodo_fecha', 'nodeId', 'fecha_creacion'),
+        # Rangos de fechas y "últimos N" sin filtro de nodo
+        db.Index('ix_datos_sensor_fecha', 'fecha_creacion'),
+        # Índice parcial: solo filas con ubicación (obtener_ultima_ubicacion)
+        db.Index('ix_datos_sensor_nodo_ubicacion', 'nodeId', 'fecha_creacion',
+                 sqlite_where=text('lat IS NOT NULL AND lon IS NOT NULL'),
+                 postgresql_where=text('lat IS NOT NULL AND lon IS NOT NULL')),
+        # Lecturas dentro de un radio (rangos de geohash), solo filas con ubicación; cubre
+        # fecha y lat/lon para elegir las más recientes sin leer la tabla
+        db.Index('ix_datos_sensor_geohash', 'geohash', 'fecha_creacion', 'lat', 'lon',
+                 sqlite_where=text('geohash IS NOT NULL'),
+                 postgresql_where=text('geohash IS NOT NULL')),
+    )
+
     def to_dict(self):
         """Convierte el objeto a diccionario para serialización JSON"""
         resultado = {
             'id': self.id,
             'nodeId': self.nodeId,
             'timestamp': self.timestamp,
-            'fecha_creacion': self.fecha_creacion.strftime('%Y-%m-%d %H:%M:%S %Z')
+            'fecha_creacion': texto_fecha(self.fecha_creacion)
         }
 
         # Solo incluir campos con valores no None
@@ -55,6 +96,185 @@ class DatosSensor(db.Model):
         return resultado
 
 
+# Campos de sensor (sin ubicación) que puede reportar un nodo
+CAMPOS_SENSOR = ('temperatura', 'humedad', 'soil_moisture', 'light', 'percentage')
+
+
+class EstadoNodo(db.Model):
+    """
+    Resumen mantenido por nodo: último valor de cada campo, última ubicación y conteo.
+    Se actualiza en la misma transacción que cada inserción en datos_sensor.
+    """
+    __tablename__ = 'estado_nodo'
+    nodeId = db.Column(db.String(50), primary_key=True)
+    # Último valor no nulo de cada campo (None = el nodo nunca lo ha reportado)
+    temperatura = db.Column(db.Float, nullable=True)
+    humedad = db.Column(db.Float, nullable=True)
+    soil_moisture = db.Column(db.Float, nullable=True)
+    light = db.Column(db.Float, nullable=True)
+    percentage = db.Column(db.Float, nullable=True)
+    # Última ubicación conocida
+    lat = db.Column(db.Float, nullable=True)
+    lon = db.Column(db.Float, nullable=True)
+    geohash = db.Column(db.String(12), nullable=True)
+    fecha_ubicacion = db.Column(db.DateTime, nullable=True)
+    # Último registro visto
+    ultimo_id = db.Column(db.Integer, nullable=True)
+    ultima_fecha = db.Column(db.DateTime, nullable=True)
+    total_registros = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        # Nodos visibles en la vista del mapa (obtener_nodos_en_area)
+        db.Index('ix_estado_nodo_geohash', 'geohash'),
+    )
+
+    def registrar(self, fila):
+        """Aplica una fila nueva de datos_sensor (mapping con sus columnas) al resumen."""
+        for campo in CAMPOS_SENSOR:
+            valor = fila[campo]
+            if valor is not None:
+                setattr(self, campo, valor)
+        if fila['lat'] is not None and fila['lon'] is not None:
+            self.lat = fila['lat']
+            self.lon = fila['lon']
+            self.geohash = _geohash_fila(fila)
+            self.fecha_ubicacion = fila['fecha_creacion']
+        self.ultimo_id = fila['id']
+        self.ultima_fecha = fila['fecha_creacion']
+        self.total_registros = (self.total_registros or 0) + 1
+
+    def campos(self):
+        """Dict {campo: True/False} con los campos de sensor que reporta el nodo."""
+        return {campo: getattr(self, campo) is not None for campo in CAMPOS_SENSOR}
+
+    def ubicacion(self):
+        """Última ubicación como dict {lat, lon, fecha} o None."""
+        if self.lat is None or self.lon is None:
+            return None
+        return {
+            'lat': float(self.lat),
+            'lon': float(self.lon),
+            'fecha': self.fecha_ubicacion.strftime('%Y-%m-%d %H:%M:%S %Z') if self.fecha_ubicacion else None
+        }
+
+
+def _geohash_fila(fila):
+    """Geohash de una fila con ubicación (las anteriores a la columna no lo traen)."""
+    return fila.get('geohash') or geo.geohash(fila['lat'], fila['lon'])
+
+
+class PuntoTrayecto(db.Model):
+    """
+    Trayecto de un nodo: una fila por posición distinta, en orden de llegada.
+    Las lecturas que caen a menos de politica_ubicacion.umbral_m de la última posición
+    no crean un punto nuevo: solo alargan ese (fecha_fin) y suman a lecturas.
+    """
+    __tablename__ = 'trayecto_nodo'
+    id = db.Column(db.Integer, primary_key=True)
+    nodeId = db.Column(db.String(50), nullable=False)
+    lat = db.Column(db.Float, nullable=False)
+    lon = db.Column(db.Float, nullable=False)
+    # Primera y última lectura en esta posición (UTC sin zona)
+    fecha_inicio = db.Column(db.DateTime, nullable=False)
+    fecha_fin = db.Column(db.DateTime, nullable=False)
+    lecturas = db.Column(db.Integer, nullable=False, default=1)
+
+    __table_args__ = (
+        # Último punto de un nodo y trayecto por rango de fechas
+        db.Index('ix_trayecto_nodo_fecha', 'nodeId', 'fecha_inicio'),
+    )
+
+    def to_dict(self):
+        return {
+            'lat': float(self.lat),
+            'lon': float(self.lon),
+            'desde': texto_fecha(self.fecha_inicio),
+            'hasta': texto_fecha(self.fecha_fin),
+            'lecturas': self.lecturas
+        }
+
+
+class PoliticaUbicacion:
+    """
+    Cuándo una ubicación es un movimiento
+
+    umbral_m: metros desde el último punto del trayecto a partir de los que una lectura
+    crea un punto nuevo (y se emite 'ubicacion_nodo'); por debajo se cuenta como la misma
+    posición. Con solo_movimiento=True las lecturas que no se movieron se guardan en
+    datos_sensor sin lat/lon: la posición queda en trayecto_nodo y no se repite en cada fila.
+    """
+
+    def __init__(self):
+        self.configurar()
+
+    def configurar(self, umbral_m=10.0, solo_movimiento=False):
+        if umbral_m < 0:
+            raise ValueError("El umbral de movimiento no puede ser negativo")
+        self.umbral_m = umbral_m
+        self.solo_movimiento = solo_movimiento
+
+    def resumen(self):
+        return {'umbral_m': self.umbral_m, 'solo_movimiento': self.solo_movimiento}
+
+
+politica_ubicacion = PoliticaUbicacion()
+
+
+# Niveles de agregación de las series: nivel -> segundos por intervalo
+NIVELES_RESUMEN = {'m': 60, 'h': 3600, 'd': 86400}
+
+
+class ResumenSerie(db.Model):
+    """
+    Agregados de un campo de un nodo por intervalo (minuto, hora o día).
+    Se actualizan de forma incremental en cada inserción; inicio es el epoch UTC del intervalo.
+    """
+    __tablename__ = 'resumen_serie'
+    nivel = db.Column(db.String(1), primary_key=True)
+    nodeId = db.Column(db.String(50), primary_key=True)
+    campo = db.Column(db.String(20), primary_key=True)
+    inicio = db.Column(db.Integer, primary_key=True)
+    cantidad = db.Column(db.Integer, nullable=False, default=0)
+    suma = db.Column(db.Float, nullable=False, default=0.0)
+    minimo = db.Column(db.Float, nullable=True)
+    maximo = db.Column(db.Float, nullable=True)
+
+
+# nodeId de la fila de EstadisticaCampo que acumula todos los nodos
+NODO_GLOBAL = '*'
+# Pseudo-campo de EstadisticaCampo que cuenta registros (tengan o no valores)
+CAMPO_REGISTROS = '_registros'
+
+
+class EstadisticaCampo(db.Model):
+    """
+    Agregados acumulados (conteo, suma, suma de cuadrados, mínimo, máximo) por nodo y campo.
+    La fila con nodeId=NODO_GLOBAL acumula todos los nodos; se mantiene en cada inserción y borrado.
+    """
+    __tablename__ = 'estadistica_campo'
+    nodeId = db.Column(db.String(50), primary_key=True)
+    campo = db.Column(db.String(20), primary_key=True)
+    cantidad = db.Column(db.Integer, nullable=False, default=0)
+    suma = db.Column(db.Float, nullable=False, default=0.0)
+    suma_cuadrados = db.Column(db.Float, nullable=False, default=0.0)
+    minimo = db.Column(db.Float, nullable=True)
+    maximo = db.Column(db.Float, nullable=True)
+
+    def resumen(self):
+        """Dict con promedio, máxima, mínima, desviación estándar (poblacional) y cantidad."""
+        n = self.cantidad or 0
+        promedio = self.suma / n if n else 0
+        varianza = (self.suma_cuadrados / n - promedio * promedio) if n else 0
+        return {
+            'promedio': float(promedio),
+            'maxima': float(self.maximo) if self.maximo is not None else 0,
+            'minima': float(self.minimo) if self.minimo is not None else 0,
+            # max(…, 0): el redondeo puede dar varianzas negativas minúsculas
+            'desviacion': math.sqrt(max(varianza, 0.0)),
+            'cantidad': n
+        }
+
+
 class GatewayInfo(db.Model):
     """Estado simple de la gateway (por ahora solo IP). Usar un único registro."""
     id = db.Column(db.Integer, primary_key=True)
@@ -62,35 +282,608 @@ class GatewayInfo(db.Model):
     actualizado_en = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
 
 
+# ==================== CACHÉ EN PROCESO ====================
+
+class _BufferLecturas:
+    """Últimas lecturas en orden cronológico; completo=True si contiene todas las de la BD."""
+    __slots__ = ('filas', 'completo')
+
+    def __init__(self, filas, maximo):
+        self.filas = deque(filas, maxlen=maximo)
+        self.completo = len(self.filas) < maximo
+
+    def agregar(self, dato):
+        if len(self.filas) == self.filas.maxlen:
+            self.completo = False
+        self.filas.append(dato)
+
+    def quitar(self, dato_id):
+        for dato in self.filas:
+            if dato.id == dato_id:
+                self.filas.remove(dato)
+                return
+
+    def ultimos(self, limit, offset):
+        """Lecturas de la más reciente a la más antigua, o None si el buffer no alcanza."""
+        total = len(self.filas)
+        if offset + limit > total and not self.completo:
+            return None
+        fin = max(total - offset, 0)
+        lista = list(self.filas)[max(fin - limit, 0):fin]
+        lista.reverse()
+        return lista
+
+
+_SIN_CARGAR = object()
+
+
+class CacheLecturas:
+    """
+    Caché en memoria de lo que piden todas las páginas y cada conexión de Socket.IO
+
+    Guarda las últimas lecturas (global y por nodo) en buffers circulares, el resumen
+    de nodos, el total de registros y la IP de la gateway. Cada cosa se carga de la BD
+    la primera vez que se pide y después se mantiene por escritura directa desde
+    guardar_dato_sensor, guardar_datos_sensor_lote, eliminar_dato y set_gateway_ip,
+    siempre después del commit.
+
+    Con varios procesos cada uno tiene su propia caché y no ve lo que escriben los
+    demás: ttl (segundos, 0 = sin caducidad) obliga a recargar de la BD cada cierto tiempo.
+    """
+
+    def __init__(self, max_recientes=500, max_por_nodo=200, max_nodos=1000, ttl=0):
+        self._lock = threading.Lock()
+        self._aciertos = {}
+        self._fallos = {}
+        self.configurar(max_recientes, max_por_nodo, max_nodos, ttl)
+
+    def configurar(self, max_recientes=500, max_por_nodo=200, max_nodos=1000, ttl=0):
+        """Fija los límites de tamaño y vacía la caché."""
+        with self._lock:
+            self.max_recientes = max_recientes
+            self.max_por_nodo = max_por_nodo
+            self.max_nodos = max_nodos
+            self.ttl = ttl
+            self._vaciar()
+
+    def invalidar(self):
+        """Descarta todo lo cacheado (p. ej. tras reconstruir tablas derivadas)."""
+        with self._lock:
+            self._vaciar()
+
+    def _vaciar(self):
+        self._recientes = None          # _BufferLecturas global
+        self._por_nodo = OrderedDict()  # nodeId -> _BufferLecturas, el menos usado primero
+        self._resumen = _SIN_CARGAR
+        self._total = _SIN_CARGAR
+        self._gateway_ip = _SIN_CARGAR
+        self._cargado_en = time.monotonic()
+        # Cambia con cada escritura: una carga que se cruzó con una escritura no se guarda
+        self._version = getattr(self, '_version', 0) + 1
+
+    def _contar(self, clave, acierto):
+        contadores = self._aciertos if acierto else self._fallos
+        contadores[clave] = contadores.get(clave, 0) + 1
+
+    def _vigente(self):
+        # Se llama con el lock tomado
+        if self.ttl and time.monotonic() - self._cargado_en > self.ttl:
+            self._vaciar()
+
+    # ---- lecturas recientes ----
+
+    def ultimos(self, node_id, limit, offset=0):
+        """Últimas lecturas (global si node_id es None) o None si no están en caché."""
+        clave = 'recientes' if node_id is None else 'recientes_nodo'
+        with self._lock:
+            self._vigente()
+            if node_id is None:
+                buffer = self._recientes
+            else:
+                buffer = self._por_nodo.get(node_id)
+                if buffer is not None:
+                    self._por_nodo.move_to_end(node_id)
+            datos = buffer.ultimos(limit, offset) if buffer is not None else None
+            self._contar(clave, datos is not None)
+            return datos
+
+    def maximo(self, node_id):
+        return self.max_recientes if node_id is None else self.max_por_nodo
+
+    def version(self):
+        with self._lock:
+            return self._version
+
+    def cargar_ultimos(self, node_id, datos, version):
+        """Guarda las últimas lecturas leídas de la BD (de la más reciente a la más antigua)."""
+        with self._lock:
+            if version != self._version:
+                return
+            buffer = _BufferLecturas(reversed(datos), self.maximo(node_id))
+            if node_id is None:
+                self._recientes = buffer
+            else:
+                self._por_nodo[node_id] = buffer
+                while len(self._por_nodo) > self.max_nodos:
+                    self._por_nodo.popitem(last=False)
+
+    # ---- valores sueltos ----
+
+    def obtener(self, clave, cargar):
+        """Devuelve 'resumen', 'total' o 'gateway_ip', cargándolo con cargar() si hace falta."""
+        atributo = '_' + clave
+        with self._lock:
+            self._vigente()
+            valor = getattr(self, atributo)
+            acierto = valor is not _SIN_CARGAR
+            self._contar(clave, acierto)
+            if acierto:
+                return dict(valor) if clave == 'resumen' else valor
+            version = self._version
+        valor = cargar()
+        with self._lock:
+            if version == self._version:
+                setattr(self, atributo, valor)
+        return dict(valor) if clave == 'resumen' else valor
+
+    def fijar_gateway_ip(self, ip):
+        with self._lock:
+            self._gateway_ip = ip
+
+    # ---- escritura directa ----
+
+    def registrar(self, datos):
+        """Aplica lecturas recién confirmadas (DatosSensor desligados, en orden de inserción)."""
+        with self._lock:
+            self._version += 1
+            if self._total is not _SIN_CARGAR:
+                self._total += len(datos)
+            for dato in datos:
+                if self._recientes is not None:
+                    self._recientes.agregar(dato)
+                buffer = self._por_nodo.get(dato.nodeId)
+                if buffer is not None:
+                    buffer.agregar(dato)
+                if self._resumen is not _SIN_CARGAR:
+                    self._registrar_en_resumen(dato)
+
+    def _registrar_en_resumen(self, dato):
+        # Mismo criterio que EstadoNodo.registrar + obtener_resumen_nodos; las entradas se
+        # reemplazan (no se modifican) porque obtener_resumen_nodos ya las pudo entregar
+        node_id = _normalizar_node_id(dato.nodeId)
+        if node_id is None:
+            return
+        previo = self._resumen.get(node_id)
+        ubicacion = previo['ubicacion'] if previo else None
+        if dato.lat is not None and dato.lon is not None:
+            ubicacion = {
+                'lat': float(dato.lat),
+                'lon': float(dato.lon),
+                'fecha': dato.fecha_creacion.strftime('%Y-%m-%d %H:%M:%S %Z') if dato.fecha_creacion else None
+            }
+        self._resumen[node_id] = {
+            'campos': {c: (previo is not None and previo['campos'][c]) or getattr(dato, c) is not None
+                       for c in CAMPOS_SENSOR},
+            'ubicacion': ubicacion,
+            'total_registros': (previo['total_registros'] if previo else 0) + 1,
+            'ultima_fecha': dato.fecha_creacion
+        }
+        if previo is None:
+            self._resumen = dict(sorted(self._resumen.items()))
+
+    def descontar(self, fila):
+        """Aplica el borrado confirmado de una fila (mapping con sus columnas)."""
+        with self._lock:
+            self._version += 1
+            if self._total is not _SIN_CARGAR:
+                self._total = max(self._total - 1, 0)
+            if self._recientes is not None:
+                self._recientes.quitar(fila['id'])
+            buffer = self._por_nodo.get(fila['nodeId'])
+            if buffer is not None:
+                buffer.quitar(fila['id'])
+            # Recalcular el resumen de un nodo tras un borrado necesita la BD: se recarga entero
+            self._resumen = _SIN_CARGAR
+
+    def metricas(self):
+        """Dict con aciertos/fallos por clave y el tamaño actual de cada parte."""
+        with self._lock:
+            claves = sorted(set(self._aciertos) | set(self._fallos))
+            return {
+                'aciertos': {c: self._aciertos.get(c, 0) for c in claves},
+                'fallos': {c: self._fallos.get(c, 0) for c in claves},
+                'recientes': len(self._recientes.filas) if self._recientes is not None else 0,
+                'nodos_con_recientes': len(self._por_nodo),
+                'nodos_en_resumen': len(self._resumen) if self._resumen is not _SIN_CARGAR else 0,
+                'limites': {
+                    'max_recientes': self.max_recientes,
+                    'max_por_nodo': self.max_por_nodo,
+                    'max_nodos': self.max_nodos,
+                    'ttl': self.ttl
+                }
+            }
+
+
+cache = CacheLecturas()
+
+
+class VersionDatos:
+    """
+    Versión monótona de los datos, para ETag y Last-Modified de las respuestas de lectura
+
+    Sube con cada escritura confirmada (guardar_dato_sensor, guardar_datos_sensor_lote,
+    eliminar_dato, archivar_datos, set_gateway_ip), con la poda de resúmenes y de archivos
+    y con las reconstrucciones (estado por nodo, resúmenes, estadísticas, geohash, trayectos).
+    Es por proceso, como la caché: con ttl > 0 sube también si pasaron ttl segundos desde el
+    último cambio, para que las escrituras de otros procesos se vean como mucho ttl segundos después.
+    """
+
+    def __init__(self, ttl=0):
+        self._lock = threading.Lock()
+        # El mismo número en otro proceso (o tras reiniciar) no es la misma versión
+        self.origen = os.urandom(4).hex()
+        self.ttl = ttl
+        self._numero = 0
+        self._subir()
+
+    def configurar(self, ttl=0):
+        with self._lock:
+            self.ttl = ttl
+            self._subir()
+
+    def _subir(self):
+        self._numero += 1
+        # HTTP usa segundos enteros
+        self._modificado = datetime.now(timezone.utc).replace(microsecond=0)
+        self._cambiado_en = time.monotonic()
+
+    def incrementar(self):
+        """Marca los datos como cambiados (llamar después del commit)."""
+        with self._lock:
+            self._subir()
+
+    def actual(self):
+        """
+        Returns:
+            tuple: (etag, fecha de la última modificación en UTC)
+        """
+        with self._lock:
+            if self.ttl and time.monotonic() - self._cambiado_en > self.ttl:
+                self._subir()
+            return f'{self.origen}-{self._numero}', self._modificado
+
+
+version_datos = VersionDatos()
+
+
+def _fecha_naive_utc(fecha):
+    """Las fechas se leen de la BD sin zona (UTC); la caché guarda el mismo formato."""
+    if fecha is not None and fecha.tzinfo is not None:
+        return fecha.astimezone(timezone.utc).replace(tzinfo=None)
+    return fecha
+
+
+def _dato_desligado(fila):
+    """DatosSensor fuera de la sesión a partir de un mapping de columnas (no caduca al hacer commit)."""
+    valores = dict(fila)
+    valores['fecha_creacion'] = _fecha_naive_utc(valores['fecha_creacion'])
+    return DatosSensor(**valores)
+
+
+def _ultimos_cacheados(limit, offset=0, node_id=None):
+    """
+    Últimas lecturas desde la caché, cargando el buffer de la BD si aún no está
+
+    Returns:
+        list o None si la página pedida no cabe en el buffer (consultar la BD directamente)
+    """
+    if limit is None or limit < 0 or offset < 0 or offset + limit > cache.maximo(node_id):
+        return None
+    datos = cache.ultimos(node_id, limit, offset)
+    if datos is not None:
+        return datos
+    version = cache.version()
+    tabla = DatosSensor.__table__
+    consulta = select(tabla).order_by(tabla.c.fecha_creacion.desc(), tabla.c.id.desc()).limit(cache.maximo(node_id))
+    if node_id is not None:
+        consulta = consulta.where(tabla.c.nodeId == node_id)
+    cargados = [_dato_desligado(fila._mapping) for fila in db.session.execute(consulta)]
+    cache.cargar_ultimos(node_id, cargados, version)
+    return cargados[offset:offset + limit]
+
+
+# ==================== PERFIL DE ALMACENAMIENTO (SQLite) ====================
+
+# PRAGMAs que se aplican a cada conexión nueva, por perfil
+PERFILES_SQLITE = {
+    # Diario de rollback sin ajustes (comportamiento anterior): escritores y lectores se bloquean entre sí
+    'clasico': {},
+    # WAL: los lectores no bloquean al escritor ni al revés. synchronous=NORMAL en WAL no corrompe
+    # la base; ante un corte de luz se pueden perder las últimas transacciones confirmadas
+    'wal': {
+        # Solo tiene efecto en bases nuevas (antes de crear tablas); debe ir antes de journal_mode.
+        # Permite devolver al disco, poco a poco, el espacio que libera la retención
+        'auto_vacuum': 'INCREMENTAL',
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,      # ms esperando el bloqueo de escritura antes de "database is locked"
+        'cache_size': -65536,      # 64 MiB de caché de páginas por conexión
+        'mmap_size': 268435456,    # 256 MiB mapeados en memoria para lecturas
+        'temp_store': 'MEMORY'
+    },
+    # WAL con fsync en cada commit
+    'wal_seguro': {
+        'auto_vacuum': 'INCREMENTAL',
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'busy_timeout': 5000,
+        'cache_size': -65536,
+        'mmap_size': 268435456,
+        'temp_store': 'MEMORY'
+    }
+}
+
+
+def _pragmas_sqlite(app):
+    """PRAGMAs del perfil configurado (SQLITE_PERFIL) con los ajustes de SQLITE_PRAGMAS encima."""
+    perfil = app.config.get('SQLITE_PERFIL', 'wal')
+    if perfil not in PERFILES_SQLITE:
+        raise ValueError(f"Perfil SQLite desconocido: {perfil} (opciones: {', '.join(PERFILES_SQLITE)})")
+    pragmas = dict(PERFILES_SQLITE[perfil])
+    pragmas.update(app.config.get('SQLITE_PRAGMAS') or {})
+    return pragmas
+
+
+def _configurar_motor(app):
+    """Opciones del pool según el motor; deben fijarse antes de db.init_app."""
+    uri = app.config.get('SQLALCHEMY_DATABASE_URI', '')
+    opciones = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+    if uri.startswith('postgresql'):
+        # Conexiones que el servidor cerró (reinicio, idle timeout) se descartan antes de usarlas
+        opciones.setdefault('pool_pre_ping', True)
+        return
+    if not uri.startswith('sqlite') or ':memory:' in uri or uri.rstrip('/') in ('sqlite:', 'sqlite://'):
+        return
+    # Un hilo por petición / evento de Socket.IO: el pool limita cuántas conexiones abiertas hay
+    opciones.setdefault('pool_size', app.config.get('SQLITE_POOL_SIZE', 10))
+    opciones.setdefault('max_overflow', app.config.get('SQLITE_POOL_MAX_OVERFLOW', 20))
+    opciones.setdefault('pool_timeout', app.config.get('SQLITE_POOL_TIMEOUT', 30))
+    # Las conexiones vuelven al pool y las usa otro hilo
+    opciones.setdefault('connect_args', {}).setdefault('check_same_thread', False)
+
+
+def _aplicar_pragmas(motor, pragmas):
+    """Registra los PRAGMAs para cada conexión nueva del motor."""
+    if motor.dialect.name != 'sqlite' or not pragmas:
+        return
+
+    @event.listens_for(motor, 'connect')
+    def _al_conectar(conexion_dbapi, registro):
+        cursor = conexion_dbapi.cursor()
+        try:
+            for nombre, valor in pragmas.items():
+                cursor.execute(f'PRAGMA {nombre}={valor}')
+        finally:
+            cursor.close()
+
+
+def configuracion_sqlite():
+    """
+    PRAGMAs vigentes en una conexión del pool (para diagnóstico)
+
+    Returns:
+        dict: {pragma: valor} o {} si la base no es SQLite
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return {}
+    resultado = {}
+    with db.engine.connect() as conn:
+        for nombre in ('auto_vacuum', 'journal_mode', 'synchronous', 'busy_timeout', 'cache_size', 'mmap_size',
+                       'temp_store'):
+            resultado[nombre] = conn.exec_driver_sql(f'PRAGMA {nombre}').scalar()
+    return resultado
+
+
 # ==================== FUNCIONES DE ACCESO A DATOS ====================
 
 def inicializar_db(app):
     """Inicializa la base de datos con la aplicación Flask y asegura columnas nuevas si faltan"""
+    pragmas = _pragmas_sqlite(app)
+    _configurar_motor(app)
     db.init_app(app)
+    cache.configurar(max_recientes=app.config.get('CACHE_MAX_RECIENTES', 500),
+                     max_por_nodo=app.config.get('CACHE_MAX_POR_NODO', 200),
+                     max_nodos=app.config.get('CACHE_MAX_NODOS', 1000),
+                     ttl=app.config.get('CACHE_TTL', 0))
+    version_datos.configurar(ttl=app.config.get('CACHE_TTL', 0))
+    politica_ubicacion.configurar(umbral_m=app.config.get('UBICACION_UMBRAL_M', 10.0),
+                                  solo_movimiento=app.config.get('UBICACION_SOLO_MOVIMIENTO', False))
+    politica_retencion.configurar(dias_crudos=app.config.get('RETENCION_DIAS_CRUDOS', 0),
+                                  archivar=app.config.get('RETENCION_ARCHIVAR', True),
+                                  dias_archivo=app.config.get('RETENCION_DIAS_ARCHIVO', 0),
+                                  dias_resumen=app.config.get('RETENCION_DIAS_RESUMEN'),
+                                  directorio=app.config.get('ARCHIVO_DIRECTORIO') or
+                                  os.path.join(app.instance_path, 'archivo'),
+                                  paginas_vacuum=app.config.get('RETENCION_PAGINAS_VACUUM', 2000),
+                                  formato=app.config.get('ARCHIVO_FORMATO', 'columnar'))
     with app.app_context():
+        # Antes de la primera conexión, para que todas las del pool tengan el perfil
+        _aplicar_pragmas(db.engine, pragmas)
+        if app.config.get('PARTICIONAR_DATOS', True):
+            _crear_tabla_particionada()
         db.create_all()
-        _asegurar_columnas_nuevas()
+        agregadas = _migrar_columnas()
+        _asegurar_indices()
+        asegurar_particiones(app.config.get('PARTICIONES_MESES_ADELANTE', 3))
         _asegurar_gateway_row()
+        _asegurar_estado_nodos()
+        _asegurar_resumenes()
+        _asegurar_estadisticas()
+        _asegurar_geohash(agregadas)
+        _asegurar_trayectos()
 
 
-def _asegurar_columnas_nuevas():
-    """Intenta añadir columnas nuevas en SQLite si la tabla ya existía sin ellas."""
-    try:
-        # Comprobar columnas existentes
-        cols = db.session.execute(text("PRAGMA table_info(datos_sensor)")).fetchall()
-        nombres = {c[1] for c in cols}  # c[1] = name
-        alterados = False
-        if 'lat' not in nombres:
-            db.session.execute(text("ALTER TABLE datos_sensor ADD COLUMN lat FLOAT"))
-            alterados = True
-        if 'lon' not in nombres:
-            db.session.execute(text("ALTER TABLE datos_sensor ADD COLUMN lon FLOAT"))
-            alterados = True
-        if alterados:
-            db.session.commit()
-    except Exception:
-        # Silenciar: si falla es porque ya existen o no es SQLite compatible.
-        db.session.rollback()
+def _migrar_columnas(motor=None, tablas=None):
+    """
+    Añade a las tablas existentes las columnas de los modelos que les falten (p. ej. lat/lon)
+
+    Usa el inspector y el compilador de tipos del motor, así que sirve igual en SQLite y
+    PostgreSQL. Solo añade columnas que admiten NULL: las demás necesitan una migración a mano.
+
+    Args:
+        motor: Motor a migrar (por defecto el de la app; también los archivos mensuales SQLite)
+        tablas: Tablas a revisar (por defecto todas las de los modelos)
+
+    Returns:
+        set: Pares (tabla, columna) añadidos
+    """
+    motor = motor if motor is not None else db.engine
+    inspector = inspect(motor)
+    preparador = motor.dialect.identifier_preparer
+    agregadas = set()
+    for tabla in tablas if tablas is not None else db.metadata.sorted_tables:
+        if not inspector.has_table(tabla.name):
+            continue
+        existentes = {c['name'] for c in inspector.get_columns(tabla.name)}
+        for columna in tabla.columns:
+            if columna.name in existentes:
+                continue
+            if not columna.nullable:
+                log.warning('Falta la columna obligatoria %s.%s; migrar a mano', tabla.name, columna.name)
+                continue
+            tipo = columna.type.compile(dialect=motor.dialect)
+            try:
+                with motor.begin() as conn:
+                    conn.exec_driver_sql(f'ALTER TABLE {preparador.format_table(tabla)} '
+                                         f'ADD COLUMN {preparador.format_column(columna)} {tipo}')
+                agregadas.add((tabla.name, columna.name))
+                log.info('Columna añadida: %s.%s %s', tabla.name, columna.name, tipo)
+            except Exception as e:
+                log.warning('No se pudo añadir %s.%s: %s', tabla.name, columna.name, e)
+    return agregadas
+
+
+def _asegurar_indices():
+    """Crea los índices declarados en los modelos si la tabla ya existía sin ellos."""
+    # create_all no crea índices nuevos sobre tablas que ya existen
+    for tabla in (DatosSensor.__table__, EstadoNodo.__table__):
+        for indice in tabla.indexes:
+            try:
+                indice.create(bind=db.engine, checkfirst=True)
+            except Exception as e:
+                log.warning('No se pudo crear el índice %s: %s', indice.name, e)
+
+
+# ==================== Particiones por mes (PostgreSQL) ====================
+
+def _ddl_tabla_particionada(dialecto):
+    """CREATE TABLE de datos_sensor particionada por rango de fecha_creacion."""
+    tabla = DatosSensor.__table__
+    preparador = dialecto.identifier_preparer
+    columnas = []
+    for c in tabla.columns:
+        tipo = 'SERIAL' if c is tabla.c.id else c.type.compile(dialect=dialecto)
+        # La columna de partición no puede ser NULL
+        obligatoria = ' NOT NULL' if c is tabla.c.fecha_creacion else ''
+        columnas.append(f'{preparador.format_column(c)} {tipo}{obligatoria}')
+    fecha = preparador.format_column(tabla.c.fecha_creacion)
+    columnas.append(f'PRIMARY KEY ({preparador.format_column(tabla.c.id)}, {fecha})')
+    return (f'CREATE TABLE {preparador.format_table(tabla)} (\n    ' + ',\n    '.join(columnas) +
+            f'\n) PARTITION BY RANGE ({fecha})')
+
+
+def _crear_tabla_particionada():
+    """
+    En PostgreSQL crea datos_sensor particionada por mes si la tabla aún no existe
+
+    Una tabla ya creada sin particiones se deja como está (convertirla exige copiar los datos).
+    La clave primaria pasa a ser (id, fecha_creacion) porque PostgreSQL exige que incluya
+    la columna de partición; id sigue siendo único porque sale de una secuencia.
+    """
+    if db.engine.dialect.name != 'postgresql' or inspect(db.engine).has_table(DatosSensor.__tablename__):
+        return
+    with db.engine.begin() as conn:
+        conn.exec_driver_sql(_ddl_tabla_particionada(db.engine.dialect))
+    log.info('Tabla datos_sensor creada con particiones mensuales')
+
+
+def tabla_particionada():
+    """True si datos_sensor es una tabla particionada de PostgreSQL."""
+    if db.engine.dialect.name != 'postgresql':
+        return False
+    with db.engine.connect() as conn:
+        return conn.execute(text(
+            "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = :tabla"
+        ), {'tabla': DatosSensor.__tablename__}).first() is not None
+
+
+def _inicio_mes(fecha, meses=0):
+    indice = fecha.year * 12 + fecha.month - 1 + meses
+    return datetime(indice // 12, indice % 12 + 1, 1)
+
+
+def asegurar_particiones(meses_adelante=3):
+    """
+    Crea las particiones del mes actual y de los meses_adelante siguientes, más una DEFAULT
+
+    Las filas fuera de esos meses caen en datos_sensor_default. Conviene ejecutarlo
+    periódicamente (flask asegurar-particiones) para que cada mes tenga su partición
+    antes de recibir datos: no se puede crear la de un mes que ya tiene filas en DEFAULT.
+
+    Returns:
+        list: Nombres de las particiones mensuales revisadas ([] si la tabla no está particionada)
+    """
+    if not tabla_particionada():
+        return []
+    hoy = datetime.now(timezone.utc).replace(tzinfo=None)
+    nombres = []
+    for i in range(meses_adelante + 1):
+        desde, hasta = _inicio_mes(hoy, i), _inicio_mes(hoy, i + 1)
+        nombre = f'{DatosSensor.__tablename__}_{desde:%Y%m}'
+        try:
+            with db.engine.begin() as conn:
+                conn.exec_driver_sql(
+                    f"CREATE TABLE IF NOT EXISTS {nombre} PARTITION OF {DatosSensor.__tablename__} "
+                    f"FOR VALUES FROM ('{desde:%Y-%m-%d}') TO ('{hasta:%Y-%m-%d}')")
+            nombres.append(nombre)
+        except Exception as e:
+            log.warning('No se pudo crear la partición %s: %s', nombre, e)
+    with db.engine.begin() as conn:
+        conn.exec_driver_sql(f"CREATE TABLE IF NOT EXISTS {DatosSensor.__tablename__}_default "
+                             f"PARTITION OF {DatosSensor.__tablename__} DEFAULT")
+    return nombres
+
+
+
+def explicar_consulta(sql, parametros=(), conexion=None):
+    """
+    Devuelve el plan de ejecución de una sentencia SQL (EXPLAIN QUERY PLAN en SQLite, EXPLAIN en PostgreSQL)
+
+    Args:
+        sql: Sentencia tal como la envía el driver (con su estilo de parámetros)
+        parametros: Parámetros de la sentencia
+        conexion: Conexión DBAPI donde corrió la sentencia (opcional). Dentro de una
+                  transacción de escritura en SQLite otra conexión no puede leer el esquema.
+
+    Returns:
+        list: Líneas de detalle del plan
+    """
+    es_sqlite = db.engine.dialect.name == 'sqlite'
+    if not isinstance(parametros, dict):
+        parametros = tuple(parametros)
+    sentencia = ('EXPLAIN QUERY PLAN ' if es_sqlite else 'EXPLAIN ') + sql
+    if conexion is not None:
+        cursor = conexion.cursor()
+        try:
+            cursor.execute(sentencia, parametros)
+            filas = cursor.fetchall()
+        finally:
+            cursor.close()
+    else:
+        with db.engine.connect() as conn:
+            filas = conn.exec_driver_sql(sentencia, parametros).fetchall()
+    # SQLite: (id, padre, -, detalle); PostgreSQL: una columna de texto por línea
+    return [fila[-1] if es_sqlite else fila[0] for fila in filas]
 
 
 def _asegurar_gateway_row():
@@ -128,32 +921,29 @@ def guardar_dato_sensor(temperatura=None, humedad=None, soil_moisture=None, ligh
         Exception: Si hay error al guardar
     """
     try:
-        if timestamp is None:
-            timestamp = int(datetime.now().timestamp())
-        
-        # Convertir a float sólo si no es None
-        temp_val = float(temperatura) if temperatura is not None else None
-        hum_val = float(humedad) if humedad is not None else None
-        soil_val = float(soil_moisture) if soil_moisture is not None else None
-        light_val = float(light) if light is not None else None
-        percentage = float(percentage) if percentage is not None else None
-        lat_val = float(lat) if lat is not None else None
-        lon_val = float(lon) if lon is not None else None
-
-        nuevo_dato = DatosSensor(
-            temperatura=temp_val,
-            humedad=hum_val,
-            soil_moisture=soil_val,
-            light=light_val,
+        valores = _valores_dato(
+            temperatura=temperatura,
+            humedad=humedad,
+            soil_moisture=soil_moisture,
+            light=light,
             percentage=percentage,
-            lat=lat_val,
-            lon=lon_val,
-            nodeId=node_id,
-            timestamp=timestamp
+            node_id=node_id,
+            timestamp=timestamp,
+            lat=lat,
+            lon=lon
         )
-        
+        movimientos = _actualizar_trayectos([valores])
+        nuevo_dato = DatosSensor(**valores)
+        nuevo_dato.movimiento = bool(movimientos)
+
         db.session.add(nuevo_dato)
+        # flush asigna id y fecha_creacion, necesarios para los resúmenes de la misma transacción
+        db.session.flush()
+        fila = _fila_dato(nuevo_dato)
+        _registrar_agregados([fila])
         db.session.commit()
+        cache.registrar([_dato_desligado(fila)])
+        version_datos.incrementar()
         
         return nuevo_dato
     except Exception as e:
@@ -161,6 +951,140 @@ def guardar_dato_sensor(temperatura=None, humedad=None, soil_moisture=None, ligh
         raise e
 
 
+def _fila_dato(dato):
+    """Columnas de un DatosSensor como dict (mismo formato que las filas de RETURNING)."""
+    return {c.key: getattr(dato, c.key) for c in DatosSensor.__table__.c}
+
+
+def _valores_dato(temperatura=None, humedad=None, soil_moisture=None, light=None, percentage=None,
+                  node_id='unknown', timestamp=None, lat=None, lon=None):
+    """
+    Convierte los argumentos de guardar_dato_sensor en columnas de DatosSensor
+
+    fecha_creacion se fija aquí (y no con el default del modelo al insertar) porque el
+    trayecto del nodo se actualiza antes del INSERT.
+    """
+    if timestamp is None:
+        timestamp = int(datetime.now().timestamp())
+
+    # Convertir a float sólo si no es None
+    return {
+        'temperatura': float(temperatura) if temperatura is not None else None,
+        'humedad': float(humedad) if humedad is not None else None,
+        'soil_moisture': float(soil_moisture) if soil_moisture is not None else None,
+        'light': float(light) if light is not None else None,
+        'percentage': float(percentage) if percentage is not None else None,
+        'lat': float(lat) if lat is not None else None,
+        'lon': float(lon) if lon is not None else None,
+        'geohash': geo.geohash(float(lat), float(lon)) if lat is not None and lon is not None else None,
+        'nodeId': node_id,
+        'timestamp': timestamp,
+        'fecha_creacion': datetime.now(timezone.utc)
+    }
+
+
+def guardar_datos_sensor_lote(registros):
+    """
+    Guarda varios datos de sensor en una única transacción (INSERT multi-fila)
+
+    Args:
+        registros: Lista de dicts con los mismos argumentos que guardar_dato_sensor
+
+    Returns:
+        list: Objetos DatosSensor guardados, en el mismo orden que registros.
+              Son objetos desligados de la sesión: no vuelven a consultar la BD al leerlos.
+
+    Raises:
+        Exception: Si hay error al guardar (no se guarda ninguna fila)
+    """
+    if not registros:
+        return []
+    try:
+        filas = [_valores_dato(**r) for r in registros]
+        movimientos = _actualizar_trayectos(filas)
+        if len(filas) >= UMBRAL_COPY and db.session.get_bind().dialect.name == 'postgresql':
+            filas_guardadas = _insertar_con_copy(filas)
+        else:
+            tabla = DatosSensor.__table__
+            resultado = db.session.execute(
+                insert(tabla).returning(*tabla.c, sort_by_parameter_order=True),
+                filas
+            )
+            filas_guardadas = [fila._mapping for fila in resultado]
+        _registrar_agregados(filas_guardadas)
+        nuevos = [DatosSensor(**fila) for fila in filas_guardadas]
+        for i in movimientos:
+            nuevos[i].movimiento = True
+        db.session.commit()
+        cache.registrar(nuevos)
+        version_datos.incrementar()
+        return nuevos
+    except Exception as e:
+        db.session.rollback()
+        raise e
+
+
+# Lotes desde este tamaño se cargan con COPY en PostgreSQL (por debajo compensa el INSERT multi-fila)
+UMBRAL_COPY = 500
+_TABLA_CARGA = '_carga_datos_sensor'
+
+
+def _insertar_con_copy(filas):
+    """
+    Inserta un lote en PostgreSQL con COPY a una tabla temporal y un INSERT ... SELECT ... RETURNING
+
+    Args:
+        filas: Lista de dicts de _valores_dato
+
+    Returns:
+        list: Mappings de las filas insertadas, en el mismo orden que filas
+    """
+    tabla = DatosSensor.__table__
+    columnas = [c for c in tabla.columns if c is not tabla.c.id]
+    conexion = db.session.connection()
+    preparador = conexion.dialect.identifier_preparer
+    definicion = ', '.join(f'{preparador.format_column(c)} {c.type.compile(dialect=conexion.dialect)}'
+                           for c in columnas)
+    # Temporal de la sesión; se vacía sola al hacer commit
+    conexion.exec_driver_sql(f'CREATE TEMP TABLE IF NOT EXISTS {_TABLA_CARGA} (orden INTEGER, {definicion}) '
+                             f'ON COMMIT DELETE ROWS')
+
+    # fecha_creacion la pone el default de Python del modelo, que COPY no ejecuta
+    ahora = datetime.now(timezone.utc).replace(tzinfo=None)
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    for orden, fila in enumerate(filas):
+        valores = [(fila.get(c.key) or ahora).isoformat() if c is tabla.c.fecha_creacion else fila.get(c.key)
+                   for c in columnas]
+        # En CSV de COPY un campo vacío sin comillas es NULL
+        escritor.writerow([orden] + ['' if v is None else v for v in valores])
+    buffer.seek(0)
+
+    nombres = ', '.join(preparador.format_column(c) for c in columnas)
+    sql_copy = f'COPY {_TABLA_CARGA} (orden, {nombres}) FROM STDIN WITH (FORMAT csv)'
+    cursor = conexion.connection.cursor()
+    try:
+        if hasattr(cursor, 'copy_expert'):
+            # psycopg2
+            cursor.copy_expert(sql_copy, buffer)
+        else:
+            # psycopg 3
+            with cursor.copy(sql_copy) as copia:
+                copia.write(buffer.getvalue())
+    finally:
+        cursor.close()
+
+    carga = table(_TABLA_CARGA, column('orden'), *[column(c.name) for c in columnas])
+    resultado = conexion.execute(
+        insert(tabla).from_select(
+            [c.name for c in columnas],
+            select(*[carga.c[c.name] for c in columnas]).order_by(carga.c.orden)
+        ).returning(*tabla.c)
+    )
+    # La secuencia asigna los id en el orden del SELECT
+    return sorted((fila._mapping for fila in resultado), key=lambda f: f['id'])
+
+
 def obtener_todos_datos(limit=100):
     """
     Obtiene los últimos N datos ordenados por fecha
@@ -171,6 +1095,9 @@ def obtener_todos_datos(limit=100):
     Returns:
         list: Lista de objetos DatosSensor
     """
+    datos = _ultimos_cacheados(limit)
+    if datos is not None:
+        return datos
     return DatosSensor.query.order_by(DatosSensor.fecha_creacion.desc()).limit(limit).all()
 
 
@@ -186,6 +1113,10 @@ def obtener_datos_paginados(limit=100, offset=0, node_id=None):
     Returns:
         list: Lista de objetos DatosSensor
     """
+    datos = _ultimos_cacheados(limit, offset, node_id or None)
+    if datos is not None:
+        return datos
+
     query = DatosSensor.query.order_by(DatosSensor.fecha_creacion.desc())
     
     if node_id:
@@ -194,9 +1125,72 @@ def obtener_datos_paginados(limit=100, offset=0, node_id=None):
     return query.offset(offset).limit(limit).all()
 
 
+def obtener_datos_cursor(limit=100, cursor=None, node_id=None):
+    """
+    Obtiene datos con paginación por cursor (keyset) sobre (fecha_creacion, id)
+
+    A diferencia de obtener_datos_paginados, el costo de una página no depende de
+    cuántas filas se hayan recorrido antes: la consulta arranca en el cursor usando el índice.
+
+    Args:
+        limit: Número de registros por página
+        cursor: Cursor opaco devuelto por la página anterior (None para la primera)
+        node_id: Filtrar por ID de nodo (opcional)
+
+    Returns:
+        tuple: (lista de DatosSensor, next_cursor o None si no hay más páginas)
+
+    Raises:
+        ValueError: Si el cursor o limit no son válidos
+    """
+    _validar_limite(limit)
+    query = DatosSensor.query.filter(*_filtros_cursor(cursor, node_id)) \
+        .order_by(DatosSensor.fecha_creacion.desc(), DatosSensor.id.desc())
+    # Pedir una fila extra para saber si hay página siguiente
+    return _pagina_cursor(query.limit(limit + 1).all(), limit)
+
+
+def _validar_limite(limit):
+    # Con limit < 1 no hay última fila de la que sacar el cursor siguiente
+    if isinstance(limit, bool) or not isinstance(limit, int) or limit < 1:
+        raise ValueError('limit debe ser un entero positivo')
+
+
+def _filtros_cursor(cursor, node_id):
+    filtros = []
+    if node_id:
+        filtros.append(DatosSensor.nodeId == node_id)
+    if cursor:
+        fecha, id_dato = _decodificar_cursor(cursor)
+        filtros.append(tuple_(DatosSensor.fecha_creacion, DatosSensor.id) < tuple_(fecha, id_dato))
+    return filtros
+
+
+def _pagina_cursor(datos, limit):
+    """Recorta la fila extra pedida y calcula el cursor de la página siguiente."""
+    if len(datos) > limit:
+        datos = datos[:limit]
+        return datos, _codificar_cursor(datos[-1])
+    return datos, None
+
+
+def _codificar_cursor(dato):
+    crudo = json.dumps([dato.fecha_creacion.isoformat(), dato.id])
+    return base64.urlsafe_b64encode(crudo.encode()).decode().rstrip('=')
+
+
+def _decodificar_cursor(cursor):
+    try:
+        relleno = '=' * (-len(cursor) % 4)
+        fecha, id_dato = json.loads(base64.urlsafe_b64decode(cursor + relleno))
+        return datetime.fromisoformat(fecha), int(id_dato)
+    except Exception:
+        raise ValueError('Cursor inválido')
+
+
 def obtener_datos_por_fecha(fecha_inicio, fecha_fin):
     """
-    Obtiene datos dentro de un rango de fechas
+    Obtiene datos dentro de un rango de fechas (tabla viva y archivos mensuales que toque)
     
     Args:
         fecha_inicio: datetime objeto de inicio
@@ -205,44 +1199,284 @@ def obtener_datos_por_fecha(fecha_inicio, fecha_fin):
     Returns:
         list: Lista de objetos DatosSensor
     """
-    return DatosSensor.query.filter(
+    # Solo los archivos mensuales que toca el rango; siempre son anteriores a la tabla viva
+    datos = [_dato_desligado(fila) for filas in _filas_archivadas(fecha_inicio, fecha_fin) for fila in filas]
+    datos.extend(DatosSensor.query.filter(
         DatosSensor.fecha_creacion.between(fecha_inicio, fecha_fin)
-    ).order_by(DatosSensor.fecha_creacion).all()
+    ).order_by(DatosSensor.fecha_creacion).all())
+    return datos
+
+
+def iterar_datos(node_id=None, campos=None, fecha_inicio=None, fecha_fin=None, tamano_bloque=5000):
+    """
+    Recorre datos en orden cronológico por bloques, sin cargar todo en memoria ni crear objetos ORM
+    Incluye los archivos mensuales que se solapan con el rango.
+
+    Args:
+        node_id: Filtrar por ID de nodo (opcional)
+        campos: Campos de sensor a incluir (por defecto todos); solo filas con alguno de ellos no nulo
+        fecha_inicio: datetime de inicio, inclusive (opcional)
+        fecha_fin: datetime de fin, inclusive (opcional)
+        tamano_bloque: Filas por bloque leído del cursor
+
+    Yields:
+        list: Bloques de filas (tuplas: id, nodeId, timestamp, fecha_creacion, lat, lon, *campos)
+    """
+    campos = list(campos or CAMPOS_SENSOR)
+    tabla = DatosSensor.__table__
+    consulta = select(
+        tabla.c.id, tabla.c.nodeId, tabla.c.timestamp, tabla.c.fecha_creacion, tabla.c.lat, tabla.c.lon,
+        *[tabla.c[c] for c in campos]
+    ).order_by(tabla.c.fecha_creacion, tabla.c.id)
+    if node_id:
+        consulta = consulta.where(tabla.c.nodeId == node_id)
+    if fecha_inicio:
+        consulta = consulta.where(tabla.c.fecha_creacion >= fecha_inicio)
+    if fecha_fin:
+        consulta = consulta.where(tabla.c.fecha_creacion <= fecha_fin)
+    if len(campos) < len(CAMPOS_SENSOR):
+        consulta = consulta.where(or_(*[tabla.c[c].isnot(None) for c in campos]))
+    nombres = ('id', 'nodeId', 'timestamp', 'fecha_creacion', 'lat', 'lon', *campos)
+    filtrar = len(campos) < len(CAMPOS_SENSOR)
+    bloque = []
+    for filas in _filas_archivadas(fecha_inicio, fecha_fin, node_id, columnas=nombres, tamano_bloque=tamano_bloque):
+        for fila in filas:
+            if not filtrar or any(fila[c] is not None for c in campos):
+                bloque.append(tuple(fila[c] for c in nombres))
+        if len(bloque) >= tamano_bloque:
+            yield bloque
+            bloque = []
+    if bloque:
+        yield bloque
+    consulta = consulta.execution_options(stream_results=True, yield_per=tamano_bloque)
+    for bloque in db.session.execute(consulta).partitions():
+        yield bloque
 
 
 def obtener_estadisticas():
     """
-    Calcula estadísticas de temperatura y humedad
+    Devuelve estadísticas de todos los campos desde los agregados acumulados (sin recorrer datos_sensor)
     
     Returns:
-        dict: Diccionario con promedios, máximos y mínimos
-    """
-    stats = db.session.query(
-        func.avg(DatosSensor.temperatura).label('temp_promedio'),
-        func.max(DatosSensor.temperatura).label('temp_maxima'),
-        func.min(DatosSensor.temperatura).label('temp_minima'),
-        func.avg(DatosSensor.humedad).label('hum_promedio'),
-        func.max(DatosSensor.humedad).label('hum_maxima'),
-        func.min(DatosSensor.humedad).label('hum_minima'),
-        func.count(DatosSensor.id).label('total_registros')
-    ).one()
+        dict: Por campo: promedio, máxima, mínima, desviación y cantidad (global);
+              'por_nodo' con lo mismo para cada nodo, total de registros y último registro
+    """
+    globales = {}
+    por_nodo = {}
+    total_registros = 0
+    for est in EstadisticaCampo.query.all():
+        if est.campo == CAMPO_REGISTROS:
+            if est.nodeId == NODO_GLOBAL:
+                total_registros = est.cantidad
+            continue
+        if est.nodeId == NODO_GLOBAL:
+            globales[est.campo] = est.resumen()
+        else:
+            por_nodo.setdefault(est.nodeId, {})[est.campo] = est.resumen()
+
+    vacio = {'promedio': 0, 'maxima': 0, 'minima': 0, 'desviacion': 0, 'cantidad': 0}
+    resultado = {campo: globales.get(campo, dict(vacio)) for campo in CAMPOS_SENSOR}
     
-    ultimo_registro = DatosSensor.query.order_by(DatosSensor.fecha_creacion.desc()).first()
+    ultimo_registro = obtener_ultimo_dato()
     
-    return {
-        'temperatura': {
-            'promedio': float(stats.temp_promedio) if stats.temp_promedio else 0,
-            'maxima': float(stats.temp_maxima) if stats.temp_maxima else 0,
-            'minima': float(stats.temp_minima) if stats.temp_minima else 0
-        },
-        'humedad': {
-            'promedio': float(stats.hum_promedio) if stats.hum_promedio else 0,
-            'maxima': float(stats.hum_maxima) if stats.hum_maxima else 0,
-            'minima': float(stats.hum_minima) if stats.hum_minima else 0
-        },
-        'total_registros': stats.total_registros,
+    resultado.update({
+        'por_nodo': por_nodo,
+        'total_registros': total_registros,
         'ultimo_registro': ultimo_registro.to_dict() if ultimo_registro else None
+    })
+    return resultado
+
+
+def _acumular_estadisticas(acumulado, fila):
+    """Suma una fila al dict {(nodo, campo): [n, suma, suma_cuadrados, min, max]} (nodo y global)."""
+    nodos = (NODO_GLOBAL,) if fila['nodeId'] is None else (NODO_GLOBAL, fila['nodeId'])
+    for campo in CAMPOS_SENSOR + (CAMPO_REGISTROS,):
+        valor = fila[campo] if campo != CAMPO_REGISTROS else 0.0
+        if valor is None:
+            continue
+        for node_id in nodos:
+            agregado = acumulado.get((node_id, campo))
+            if agregado is None:
+                acumulado[(node_id, campo)] = [1, valor, valor * valor, valor, valor]
+            else:
+                agregado[0] += 1
+                agregado[1] += valor
+                agregado[2] += valor * valor
+                if valor < agregado[3]:
+                    agregado[3] = valor
+                if valor > agregado[4]:
+                    agregado[4] = valor
+
+
+def _upsert_estadisticas(acumulado):
+    _upsert_sumando(EstadisticaCampo, [
+        {'nodeId': node_id, 'campo': campo, 'cantidad': n, 'suma': suma, 'suma_cuadrados': suma_cuadrados,
+         'minimo': minimo, 'maximo': maximo}
+        for (node_id, campo), (n, suma, suma_cuadrados, minimo, maximo) in acumulado.items()
+    ], sumar=('cantidad', 'suma', 'suma_cuadrados'))
+
+
+def _actualizar_estadisticas(filas):
+    acumulado = {}
+    for fila in filas:
+        _acumular_estadisticas(acumulado, fila)
+    _upsert_estadisticas(acumulado)
+
+
+def _descontar_estadisticas(fila):
+    """Resta una fila borrada de los agregados; min/max solo se recalculan si la fila era el extremo."""
+    nodos = (NODO_GLOBAL,) if fila['nodeId'] is None else (fila['nodeId'], NODO_GLOBAL)
+    for campo in CAMPOS_SENSOR + (CAMPO_REGISTROS,):
+        valor = fila[campo] if campo != CAMPO_REGISTROS else 0.0
+        if valor is None:
+            continue
+        # Primero el nodo: el extremo global se recalcula a partir de los extremos por nodo
+        for node_id in nodos:
+            est = db.session.get(EstadisticaCampo, (node_id, campo))
+            if est is None:
+                continue
+            est.cantidad -= 1
+            if est.cantidad <= 0:
+                db.session.delete(est)
+                db.session.flush()
+                continue
+            est.suma -= valor
+            est.suma_cuadrados -= valor * valor
+            if campo != CAMPO_REGISTROS and (valor == est.minimo or valor == est.maximo):
+                est.minimo, est.maximo = _extremos_campo(node_id, campo)
+            db.session.flush()
+
+
+def _extremos_campo(node_id, campo):
+    """
+    (min, max) actuales de un campo, de las mismas fuentes que _agregados_desde_datos
+    Los de un nodo salen de la tabla viva y los archivos; el global, de las filas por nodo
+    de estadistica_campo más las lecturas sin nodeId (vivas y archivadas).
+    """
+    tabla = DatosSensor.__table__
+    columna = tabla.c[campo]
+    extremos = []
+    if node_id == NODO_GLOBAL:
+        extremos.append(db.session.query(func.min(EstadisticaCampo.minimo), func.max(EstadisticaCampo.maximo))
+                        .filter(EstadisticaCampo.campo == campo, EstadisticaCampo.nodeId != NODO_GLOBAL).one())
+        # Las filas sin nodeId solo cuentan en el global
+        node_id = None
+    consulta = select(func.min(columna), func.max(columna)).where(
+        tabla.c.nodeId.is_(None) if node_id is None else tabla.c.nodeId == node_id)
+    for ejecutar in _fuentes_datos():
+        extremos.append(tuple(ejecutar(consulta).one()))
+    for _, _, ruta in particiones_archivadas():
+        if not _es_columnar(ruta):
+            continue
+        for filas in columnar.abrir(ruta).iterar(node_id=node_id, filtrar_nodo=True, columnas=(campo,)):
+            valores = [f[campo] for f in filas if f[campo] is not None]
+            if valores:
+                extremos.append((min(valores), max(valores)))
+    minimos = [e[0] for e in extremos if e[0] is not None]
+    maximos = [e[1] for e in extremos if e[1] is not None]
+    return (min(minimos) if minimos else None), (max(maximos) if maximos else None)
+
+
+def _agregados_desde_datos():
+    """
+    Recalcula los agregados de EstadisticaCampo directamente desde los datos (GROUP BY nodo)
+    Suma la tabla viva y los archivos mensuales: los agregados cubren toda la historia
+    (los archivos columnares se recorren fila a fila).
+    """
+    tabla = DatosSensor.__table__
+    consultas = []
+    for campo in CAMPOS_SENSOR + (CAMPO_REGISTROS,):
+        if campo == CAMPO_REGISTROS:
+            columnas = (func.count(tabla.c.id), func.sum(0.0), func.sum(0.0), func.min(0.0), func.max(0.0))
+            filtro = []
+        else:
+            c = tabla.c[campo]
+            columnas = (func.count(c), func.sum(c), func.sum(c * c), func.min(c), func.max(c))
+            filtro = [c.isnot(None)]
+        consultas.append((campo, select(tabla.c.nodeId, *columnas).where(*filtro).group_by(tabla.c.nodeId)))
+
+    agregados = {}
+
+    def acumular(clave, n, suma, suma_cuadrados, minimo, maximo):
+        actual = agregados.get(clave)
+        if actual is None:
+            agregados[clave] = [n, suma, suma_cuadrados, minimo, maximo]
+        else:
+            agregados[clave] = [actual[0] + n, actual[1] + suma, actual[2] + suma_cuadrados,
+                                min(actual[3], minimo), max(actual[4], maximo)]
+
+    for ejecutar in _fuentes_datos():
+        for campo, consulta in consultas:
+            for node_id, n, suma, suma_cuadrados, minimo, maximo in ejecutar(consulta):
+                if not n:
+                    continue
+                if node_id is not None:
+                    acumular((node_id, campo), n, suma, suma_cuadrados, minimo, maximo)
+                acumular((NODO_GLOBAL, campo), n, suma, suma_cuadrados, minimo, maximo)
+    columnares = {}
+    for filas in _filas_archivadas(columnas=CAMPOS_SENSOR, solo_columnar=True):
+        for fila in filas:
+            _acumular_estadisticas(columnares, fila)
+    for clave, valores in columnares.items():
+        acumular(clave, *valores)
+    return agregados
+
+
+def reconstruir_estadisticas():
+    """
+    Reconstruye estadistica_campo desde datos_sensor
+
+    Returns:
+        int: Número de agregados (nodo, campo) guardados
+    """
+    try:
+        db.session.query(EstadisticaCampo).delete()
+        agregados = _agregados_desde_datos()
+        _upsert_estadisticas(agregados)
+        db.session.commit()
+        version_datos.incrementar()
+        return len(agregados)
+    except Exception as e:
+        db.session.rollback()
+        raise e
+
+
+def verificar_estadisticas(tolerancia=1e-6):
+    """
+    Compara los agregados acumulados con un recálculo desde cero
+
+    Args:
+        tolerancia: Error relativo admitido en sumas (por redondeo de punto flotante)
+
+    Returns:
+        list: Diferencias encontradas como dicts {nodeId, campo, esperado, guardado}; vacía si son consistentes
+    """
+    esperado = _agregados_desde_datos()
+    guardado = {
+        (e.nodeId, e.campo): [e.cantidad, e.suma, e.suma_cuadrados, e.minimo, e.maximo]
+        for e in EstadisticaCampo.query.all()
     }
+    diferencias = []
+    for clave in set(esperado) | set(guardado):
+        a, b = esperado.get(clave), guardado.get(clave)
+        iguales = a is not None and b is not None and a[0] == b[0] and all(
+            math.isclose(x, y, rel_tol=tolerancia, abs_tol=tolerancia) for x, y in zip(a[1:], b[1:])
+        )
+        if not iguales:
+            diferencias.append({'nodeId': clave[0], 'campo': clave[1], 'esperado': a, 'guardado': b})
+    return diferencias
+
+
+def _asegurar_estadisticas():
+    """Rellena estadistica_campo la primera vez que se arranca con una base que ya tenía datos."""
+    try:
+        if db.session.query(EstadisticaCampo.campo).first() is None and \
+                db.session.query(DatosSensor.id).first() is not None:
+            n = reconstruir_estadisticas()
+            log.info('Estadísticas reconstruidas (%d agregados)', n)
+    except Exception as e:
+        db.session.rollback()
+        log.warning('No se pudieron reconstruir las estadísticas: %s', e)
 
 
 def contar_registros(node_id=None):
@@ -255,10 +1489,9 @@ def contar_registros(node_id=None):
     Returns:
         int: Número de registros
     """
-    query = DatosSensor.query
-    if node_id:
-        query = query.filter_by(nodeId=node_id)
-    return query.count()
+    if not node_id:
+        return cache.obtener('total', lambda: DatosSensor.query.count())
+    return DatosSensor.query.filter_by(nodeId=node_id).count()
 
 
 def obtener_ultimo_dato(node_id=None):
@@ -271,6 +1504,9 @@ def obtener_ultimo_dato(node_id=None):
     Returns:
         DatosSensor: Último registro o None
     """
+    datos = _ultimos_cacheados(1, 0, node_id or None)
+    if datos is not None:
+        return datos[0] if datos else None
     query = DatosSensor.query.order_by(DatosSensor.fecha_creacion.desc())
     if node_id:
         query = query.filter_by(nodeId=node_id)
@@ -282,20 +1518,8 @@ def obtener_nodos_unicos():
     Obtiene lista de IDs de nodos únicos (excluye el id especial 'gateway')
     Normaliza los IDs eliminando duplicados por mayúsculas/minúsculas y espacios
     """
-    # Obtener todos los nodos distintos de la BD
-    nodos_raw = [row[0] for row in db.session.query(DatosSensor.nodeId).distinct().all() if row[0]]
-    
-    # Usar un set para evitar duplicados, normalizando espacios
-    nodos_set = set()
-    for nodo in nodos_raw:
-        # Limpiar espacios en blanco al inicio y final
-        nodo_limpio = str(nodo).strip()
-        # Excluir 'gateway' (case-insensitive)
-        if nodo_limpio and nodo_limpio.lower() != 'gateway':
-            nodos_set.add(nodo_limpio)
-    
-    # Convertir a lista ordenada
-    return sorted(list(nodos_set))
+    # Las claves del resumen (cacheado) ya están normalizadas, sin duplicados y ordenadas
+    return list(obtener_resumen_nodos())
 
 
 def obtener_campos_nodo(node_id):
@@ -353,14 +1577,85 @@ def eliminar_dato(dato_id):
         if not dato:
             return False
         
+        fila = _fila_dato(dato)
         db.session.delete(dato)
+        db.session.flush()
+        _descontar_agregados(fila)
         db.session.commit()
+        cache.descontar(fila)
+        version_datos.incrementar()
         return True
     except Exception as e:
         db.session.rollback()
         raise e
 
 
+# ==================== Listados como tuplas (respuestas masivas) ====================
+
+_valores_de_dato = attrgetter(*FilaDato._fields)
+_valores_de_mapping = itemgetter(*FilaDato._fields)
+
+
+def _seleccionar_filas():
+    """SELECT de las columnas de FilaDato: filas como tuplas, sin objetos ORM ni identity map."""
+    tabla = DatosSensor.__table__
+    return select(*[tabla.c[c] for c in FilaDato._fields])
+
+
+def _a_filas(resultado):
+    return [fila_dato(fila) for fila in resultado]
+
+
+def obtener_filas_paginadas(limit=100, offset=0, node_id=None):
+    """
+    Como obtener_datos_paginados, pero devuelve tuplas FilaDato (más baratas de crear y serializar)
+
+    Returns:
+        list: FilaDato ordenadas de la más reciente a la más antigua
+    """
+    datos = _ultimos_cacheados(limit, offset, node_id or None)
+    if datos is not None:
+        return [fila_dato(_valores_de_dato(d)) for d in datos]
+    tabla = DatosSensor.__table__
+    consulta = _seleccionar_filas().order_by(tabla.c.fecha_creacion.desc()).offset(offset).limit(limit)
+    if node_id:
+        consulta = consulta.where(tabla.c.nodeId == node_id)
+    return _a_filas(db.session.execute(consulta))
+
+
+def obtener_filas_cursor(limit=100, cursor=None, node_id=None):
+    """
+    Como obtener_datos_cursor, pero devuelve tuplas FilaDato
+
+    Returns:
+        tuple: (lista de FilaDato, next_cursor o None si no hay más páginas)
+
+    Raises:
+        ValueError: Si el cursor o limit no son válidos
+    """
+    _validar_limite(limit)
+    consulta = _seleccionar_filas().where(*_filtros_cursor(cursor, node_id)) \
+        .order_by(DatosSensor.fecha_creacion.desc(), DatosSensor.id.desc()).limit(limit + 1)
+    return _pagina_cursor(_a_filas(db.session.execute(consulta)), limit)
+
+
+def obtener_filas_por_fecha(fecha_inicio, fecha_fin):
+    """
+    Como obtener_datos_por_fecha (incluye los archivos mensuales), pero devuelve tuplas FilaDato
+
+    Returns:
+        list: FilaDato en orden cronológico
+    """
+    filas = [fila_dato(_valores_de_mapping(fila))
+             for bloque in _filas_archivadas(fecha_inicio, fecha_fin) for fila in bloque]
+    tabla = DatosSensor.__table__
+    filas.extend(_a_filas(db.session.execute(
+        _seleccionar_filas().where(tabla.c.fecha_creacion.between(fecha_inicio, fecha_fin))
+        .order_by(tabla.c.fecha_creacion)
+    )))
+    return filas
+
+
 # ==================== Ubicación por nodo ====================
 
 def obtener_ultima_ubicacion(node_id):
@@ -379,6 +1674,1093 @@ def obtener_ultima_ubicacion(node_id):
     }
 
 
+
+# ==================== Consultas espaciales (geohash) ====================
+
+def _filtro_caja(tabla, sur, oeste, norte, este):
+    """Caja sin cruzar el antimeridiano: rangos de geohash (recorren el índice) y lat/lon exactos."""
+    rangos = [tabla.c.geohash >= desde if hasta is None else and_(tabla.c.geohash >= desde, tabla.c.geohash < hasta)
+              for desde, hasta in geo.rangos_caja(sur, oeste, norte, este)]
+    return and_(or_(*rangos), tabla.c.lat.between(sur, norte), tabla.c.lon.between(oeste, este))
+
+
+def _filtro_cajas(tabla, cajas):
+    return or_(*[_filtro_caja(tabla, *caja) for caja in cajas])
+
+
+def obtener_nodos_en_area(sur, oeste, norte, este):
+    """
+    Última ubicación de los nodos que están dentro de una caja (la vista del mapa)
+
+    Busca en estado_nodo por rangos de geohash, así que el costo depende de los nodos
+    visibles y no del total. Una caja con oeste > este cruza el antimeridiano.
+
+    Returns:
+        dict: {nodeId: {lat, lon, fecha}}
+
+    Raises:
+        ValueError: Si la caja no es válida
+    """
+    tabla = EstadoNodo.__table__
+    consulta = select(tabla.c.nodeId, tabla.c.lat, tabla.c.lon, tabla.c.fecha_ubicacion) \
+        .where(_filtro_cajas(tabla, geo.normalizar_caja(sur, oeste, norte, este))) \
+        .order_by(tabla.c.fecha_ubicacion)
+    ubicaciones = {}
+    for node_id, lat, lon, fecha in db.session.execute(consulta):
+        node_id = _normalizar_node_id(node_id)
+        if node_id is None:
+            continue
+        # IDs que solo difieren en espacios: gana la ubicación más reciente, como en el resumen
+        ubicaciones[node_id] = {
+            'lat': float(lat),
+            'lon': float(lon),
+            'fecha': fecha.strftime('%Y-%m-%d %H:%M:%S %Z') if fecha else None
+        }
+    return dict(sorted(ubicaciones.items()))
+
+
+def obtener_lecturas_en_radio(lat, lon, radio_m, limit=500, node_id=None, fecha_inicio=None, fecha_fin=None):
+    """
+    Lecturas tomadas a menos de radio_m metros de un punto, de la más reciente a la más antigua
+
+    Solo la tabla viva (lo archivado no se consulta por ubicación). Primero lee id, fecha
+    y ubicación de ix_datos_sensor_geohash (rangos de geohash, caja del círculo y una
+    distancia aproximada) sin ORDER BY: ordenar en la consulta hace que SQLite prefiera
+    recorrer ix_datos_sensor_fecha entero. Aquí calcula la distancia exacta (haversine),
+    se queda con las limit más recientes y después lee solo esas filas por id.
+
+    Args:
+        lat, lon: Centro en grados
+        radio_m: Radio en metros
+        limit: Máximo de lecturas
+        node_id: Filtrar por ID de nodo (opcional)
+        fecha_inicio, fecha_fin: datetime (opcionales, inclusive)
+
+    Returns:
+        list: Tuplas (FilaDato, distancia en metros)
+    """
+    tabla = DatosSensor.__table__
+    cajas = geo.caja_radio(lat, lon, radio_m)
+    consulta = select(tabla.c.id, tabla.c.fecha_creacion, tabla.c.lat, tabla.c.lon).where(_filtro_cajas(tabla, cajas))
+    if len(cajas) == 1:
+        # Distancia equirectangular en grados de latitud, con holgura para el redondeo
+        escala = math.cos(math.radians(lat))
+        dlat, dlon = tabla.c.lat - lat, (tabla.c.lon - lon) * escala
+        consulta = consulta.where(dlat * dlat + dlon * dlon <= (radio_m * 1.01 / geo.METROS_POR_GRADO) ** 2)
+    if node_id:
+        consulta = consulta.where(tabla.c.nodeId == node_id)
+    if fecha_inicio:
+        consulta = consulta.where(tabla.c.fecha_creacion >= fecha_inicio)
+    if fecha_fin:
+        consulta = consulta.where(tabla.c.fecha_creacion <= fecha_fin)
+    candidatos = (
+        (fecha or datetime.min, dato_id, distancia)
+        for dato_id, fecha, la, lo in db.session.execute(consulta.execution_options(yield_per=10000))
+        for distancia in (geo.distancia_m(lat, lon, la, lo),) if distancia <= radio_m
+    )
+    elegidos = heapq.nlargest(limit, candidatos)
+    if not elegidos:
+        return []
+    filas = {fila.id: fila for fila in _a_filas(db.session.execute(
+        _seleccionar_filas().where(tabla.c.id.in_([dato_id for _, dato_id, _ in elegidos]))))}
+    # Una fila borrada entre las dos consultas simplemente no sale
+    return [(filas[dato_id], distancia) for _, dato_id, distancia in elegidos if dato_id in filas]
+
+
+def reconstruir_geohash(tamano_lote=5000):
+    """
+    Calcula el geohash de las filas con ubicación que no lo tienen (datos anteriores a la columna)
+
+    Recorre datos_sensor por id en lotes con su propio commit, así que se puede
+    interrumpir y volver a ejecutar. Después recalcula el de estado_nodo.
+
+    Returns:
+        int: Filas de datos_sensor actualizadas
+    """
+    tabla = DatosSensor.__table__
+    actualizar = tabla.update().where(tabla.c.id == bindparam('_id')).values(geohash=bindparam('_geohash'))
+    total = 0
+    ultimo_id = 0
+    try:
+        while True:
+            filas = db.session.execute(
+                select(tabla.c.id, tabla.c.lat, tabla.c.lon)
+                .where(tabla.c.id > ultimo_id, tabla.c.geohash.is_(None),
+                       tabla.c.lat.isnot(None), tabla.c.lon.isnot(None))
+                .order_by(tabla.c.id).limit(tamano_lote)
+            ).all()
+            if not filas:
+                break
+            db.session.execute(actualizar, [{'_id': i, '_geohash': geo.geohash(la, lo)} for i, la, lo in filas])
+            db.session.commit()
+            ultimo_id = filas[-1][0]
+            total += len(filas)
+        for estado in EstadoNodo.query.filter(EstadoNodo.lat.isnot(None), EstadoNodo.lon.isnot(None)):
+            estado.geohash = geo.geohash(estado.lat, estado.lon)
+        db.session.commit()
+        version_datos.incrementar()
+        return total
+    except Exception as e:
+        db.session.rollback()
+        raise e
+
+
+def _asegurar_geohash(agregadas):
+    """Rellena el geohash la primera vez que se arranca después de añadir la columna."""
+    if not agregadas & {(DatosSensor.__tablename__, 'geohash'), (EstadoNodo.__tablename__, 'geohash')}:
+        return
+    try:
+        n = reconstruir_geohash()
+        log.info('Geohash calculado para %d lecturas', n)
+    except Exception as e:
+        db.session.rollback()
+        log.warning('No se pudo calcular el geohash: %s', e)
+
+
+# ==================== Trayectos por nodo ====================
+
+def _ultimo_punto(node_id):
+    return PuntoTrayecto.query.filter(PuntoTrayecto.nodeId == node_id) \
+        .order_by(PuntoTrayecto.fecha_inicio.desc(), PuntoTrayecto.id.desc()).first()
+
+
+def _bloquear_trayectos(node_ids):
+    """
+    Serializa hasta el fin de la transacción la actualización del trayecto de estos nodos
+
+    Sin esto, dos escrituras concurrentes del mismo nodo leen el mismo último punto y las
+    dos lo alargan o abren uno nuevo. En PostgreSQL toma un advisory lock de transacción
+    por nodo (en orden, para que dos lotes no se bloqueen entre sí; sirve también para un
+    nodo que todavía no tiene puntos). En SQLite toma ya el lock de escritura de la base:
+    pysqlite no abre la transacción hasta el primer INSERT/UPDATE, así que la lectura del
+    último punto quedaba fuera de ella.
+    """
+    conexion = db.session.connection()
+    dialecto = conexion.dialect.name
+    if dialecto == 'postgresql':
+        for node_id in sorted(node_ids):
+            conexion.execute(text('SELECT pg_advisory_xact_lock(hashtext(:clave))'), {'clave': f'trayecto:{node_id}'})
+    elif dialecto == 'sqlite':
+        conexion.exec_driver_sql(f'UPDATE {PuntoTrayecto.__tablename__} SET lecturas = lecturas WHERE 0')
+
+
+def _actualizar_trayectos(filas):
+    """
+    Aplica a trayecto_nodo las lecturas con ubicación de un lote (antes del INSERT, misma transacción)
+
+    Compara cada lectura con el último punto del trayecto de su nodo (no con la lectura
+    anterior, para que un nodo que se desplaza de a poco no arrastre el punto). Con
+    politica_ubicacion.solo_movimiento quita lat/lon de las filas que no se movieron.
+    Antes toma el lock de los nodos del lote (_bloquear_trayectos).
+
+    Args:
+        filas: dicts de _valores_dato (se modifican)
+
+    Returns:
+        set: Posiciones en filas de las lecturas que abrieron un punto nuevo
+    """
+    node_ids = {fila['nodeId'] for fila in filas
+                if fila['nodeId'] is not None and fila['lat'] is not None and fila['lon'] is not None}
+    if not node_ids:
+        return set()
+    _bloquear_trayectos(node_ids)
+    umbral = politica_ubicacion.umbral_m
+    movimientos = set()
+    # nodeId -> [punto, lat, lon, fecha_fin, lecturas]: se acumula aquí y se asigna al punto
+    # una vez al final (cada asignación a un atributo del ORM cuesta)
+    abiertos = {}
+    # Sin autoflush: cada consulta del último punto no escribe antes los puntos ya tocados
+    with db.session.no_autoflush:
+        for i, fila in enumerate(filas):
+            node_id, lat, lon = fila['nodeId'], fila['lat'], fila['lon']
+            if node_id is None or lat is None or lon is None:
+                continue
+            fecha = _fecha_naive_utc(fila['fecha_creacion'])
+            abierto = abiertos.get(node_id)
+            if abierto is None and node_id not in abiertos:
+                punto = _ultimo_punto(node_id)
+                abierto = abiertos[node_id] = [punto, punto.lat, punto.lon, punto.fecha_fin,
+                                               punto.lecturas or 0] if punto is not None else None
+            if abierto is not None and geo.distancia_m(abierto[1], abierto[2], lat, lon) <= umbral:
+                abierto[3] = max(abierto[3], fecha)
+                abierto[4] += 1
+                if politica_ubicacion.solo_movimiento:
+                    fila['lat'] = fila['lon'] = fila['geohash'] = None
+                continue
+            if abierto is not None:
+                _cerrar_punto(abierto)
+            punto = PuntoTrayecto(nodeId=node_id, lat=lat, lon=lon, fecha_inicio=fecha, fecha_fin=fecha, lecturas=1)
+            db.session.add(punto)
+            abiertos[node_id] = [punto, lat, lon, fecha, 1]
+            movimientos.add(i)
+    for abierto in abiertos.values():
+        if abierto is not None:
+            _cerrar_punto(abierto)
+    return movimientos
+
+
+def _cerrar_punto(abierto):
+    punto, _, _, fecha_fin, lecturas = abierto
+    if punto.fecha_fin != fecha_fin:
+        punto.fecha_fin = fecha_fin
+    if punto.lecturas != lecturas:
+        punto.lecturas = lecturas
+
+
+def obtener_trayecto(node_id, fecha_inicio=None, fecha_fin=None, tolerancia_m=0.0, zoom=None):
+    """
+    Trayecto de un nodo en un rango de fechas, simplificado con Douglas–Peucker
+
+    Incluye el punto donde estaba el nodo al empezar el rango (si llegó antes y seguía ahí).
+
+    Args:
+        node_id: ID del nodo
+        fecha_inicio, fecha_fin: datetime UTC sin zona (opcionales, inclusive)
+        tolerancia_m: Desvío máximo de la línea simplificada en metros (0 = todos los puntos)
+        zoom: Zoom del mapa; si se indica, la tolerancia es un pixel a ese zoom
+
+    Returns:
+        dict: {'puntos': [{lat, lon, desde, hasta, lecturas}], 'total': puntos antes de
+               simplificar, 'tolerancia_m': tolerancia usada}
+    """
+    consulta = PuntoTrayecto.query.filter(PuntoTrayecto.nodeId == node_id)
+    if fecha_inicio:
+        consulta = consulta.filter(PuntoTrayecto.fecha_inicio >= fecha_inicio)
+    if fecha_fin:
+        consulta = consulta.filter(PuntoTrayecto.fecha_inicio <= fecha_fin)
+    puntos = consulta.order_by(PuntoTrayecto.fecha_inicio, PuntoTrayecto.id).all()
+    if fecha_inicio:
+        anterior = PuntoTrayecto.query.filter(PuntoTrayecto.nodeId == node_id,
+                                              PuntoTrayecto.fecha_inicio < fecha_inicio) \
+            .order_by(PuntoTrayecto.fecha_inicio.desc(), PuntoTrayecto.id.desc()).first()
+        if anterior is not None and anterior.fecha_fin >= fecha_inicio:
+            puntos.insert(0, anterior)
+    if zoom is not None and puntos:
+        tolerancia_m = geo.metros_por_pixel(zoom, puntos[0].lat)
+    conservados = geo.simplificar([(p.lat, p.lon) for p in puntos], tolerancia_m)
+    return {'puntos': [puntos[i].to_dict() for i in conservados], 'total': len(puntos), 'tolerancia_m': tolerancia_m}
+
+
+def reconstruir_trayectos():
+    """
+    Reconstruye trayecto_nodo desde las lecturas con ubicación (archivadas y vivas)
+
+    Con solo_movimiento las lecturas que no se movieron no tienen lat/lon, así que los
+    puntos reconstruidos no cuentan esas lecturas ni alargan su fecha_fin.
+
+    Returns:
+        int: Puntos del trayecto
+    """
+    tabla = DatosSensor.__table__
+    umbral = politica_ubicacion.umbral_m
+    puntos = []
+    ultimos = {}
+
+    def aplicar(node_id, lat, lon, fecha):
+        if node_id is None or lat is None or lon is None:
+            return
+        fecha = _fecha_naive_utc(fecha)
+        punto = ultimos.get(node_id)
+        if punto is not None and geo.distancia_m(punto['lat'], punto['lon'], lat, lon) <= umbral:
+            punto['fecha_fin'] = max(punto['fecha_fin'], fecha)
+            punto['lecturas'] += 1
+            return
+        punto = ultimos[node_id] = {'nodeId': node_id, 'lat': lat, 'lon': lon, 'fecha_inicio': fecha,
+                                    'fecha_fin': fecha, 'lecturas': 1}
+        puntos.append(punto)
+
+    try:
+        db.session.query(PuntoTrayecto).delete()
+        for bloque in _filas_archivadas(columnas=('lat', 'lon')):
+            for fila in bloque:
+                aplicar(fila['nodeId'], fila['lat'], fila['lon'], fila['fecha_creacion'])
+        consulta = select(tabla.c.nodeId, tabla.c.lat, tabla.c.lon, tabla.c.fecha_creacion) \
+            .where(tabla.c.nodeId.isnot(None), tabla.c.lat.isnot(None), tabla.c.lon.isnot(None)) \
+            .order_by(tabla.c.fecha_creacion, tabla.c.id)
+        for bloque in db.session.execute(consulta.execution_options(yield_per=5000)).partitions():
+            for node_id, lat, lon, fecha in bloque:
+                aplicar(node_id, lat, lon, fecha)
+        for i in range(0, len(puntos), 5000):
+            db.session.execute(insert(PuntoTrayecto.__table__), puntos[i:i + 5000])
+        db.session.commit()
+        version_datos.incrementar()
+        return len(puntos)
+    except Exception as e:
+        db.session.rollback()
+        raise e
+
+
+def _asegurar_trayectos():
+    """Rellena trayecto_nodo la primera vez que se arranca con una base que ya tenía ubicaciones."""
+    try:
+        if db.session.query(PuntoTrayecto.id).first() is None and db.session.query(DatosSensor.id).filter(
+                DatosSensor.lat.isnot(None), DatosSensor.lon.isnot(None)).first() is not None:
+            n = reconstruir_trayectos()
+            log.info('Trayectos reconstruidos: %d puntos', n)
+    except Exception as e:
+        db.session.rollback()
+        log.warning('No se pudieron reconstruir los trayectos: %s', e)
+
+# ==================== Estado por nodo ====================
+
+def _actualizar_estado_nodos(filas):
+    """Aplica filas recién insertadas (sin commit) a EstadoNodo, una consulta por nodo distinto."""
+    por_nodo = {}
+    for fila in filas:
+        por_nodo.setdefault(fila['nodeId'], []).append(fila)
+    for node_id, lista in por_nodo.items():
+        if node_id is None:
+            continue
+        # La inserción en datos_sensor ya tomó el bloqueo de escritura, así que
+        # no hay otra transacción creando este mismo estado en paralelo
+        estado = db.session.get(EstadoNodo, node_id)
+        if estado is None:
+            estado = EstadoNodo(nodeId=node_id, total_registros=0)
+            db.session.add(estado)
+        for fila in lista:
+            estado.registrar(fila)
+
+
+def _ultimo_del_nodo(node_id, *condiciones):
+    return DatosSensor.query.filter(DatosSensor.nodeId == node_id, *condiciones) \
+        .order_by(DatosSensor.fecha_creacion.desc(), DatosSensor.id.desc()).first()
+
+
+def _descontar_estado_nodo(fila):
+    """Actualiza EstadoNodo tras borrar una fila (ya borrada en la sesión, sin commit)."""
+    estado = db.session.get(EstadoNodo, fila['nodeId']) if fila['nodeId'] is not None else None
+    if estado is None:
+        return
+    estado.total_registros = max((estado.total_registros or 0) - 1, 0)
+    if estado.total_registros == 0:
+        db.session.delete(estado)
+        return
+    # Solo se consulta lo que la fila borrada podía estar aportando
+    if fila['id'] == estado.ultimo_id:
+        ultimo = _ultimo_del_nodo(fila['nodeId'])
+        estado.ultimo_id = ultimo.id if ultimo else None
+        estado.ultima_fecha = ultimo.fecha_creacion if ultimo else None
+    for campo in CAMPOS_SENSOR:
+        if fila[campo] is not None and fila[campo] == getattr(estado, campo):
+            columna = getattr(DatosSensor, campo)
+            ultimo = _ultimo_del_nodo(fila['nodeId'], columna.isnot(None))
+            setattr(estado, campo, getattr(ultimo, campo) if ultimo else None)
+    if fila['lat'] is not None and fila['lon'] is not None and fila['fecha_creacion'] == estado.fecha_ubicacion:
+        ultimo = _ultimo_del_nodo(fila['nodeId'], DatosSensor.lat.isnot(None), DatosSensor.lon.isnot(None))
+        estado.lat = ultimo.lat if ultimo else None
+        estado.lon = ultimo.lon if ultimo else None
+        estado.geohash = (ultimo.geohash or geo.geohash(ultimo.lat, ultimo.lon)) if ultimo else None
+        estado.fecha_ubicacion = ultimo.fecha_creacion if ultimo else None
+
+
+def _ultimos_por_nodo(*condiciones):
+    """
+    Última fila (por fecha_creacion, id) de cada nodo entre las que cumplen las condiciones
+
+    PostgreSQL usa SELECT DISTINCT ON ("nodeId"); el resto de motores, ROW_NUMBER()
+    sobre una ventana por nodo. Ambos recorren ix_datos_sensor_nodo_fecha en orden.
+
+    Args:
+        *condiciones: Expresiones sobre las columnas de datos_sensor
+
+    Returns:
+        dict: {nodeId: mapping con las columnas de la fila}
+    """
+    consulta = _consulta_ultimos_por_nodo(db.session.get_bind().dialect.name, *condiciones)
+    return {fila._mapping['nodeId']: fila._mapping for fila in db.session.execute(consulta)}
+
+
+def _consulta_ultimos_por_nodo(dialecto, *condiciones):
+    tabla = DatosSensor.__table__
+    orden = (tabla.c.fecha_creacion.desc(), tabla.c.id.desc())
+    filtro = (tabla.c.nodeId.isnot(None),) + condiciones
+    if dialecto == 'postgresql':
+        return select(tabla).where(*filtro).order_by(tabla.c.nodeId, *orden).distinct(tabla.c.nodeId)
+    numeradas = select(
+        tabla, func.row_number().over(partition_by=tabla.c.nodeId, order_by=orden).label('posicion')
+    ).where(*filtro).subquery()
+    return select(*[numeradas.c[c.name] for c in tabla.columns]).where(numeradas.c.posicion == 1)
+
+
+def reconstruir_estado_nodos():
+    """
+    Reconstruye EstadoNodo desde cero con consultas de "última fila por nodo"
+
+    Una para el último registro, una por campo de sensor (último valor no nulo) y una
+    para la última ubicación, más un conteo agrupado; no recorre datos_sensor en Python.
+
+    Returns:
+        int: Número de nodos con estado
+    """
+    try:
+        db.session.query(EstadoNodo).delete()
+        tabla = DatosSensor.__table__
+        # El conteo incluye lo archivado, como el contador incremental
+        totales = {}
+        for ejecutar in _fuentes_datos():
+            for node_id, n in ejecutar(
+                select(tabla.c.nodeId, func.count()).where(tabla.c.nodeId.isnot(None)).group_by(tabla.c.nodeId)
+            ):
+                totales[node_id] = totales.get(node_id, 0) + n
+        for _, _, ruta in particiones_archivadas():
+            if _es_columnar(ruta):
+                for node_id, n in columnar.abrir(ruta).conteo_por_nodo().items():
+                    totales[node_id] = totales.get(node_id, 0) + n
+        estados = {}
+        for node_id, fila in _ultimos_por_nodo().items():
+            estados[node_id] = EstadoNodo(nodeId=node_id, total_registros=totales.get(node_id, 0),
+                                          ultimo_id=fila['id'], ultima_fecha=fila['fecha_creacion'])
+        for campo in CAMPOS_SENSOR:
+            for node_id, fila in _ultimos_por_nodo(tabla.c[campo].isnot(None)).items():
+                setattr(estados[node_id], campo, fila[campo])
+        for node_id, fila in _ultimos_por_nodo(tabla.c.lat.isnot(None), tabla.c.lon.isnot(None)).items():
+            estado = estados[node_id]
+            estado.lat, estado.lon, estado.fecha_ubicacion = fila['lat'], fila['lon'], fila['fecha_creacion']
+            estado.geohash = _geohash_fila(fila)
+        db.session.add_all(estados.values())
+        db.session.commit()
+        cache.invalidar()
+        version_datos.incrementar()
+        return len(estados)
+    except Exception as e:
+        db.session.rollback()
+        raise e
+
+
+def _asegurar_estado_nodos():
+    """Rellena EstadoNodo la primera vez que se arranca con una base que ya tenía datos."""
+    try:
+        if db.session.query(EstadoNodo.nodeId).first() is None and \
+                db.session.query(DatosSensor.id).first() is not None:
+            n = reconstruir_estado_nodos()
+            log.info('EstadoNodo reconstruido para %d nodos', n)
+    except Exception as e:
+        db.session.rollback()
+        log.warning('No se pudo reconstruir EstadoNodo: %s', e)
+
+
+def _normalizar_node_id(node_id):
+    """Limpia espacios y descarta el id especial 'gateway' (None si no es un nodo válido)."""
+    if not node_id:
+        return None
+    limpio = str(node_id).strip()
+    if not limpio or limpio.lower() == 'gateway':
+        return None
+    return limpio
+
+
+def obtener_resumen_nodos():
+    """
+    Obtiene el resumen de todos los nodos (desde la caché; si no, con una sola consulta)
+
+    Returns:
+        dict: {nodeId: {'campos': {...}, 'ubicacion': {lat, lon, fecha} o None,
+                        'total_registros': int, 'ultima_fecha': datetime}}
+    """
+    return cache.obtener('resumen', _leer_resumen_nodos)
+
+
+def _leer_resumen_nodos():
+    resumen = {}
+    for estado in EstadoNodo.query.order_by(EstadoNodo.ultima_fecha).all():
+        node_id = _normalizar_node_id(estado.nodeId)
+        if node_id is None:
+            continue
+        previo = resumen.get(node_id)
+        actual = {
+            'campos': estado.campos(),
+            'ubicacion': estado.ubicacion(),
+            'total_registros': estado.total_registros or 0,
+            'ultima_fecha': estado.ultima_fecha
+        }
+        if previo:
+            # IDs que solo difieren en espacios: combinar (el más reciente gana la ubicación)
+            actual['campos'] = {c: previo['campos'][c] or actual['campos'][c] for c in CAMPOS_SENSOR}
+            actual['ubicacion'] = actual['ubicacion'] or previo['ubicacion']
+            actual['total_registros'] += previo['total_registros']
+        resumen[node_id] = actual
+    return dict(sorted(resumen.items()))
+
+
+# ==================== Series agregadas (rollups) ====================
+
+def _registrar_agregados(filas):
+    """Actualiza todas las tablas derivadas con filas recién insertadas (misma transacción)."""
+    _actualizar_estado_nodos(filas)
+    _actualizar_resumenes(filas)
+    _actualizar_estadisticas(filas)
+
+
+def _descontar_agregados(fila):
+    """Actualiza todas las tablas derivadas tras borrar una fila (misma transacción)."""
+    _descontar_estado_nodo(fila)
+    _recalcular_resumenes(fila['nodeId'], fila['fecha_creacion'])
+    _descontar_estadisticas(fila)
+
+
+def _epoch(fecha):
+    """Segundos epoch de un datetime (los naive se interpretan como UTC, igual que se guardan)."""
+    return calendar.timegm(fecha.utctimetuple())
+
+
+def _acumular_resumenes(acumulado, fila):
+    """Suma una fila de datos_sensor al dict {(nivel, nodo, campo, inicio): [n, suma, min, max]}."""
+    if fila['nodeId'] is None or fila['fecha_creacion'] is None:
+        return
+    t = _epoch(fila['fecha_creacion'])
+    for campo in CAMPOS_SENSOR:
+        valor = fila[campo]
+        if valor is None:
+            continue
+        for nivel, ancho in NIVELES_RESUMEN.items():
+            clave = (nivel, fila['nodeId'], campo, t - t % ancho)
+            agregado = acumulado.get(clave)
+            if agregado is None:
+                acumulado[clave] = [1, valor, valor, valor]
+            else:
+                agregado[0] += 1
+                agregado[1] += valor
+                if valor < agregado[2]:
+                    agregado[2] = valor
+                if valor > agregado[3]:
+                    agregado[3] = valor
+
+
+def _upsert_resumenes(acumulado):
+    """Suma los agregados a resumen_serie."""
+    _upsert_sumando(ResumenSerie, [
+        {'nivel': nivel, 'nodeId': node_id, 'campo': campo, 'inicio': inicio,
+         'cantidad': n, 'suma': suma, 'minimo': minimo, 'maximo': maximo}
+        for (nivel, node_id, campo, inicio), (n, suma, minimo, maximo) in acumulado.items()
+    ], sumar=('cantidad', 'suma'))
+
+
+def _upsert_sumando(modelo, filas, sumar):
+    """
+    Inserta filas de agregados o las combina con las existentes (INSERT ... ON CONFLICT DO UPDATE)
+
+    Args:
+        modelo: Modelo cuya clave primaria identifica el agregado
+        filas: Lista de dicts con todas las columnas
+        sumar: Columnas que se suman; 'minimo' y 'maximo' se combinan con min/max
+    """
+    if not filas:
+        return
+    tabla = modelo.__table__
+    dialecto = db.session.get_bind().dialect.name
+    if dialecto == 'postgresql':
+        stmt = postgresql.insert(tabla)
+        menor, mayor = func.least, func.greatest
+    elif dialecto == 'sqlite':
+        stmt = sqlite.insert(tabla)
+        # min()/max() con dos argumentos son funciones escalares en SQLite
+        menor, mayor = func.min, func.max
+    else:
+        _upsert_sumando_orm(modelo, filas, sumar)
+        return
+    cambios = {c: tabla.c[c] + stmt.excluded[c] for c in sumar}
+    cambios['minimo'] = menor(tabla.c.minimo, stmt.excluded.minimo)
+    cambios['maximo'] = mayor(tabla.c.maximo, stmt.excluded.maximo)
+    stmt = stmt.on_conflict_do_update(index_elements=list(tabla.primary_key.columns), set_=cambios)
+    db.session.execute(stmt, filas)
+
+
+def _upsert_sumando_orm(modelo, filas, sumar):
+    """Versión portable (una consulta por agregado) para motores sin ON CONFLICT."""
+    claves = [c.key for c in modelo.__table__.primary_key.columns]
+    for f in filas:
+        r = db.session.get(modelo, tuple(f[c] for c in claves))
+        if r is None:
+            db.session.add(modelo(**f))
+            continue
+        for c in sumar:
+            setattr(r, c, getattr(r, c) + f[c])
+        r.minimo = min(r.minimo, f['minimo'])
+        r.maximo = max(r.maximo, f['maximo'])
+
+
+def _actualizar_resumenes(filas):
+    acumulado = {}
+    for fila in filas:
+        _acumular_resumenes(acumulado, fila)
+    _upsert_resumenes(acumulado)
+
+
+def _recalcular_resumenes(node_id, fecha):
+    """
+    Recalcula los intervalos de un nodo que contienen fecha (tras un borrado), con las mismas
+    fuentes que reconstruir_resumenes: si la retención cortó un intervalo, lo archivado sigue contando.
+    """
+    if node_id is None or fecha is None:
+        return
+    tabla = DatosSensor.__table__
+    t = _epoch(fecha)
+    for nivel, ancho in NIVELES_RESUMEN.items():
+        inicio = t - t % ancho
+        ResumenSerie.query.filter_by(nivel=nivel, nodeId=node_id, inicio=inicio).delete()
+        desde = datetime.fromtimestamp(inicio, timezone.utc).replace(tzinfo=None)
+        hasta = datetime.fromtimestamp(inicio + ancho, timezone.utc).replace(tzinfo=None)
+        filtro = (tabla.c.nodeId == node_id, tabla.c.fecha_creacion >= desde, tabla.c.fecha_creacion < hasta)
+        agregados = {}  # campo -> [n, suma, min, max]
+
+        def combinar(campo, n, suma, minimo, maximo):
+            actual = agregados.get(campo)
+            if actual is None:
+                agregados[campo] = [n, suma, minimo, maximo]
+            else:
+                agregados[campo] = [actual[0] + n, actual[1] + suma, min(actual[2], minimo), max(actual[3], maximo)]
+
+        # Tabla viva y archivos SQLite del intervalo (la viva siempre; los archivos solo si los toca)
+        for ejecutar in _fuentes_datos(desde, hasta):
+            for campo in CAMPOS_SENSOR:
+                c = tabla.c[campo]
+                n, suma, minimo, maximo = ejecutar(
+                    select(func.count(c), func.sum(c), func.min(c), func.max(c)).where(*filtro)).one()
+                if n:
+                    combinar(campo, n, suma, minimo, maximo)
+        for filas in _filas_archivadas(desde, hasta, node_id, columnas=CAMPOS_SENSOR, solo_columnar=True):
+            for fila in filas:
+                if fila['fecha_creacion'] >= hasta:
+                    continue
+                for campo in CAMPOS_SENSOR:
+                    valor = fila[campo]
+                    if valor is not None:
+                        combinar(campo, 1, valor, valor, valor)
+        for campo, (n, suma, minimo, maximo) in agregados.items():
+            db.session.add(ResumenSerie(nivel=nivel, nodeId=node_id, campo=campo, inicio=inicio,
+                                        cantidad=n, suma=suma, minimo=minimo, maximo=maximo))
+
+
+def reconstruir_resumenes():
+    """
+    Reconstruye resumen_serie desde cero a partir de datos_sensor y los archivos mensuales
+
+    Returns:
+        int: Número de lecturas procesadas
+    """
+    try:
+        db.session.query(ResumenSerie).delete()
+        tabla = DatosSensor.__table__
+        consulta = select(tabla).execution_options(yield_per=5000)
+        acumulado = {}
+        procesadas = 0
+        for ejecutar in _fuentes_datos():
+            for fila in ejecutar(consulta):
+                _acumular_resumenes(acumulado, fila._mapping)
+                procesadas += 1
+                # El upsert es aditivo: se puede vaciar el acumulado por partes
+                if len(acumulado) >= 50000:
+                    _upsert_resumenes(acumulado)
+                    acumulado = {}
+        for filas in _filas_archivadas(solo_columnar=True):
+            for fila in filas:
+                _acumular_resumenes(acumulado, fila)
+                procesadas += 1
+            if len(acumulado) >= 50000:
+                _upsert_resumenes(acumulado)
+                acumulado = {}
+        _upsert_resumenes(acumulado)
+        db.session.commit()
+        version_datos.incrementar()
+        return procesadas
+    except Exception as e:
+        db.session.rollback()
+        raise e
+
+
+def _asegurar_resumenes():
+    """Rellena resumen_serie la primera vez que se arranca con una base que ya tenía datos."""
+    try:
+        if db.session.query(ResumenSerie.inicio).first() is None and \
+                db.session.query(DatosSensor.id).first() is not None:
+            n = reconstruir_resumenes()
+            log.info('Series agregadas reconstruidas a partir de %d registros', n)
+    except Exception as e:
+        db.session.rollback()
+        log.warning('No se pudieron reconstruir las series agregadas: %s', e)
+
+
+def obtener_serie(node_id, campo, desde, hasta, intervalo):
+    """
+    Obtiene una serie agregada (min/avg/max/count por intervalo) desde las tablas de resumen
+
+    Args:
+        node_id: ID del nodo
+        campo: Uno de CAMPOS_SENSOR
+        desde: Epoch (segundos) de inicio, inclusive
+        hasta: Epoch (segundos) de fin, exclusivo
+        intervalo: Segundos por punto (múltiplo de 60)
+
+    Returns:
+        tuple: (nivel usado, lista de dicts {t, min, avg, max, count} ordenados por t)
+
+    Raises:
+        ValueError: Si el campo o el intervalo no son válidos
+    """
+    if campo not in CAMPOS_SENSOR:
+        raise ValueError(f"Campo inválido: {campo}")
+    if intervalo <= 0 or intervalo % 60:
+        raise ValueError("El intervalo debe ser múltiplo de 60 segundos")
+    # El nivel más grueso que divide exactamente el intervalo pedido
+    nivel = 'd' if intervalo % 86400 == 0 else ('h' if intervalo % 3600 == 0 else 'm')
+    ancho = NIVELES_RESUMEN[nivel]
+    filas = db.session.query(
+        ResumenSerie.inicio, ResumenSerie.cantidad, ResumenSerie.suma, ResumenSerie.minimo, ResumenSerie.maximo
+    ).filter(
+        ResumenSerie.nivel == nivel,
+        ResumenSerie.nodeId == node_id,
+        ResumenSerie.campo == campo,
+        ResumenSerie.inicio >= desde - desde % ancho,
+        ResumenSerie.inicio < hasta
+    ).order_by(ResumenSerie.inicio).all()
+
+    puntos = {}
+    for inicio, n, suma, minimo, maximo in filas:
+        t = inicio - inicio % intervalo
+        p = puntos.get(t)
+        if p is None:
+            puntos[t] = [n, suma, minimo, maximo]
+        else:
+            p[0] += n
+            p[1] += suma
+            p[2] = min(p[2], minimo)
+            p[3] = max(p[3], maximo)
+    return nivel, [
+        {'t': t, 'min': minimo, 'avg': suma / n, 'max': maximo, 'count': n}
+        for t, (n, suma, minimo, maximo) in puntos.items()
+    ]
+
+
+# ==================== Retención y archivo ====================
+
+# Formato del archivo mensual -> extensión
+EXTENSIONES_ARCHIVO = {'columnar': '.col', 'sqlite': '.db'}
+
+
+class PoliticaRetencion:
+    """
+    Cuánto tiempo se conserva cada cosa, en días (0 = para siempre)
+
+    Las lecturas crudas más antiguas que dias_crudos salen de datos_sensor: se archivan en
+    un archivo por mes o se descartan si archivar=False. El archivo puede ser 'columnar'
+    (directorio/datos_sensor_AAAAMM.col, comprimido, ver columnar.py) o 'sqlite'
+    (datos_sensor_AAAAMM.db, misma tabla que la viva); cada mes queda en un solo formato.
+    Los archivos se borran pasados dias_archivo. Los resúmenes se podan por nivel con
+    dias_resumen (p. ej. {'m': 30}: minutos 30 días, horas y días para siempre).
+    estado_nodo, estadistica_campo y trayecto_nodo guardan la historia completa: archivar
+    o borrar archivos no los descuenta.
+    """
+
+    def __init__(self):
+        self.configurar()
+
+    def configurar(self, dias_crudos=0, archivar=True, dias_archivo=0, dias_resumen=None, directorio=None,
+                   paginas_vacuum=2000, formato='columnar'):
+        if formato not in EXTENSIONES_ARCHIVO:
+            raise ValueError(f"Formato de archivo desconocido: {formato}")
+        self.dias_crudos = dias_crudos
+        self.archivar = archivar
+        self.formato = formato
+        self.dias_archivo = dias_archivo
+        self.dias_resumen = {nivel: d for nivel, d in (dias_resumen or {}).items() if nivel in NIVELES_RESUMEN}
+        self.directorio = directorio
+        self.paginas_vacuum = paginas_vacuum
+
+    def activa(self):
+        return bool(self.dias_crudos or self.dias_archivo or any(self.dias_resumen.values()))
+
+    def resumen(self):
+        return {
+            'dias_crudos': self.dias_crudos,
+            'archivar': self.archivar,
+            'formato': self.formato,
+            'dias_archivo': self.dias_archivo,
+            'dias_resumen': self.dias_resumen,
+            'directorio': self.directorio,
+            'paginas_vacuum': self.paginas_vacuum
+        }
+
+
+politica_retencion = PoliticaRetencion()
+
+_PATRON_ARCHIVO = re.compile(r'^datos_sensor_(\d{4})(\d{2})(\.db|\.col)$')
+_motores_archivo = {}
+_lock_archivo = threading.Lock()
+
+
+def _ruta_archivo(mes):
+    """Archivo de un mes: el que ya exista, o uno nuevo en el formato de la política."""
+    base = os.path.join(politica_retencion.directorio, f'{DatosSensor.__tablename__}_{mes:%Y%m}')
+    for extension in EXTENSIONES_ARCHIVO.values():
+        if os.path.exists(base + extension):
+            return base + extension
+    return base + EXTENSIONES_ARCHIVO[politica_retencion.formato]
+
+
+def _motor_archivo(ruta, crear=False):
+    """Motor SQLite de un archivo mensual (uno por ruta); con crear=True crea el archivo y su tabla."""
+    with _lock_archivo:
+        motor = _motores_archivo.get(ruta)
+        if motor is None:
+            if not crear and not os.path.exists(ruta):
+                return None
+            os.makedirs(os.path.dirname(ruta), exist_ok=True)
+            motor = _motores_archivo[ruta] = db.create_engine(f'sqlite:///{ruta}')
+            # Misma tabla e índices que datos_sensor, para consultar igual que la tabla viva
+            DatosSensor.__table__.create(bind=motor, checkfirst=True)
+            # Archivos de versiones anteriores: añadir las columnas nuevas (p. ej. geohash)
+            _migrar_columnas(motor, (DatosSensor.__table__,))
+        return motor
+
+
+def particiones_archivadas(fecha_inicio=None, fecha_fin=None):
+    """
+    Archivos mensuales que se solapan con [fecha_inicio, fecha_fin], en orden cronológico
+
+    Returns:
+        list: Tuplas (inicio_mes, fin_mes, ruta)
+    """
+    directorio = politica_retencion.directorio
+    if not directorio or not os.path.isdir(directorio):
+        return []
+    particiones = []
+    for nombre in os.listdir(directorio):
+        m = _PATRON_ARCHIVO.match(nombre)
+        if not m:
+            continue
+        inicio = datetime(int(m.group(1)), int(m.group(2)), 1)
+        fin = _inicio_mes(inicio, 1)
+        if (fecha_fin is None or inicio <= fecha_fin) and (fecha_inicio is None or fin > fecha_inicio):
+            particiones.append((inicio, fin, os.path.join(directorio, nombre)))
+    return sorted(particiones)
+
+
+def _es_columnar(ruta):
+    return ruta.endswith(EXTENSIONES_ARCHIVO['columnar'])
+
+
+def _fuentes_datos(fecha_inicio=None, fecha_fin=None):
+    """
+    Fuentes consultables con SQL de un rango: archivos mensuales SQLite que toca (más antiguos
+    primero) y la tabla viva. Los archivos columnares se leen con _filas_archivadas.
+    """
+    for _, _, ruta in particiones_archivadas(fecha_inicio, fecha_fin):
+        motor = None if _es_columnar(ruta) else _motor_archivo(ruta)
+        if motor is not None:
+            with motor.connect() as conn:
+                yield conn.execute
+    yield db.session.execute
+
+
+def _filas_archivadas(fecha_inicio=None, fecha_fin=None, node_id=None, columnas=None, solo_columnar=False,
+                      tamano_bloque=5000):
+    """
+    Lecturas archivadas de un rango, en orden cronológico (cada mes está en un único archivo)
+
+    Args:
+        fecha_inicio, fecha_fin: datetime (opcionales, inclusive)
+        node_id: Filtrar por ID de nodo (opcional)
+        columnas: Columnas necesarias además de id, nodeId y fecha_creacion (por defecto todas)
+        solo_columnar: Solo los archivos columnares (los SQLite se consultan aparte con _fuentes_datos)
+
+    Yields:
+        list: Bloques de filas (dicts o mappings con las columnas de DatosSensor)
+    """
+    tabla = DatosSensor.__table__
+    for _, _, ruta in particiones_archivadas(fecha_inicio, fecha_fin):
+        if _es_columnar(ruta):
+            yield from columnar.abrir(ruta).iterar(
+                fecha_inicio, fecha_fin, node_id, filtrar_nodo=bool(node_id),
+                columnas=columnar.COLUMNAS if columnas is None else columnas
+            )
+            continue
+        motor = None if solo_columnar else _motor_archivo(ruta)
+        if motor is None:
+            continue
+        consulta = select(tabla).order_by(tabla.c.fecha_creacion, tabla.c.id)
+        if node_id:
+            consulta = consulta.where(tabla.c.nodeId == node_id)
+        if fecha_inicio:
+            consulta = consulta.where(tabla.c.fecha_creacion >= fecha_inicio)
+        if fecha_fin:
+            consulta = consulta.where(tabla.c.fecha_creacion <= fecha_fin)
+        with motor.connect() as conn:
+            for bloque in conn.execute(consulta.execution_options(stream_results=True,
+                                                                  yield_per=tamano_bloque)).mappings().partitions():
+                yield bloque
+
+
+def archivar_datos(hasta, tamano_lote=5000):
+    """
+    Saca de datos_sensor las filas con fecha_creacion anterior a hasta
+
+    Las copia a su archivo mensual (si la política archiva) y las borra de la tabla viva,
+    por lotes para no retener el bloqueo de escritura. Es reanudable: la copia ignora
+    filas ya archivadas, así que un corte entre copiar y borrar no duplica nada.
+    Los archivos columnares de meses ya cerrados se compactan al final (un bloque por nodo y día).
+
+    Returns:
+        int: Filas sacadas de datos_sensor
+    """
+    tabla = DatosSensor.__table__
+    total = 0
+    tocados = set()
+    try:
+        while True:
+            filas = db.session.execute(
+                select(tabla).where(tabla.c.fecha_creacion < hasta)
+                .order_by(tabla.c.fecha_creacion, tabla.c.id).limit(tamano_lote)
+            ).mappings().all()
+            if not filas:
+                break
+            if politica_retencion.archivar and politica_retencion.directorio:
+                por_mes = {}
+                for fila in filas:
+                    por_mes.setdefault(_inicio_mes(fila['fecha_creacion']), []).append(dict(fila))
+                for mes, lista in por_mes.items():
+                    ruta = _ruta_archivo(mes)
+                    if _es_columnar(ruta):
+                        for fila in lista:
+                            fila['fecha_creacion'] = _fecha_naive_utc(fila['fecha_creacion'])
+                        columnar.agregar(ruta, lista)
+                        tocados.add((mes, ruta))
+                    else:
+                        with _motor_archivo(ruta, crear=True).begin() as conn:
+                            conn.execute(sqlite.insert(tabla).on_conflict_do_nothing(index_elements=['id']), lista)
+            db.session.execute(tabla.delete().where(tabla.c.id.in_([f['id'] for f in filas])))
+            db.session.commit()
+            total += len(filas)
+    except Exception as e:
+        db.session.rollback()
+        raise e
+    for mes, ruta in tocados:
+        if _inicio_mes(mes, 1) <= hasta:
+            columnar.compactar(ruta)
+    if total:
+        cache.invalidar()
+        version_datos.incrementar()
+    return total
+
+
+def _eliminar_particiones_vencidas(hasta):
+    """PostgreSQL: borra las particiones mensuales ya vacías que terminan antes de hasta."""
+    if not tabla_particionada():
+        return []
+    eliminadas = []
+    with db.engine.connect() as conn:
+        nombres = conn.execute(text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = :tabla"
+        ), {'tabla': DatosSensor.__tablename__}).scalars().all()
+    for nombre in nombres:
+        m = re.match(rf'^{DatosSensor.__tablename__}_(\d{{4}})(\d{{2}})$', nombre)
+        if not m or _inicio_mes(datetime(int(m.group(1)), int(m.group(2)), 1), 1) > hasta:
+            continue
+        with db.engine.begin() as conn:
+            if conn.exec_driver_sql(f'SELECT 1 FROM {nombre} LIMIT 1').first() is None:
+                conn.exec_driver_sql(f'DROP TABLE {nombre}')
+                eliminadas.append(nombre)
+    return eliminadas
+
+
+def eliminar_archivos_vencidos(hasta):
+    """Borra los archivos mensuales cuyo mes terminó antes de hasta. Returns: rutas borradas."""
+    borrados = []
+    for _, fin, ruta in particiones_archivadas():
+        if fin > hasta:
+            continue
+        with _lock_archivo:
+            motor = _motores_archivo.pop(ruta, None)
+        if motor is not None:
+            motor.dispose()
+        columnar.olvidar(ruta)
+        for sufijo in ('', '-wal', '-shm', '-journal'):
+            if os.path.exists(ruta + sufijo):
+                os.remove(ruta + sufijo)
+        borrados.append(ruta)
+    if borrados:
+        version_datos.incrementar()
+    return borrados
+
+
+def podar_resumenes(limites):
+    """
+    Borra los intervalos de resumen_serie anteriores al límite de su nivel
+
+    Args:
+        limites: dict {nivel: datetime}
+
+    Returns:
+        int: Filas borradas
+    """
+    try:
+        total = 0
+        for nivel, hasta in limites.items():
+            total += ResumenSerie.query.filter(
+                ResumenSerie.nivel == nivel, ResumenSerie.inicio < _epoch(hasta)
+            ).delete(synchronize_session=False)
+        db.session.commit()
+        if total:
+            version_datos.incrementar()
+        return total
+    except Exception as e:
+        db.session.rollback()
+        raise e
+
+
+def vacuum_incremental(paginas):
+    """
+    Devuelve al sistema hasta 'paginas' páginas libres de la base SQLite (auto_vacuum=INCREMENTAL)
+
+    Returns:
+        int: Páginas liberadas (0 si la base no es SQLite o no tiene auto_vacuum incremental)
+    """
+    if db.engine.dialect.name != 'sqlite' or not paginas:
+        return 0
+    with db.engine.connect() as conn:
+        if conn.exec_driver_sql('PRAGMA auto_vacuum').scalar() != 2:
+            return 0
+        antes = conn.exec_driver_sql('PRAGMA freelist_count').scalar()
+    crudo = db.engine.raw_connection()
+    try:
+        # executescript ejecuta el PRAGMA hasta el final; execute() solo libera una página
+        crudo.driver_connection.executescript(f'PRAGMA incremental_vacuum({int(paginas)});')
+    finally:
+        crudo.close()
+    with db.engine.connect() as conn:
+        return antes - conn.exec_driver_sql('PRAGMA freelist_count').scalar()
+
+
+def aplicar_retencion(ahora=None):
+    """
+    Aplica politica_retencion una vez: archiva o descarta lecturas vencidas, borra archivos
+    y particiones vencidas, poda resúmenes y libera espacio en disco
+
+    Args:
+        ahora: datetime UTC sin zona de referencia (por defecto, el actual)
+
+    Returns:
+        dict: Qué se hizo en esta pasada
+    """
+    politica = politica_retencion
+    ahora = ahora or datetime.now(timezone.utc).replace(tzinfo=None)
+    resultado = {'filas_archivadas': 0, 'filas_descartadas': 0, 'particiones_eliminadas': [],
+                 'archivos_eliminados': [], 'resumenes_podados': 0, 'paginas_liberadas': 0}
+    if politica.dias_crudos:
+        hasta = ahora - timedelta(days=politica.dias_crudos)
+        movidas = archivar_datos(hasta)
+        clave = 'filas_archivadas' if politica.archivar and politica.directorio else 'filas_descartadas'
+        resultado[clave] = movidas
+        resultado['particiones_eliminadas'] = _eliminar_particiones_vencidas(hasta)
+    if politica.dias_archivo:
+        resultado['archivos_eliminados'] = eliminar_archivos_vencidos(ahora - timedelta(days=politica.dias_archivo))
+    limites = {nivel: ahora - timedelta(days=d) for nivel, d in politica.dias_resumen.items() if d}
+    if limites:
+        resultado['resumenes_podados'] = podar_resumenes(limites)
+    resultado['paginas_liberadas'] = vacuum_incremental(politica.paginas_vacuum)
+    return resultado
+
+
 # ==================== Gateway IP ====================
 
 def set_gateway_ip(ip: str):
@@ -391,6 +2773,8 @@ def set_gateway_ip(ip: str):
         else:
             g.ip = ip
         db.session.commit()
+        cache.fijar_gateway_ip(ip)
+        version_datos.incrementar()
         return True
     except Exception:
         db.session.rollback()
@@ -399,5 +2783,9 @@ def set_gateway_ip(ip: str):
 
 def get_gateway_ip():
     """Obtiene la IP de la gateway o None."""
+    return cache.obtener('gateway_ip', _leer_gateway_ip)
+
+
+def _leer_gateway_ip():
     g = GatewayInfo.query.get(1)
     return g.ip if g else None
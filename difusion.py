@@ -0,0 +1,269 @@
+"""
+Difusión de eventos Socket.IO por salas para AgroLink
+Cada navegador se suscribe solo a lo que muestra (un nodo, o todos) y cada
+evento se serializa una única vez aunque vaya a muchos clientes.
+Con varios procesos las emisiones pasan por una cola de mensajes (Redis, AMQP...)
+para que cada proceso las entregue a sus propios clientes.
+"""
+import pickle
+import queue
+import threading
+import time
+from collections import deque
+
+import socketio
+from socketio import packet
+
+from bitacora import obtener_logger
+
+log = obtener_logger('difusion')
+
+# Salas
+SALA_TODOS = 'todos'              # Todas las lecturas y ubicaciones (inicio, tabla general)
+SALA_UBICACIONES = 'ubicaciones'  # Solo ubicacion_nodo de todos los nodos (mapa de la página de nodo)
+PREFIJO_SALA_NODO = 'nodo:'       # Lecturas y ubicación de un nodo
+
+
+def sala_nodo(node_id):
+    """Nombre de la sala de un nodo."""
+    return PREFIJO_SALA_NODO + str(node_id).strip()
+
+
+class MetricasSalas:
+    """Contadores de emisiones por sala, con tasa por segundo sobre una ventana deslizante."""
+
+    def __init__(self, ventana=60):
+        self.ventana = ventana
+        self._lock = threading.Lock()
+        self._totales = {}    # sala -> [emisiones, entregas]
+        self._recientes = {}  # sala -> deque de (segundo, emisiones)
+
+    def registrar(self, sala, entregas):
+        ahora = int(time.monotonic())
+        with self._lock:
+            total = self._totales.setdefault(sala, [0, 0])
+            total[0] += 1
+            total[1] += entregas
+            recientes = self._recientes.setdefault(sala, deque())
+            if recientes and recientes[-1][0] == ahora:
+                recientes[-1][1] += 1
+            else:
+                recientes.append([ahora, 1])
+            while recientes and recientes[0][0] <= ahora - self.ventana:
+                recientes.popleft()
+
+    def resumen(self):
+        """Dict {sala: {emisiones, entregas, emisiones_por_segundo}} (tasa media de la ventana)."""
+        limite = int(time.monotonic()) - self.ventana
+        with self._lock:
+            return {
+                sala: {
+                    'emisiones': total[0],
+                    'entregas': total[1],
+                    'emisiones_por_segundo': sum(n for s, n in self._recientes.get(sala, ()) if s > limite) / self.ventana
+                }
+                for sala, total in self._totales.items()
+            }
+
+
+class GestorSalas(socketio.BaseManager):
+    """
+    Administrador de clientes que codifica cada evento una sola vez por emisión
+
+    Admite una lista de salas como destino: cada cliente recibe el evento una vez
+    aunque esté en varias de ellas.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metricas = MetricasSalas()
+
+    def emit(self, event, data, namespace, room=None, skip_sid=None, callback=None, **kwargs):
+        if callback is not None or namespace not in self.rooms:
+            # Los acks son por cliente: no hay nada que compartir
+            return super().emit(event, data, namespace, room=room, skip_sid=skip_sid, callback=callback, **kwargs)
+        if not isinstance(skip_sid, list):
+            skip_sid = [skip_sid]
+        if isinstance(data, tuple):
+            data = list(data)
+        elif data is not None:
+            data = [data]
+        else:
+            data = []
+        paquete = self.server.packet_class(packet.EVENT, namespace=namespace, data=[event] + data)
+        # Codificar una vez; _send_packet reutiliza el resultado para cada cliente
+        codificado = paquete.encode()
+        paquete.encode = lambda: codificado
+
+        salas = room if isinstance(room, (list, tuple, set)) else [room]
+        enviados = set(skip_sid)
+        for sala in salas:
+            entregas = 0
+            for sid, eio_sid in self.get_participants(namespace, sala):
+                if sid in enviados:
+                    continue
+                enviados.add(sid)
+                self.server._send_packet(eio_sid, paquete)
+                entregas += 1
+            self.metricas.registrar(_nombre_metrica(sala), entregas)
+
+
+def _nombre_metrica(sala):
+    """Agrupa las emisiones a un cliente concreto (sala = sid) para no crear una métrica por conexión."""
+    if sala is None:
+        return '*'
+    if sala in (SALA_TODOS, SALA_UBICACIONES) or str(sala).startswith(PREFIJO_SALA_NODO):
+        return sala
+    return 'cliente'
+
+
+class _BrokerMemoria:
+    """Pub/sub dentro del proceso con la misma semántica que un canal de Redis (pruebas y desarrollo)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._suscriptores = {}  # canal -> lista de colas
+
+    def suscribir(self, canal):
+        cola = queue.Queue()
+        with self._lock:
+            self._suscriptores.setdefault(canal, []).append(cola)
+        return cola
+
+    def publicar(self, canal, mensaje):
+        with self._lock:
+            colas = list(self._suscriptores.get(canal, ()))
+        for cola in colas:
+            cola.put(mensaje)
+        return len(colas)
+
+
+_broker_memoria = _BrokerMemoria()
+
+
+class GestorSalasMemoria(socketio.PubSubManager, GestorSalas):
+    """
+    GestorSalas sobre una cola de mensajes en memoria (url 'memoria://canal')
+
+    Sustituto local de Redis: varios servidores Socket.IO del mismo proceso comparten
+    las emisiones igual que lo harían varios procesos con redis://. Los mensajes se
+    serializan con pickle como en RedisManager.
+    """
+    name = 'memoria'
+
+    def __init__(self, url='memoria://', channel='socketio', write_only=False, logger=None):
+        canal = url.split('://', 1)[1] if '://' in url else ''
+        super().__init__(channel=canal or channel, write_only=write_only, logger=logger)
+        self._cola = None if write_only else _broker_memoria.suscribir(self.channel)
+
+    def _publish(self, data):
+        return _broker_memoria.publicar(self.channel, pickle.dumps(data))
+
+    def _listen(self):
+        while True:
+            yield self._cola.get()
+
+
+# La cola reparte cada emisión y GestorSalas la entrega en cada proceso (codificada una vez).
+# Requieren el paquete redis o kombu respectivamente.
+class GestorSalasRedis(socketio.RedisManager, GestorSalas):
+    """GestorSalas compartido entre procesos a través de Redis."""
+
+
+class GestorSalasKombu(socketio.KombuManager, GestorSalas):
+    """GestorSalas compartido entre procesos a través de kombu (RabbitMQ, etc.)."""
+
+
+def crear_gestor_salas(url_cola=None, write_only=False):
+    """
+    Crea el administrador de clientes según la cola de mensajes configurada
+
+    Args:
+        url_cola: None (un solo proceso), 'memoria://canal', 'redis://...' o 'rediss://...',
+                  o cualquier otra url de kombu ('amqp://...')
+        write_only: Solo publica (procesos que emiten sin atender clientes, p. ej. la CLI)
+
+    Returns:
+        GestorSalas o una subclase que reparte las emisiones por la cola
+    """
+    if not url_cola:
+        return GestorSalas()
+    if url_cola.startswith('memoria://'):
+        return GestorSalasMemoria(url_cola, write_only=write_only)
+    if url_cola.startswith(('redis://', 'rediss://')):
+        return GestorSalasRedis(url_cola, write_only=write_only)
+    return GestorSalasKombu(url_cola, write_only=write_only)
+
+
+class DifusorAgrupado:
+    """
+    Agrupa las lecturas nuevas por sala y emite un único 'nuevos_datos' por sala y ventana
+
+    Con ráfagas (una gateway reenviando su buffer, muchos nodos a la vez) cada cliente
+    recibe como máximo un mensaje por sala y ventana. Si en una ventana llegan más de
+    max_filas lecturas se envían las más recientes y 'omitidos' indica cuántas faltan,
+    para que el cliente vuelva a pedir los datos.
+
+    El tope de mensajes es por sala, no por cliente: cada mensaje se serializa una vez
+    para toda la sala. Un cliente recibe en cada ventana un 'nuevos_datos' por sala a la
+    que está suscrito, más un 'ubicacion_nodo' por cada nodo que se movió. Las páginas
+    actuales se suscriben a una sola sala de lecturas ('todos' o la de un nodo).
+    """
+
+    def __init__(self, socketio, ventana=0.25, max_filas=200, max_mensajes_por_segundo=4):
+        """
+        Args:
+            socketio: Instancia de flask_socketio.SocketIO
+            ventana: Segundos que se acumulan lecturas antes de emitir
+            max_filas: Lecturas máximas por mensaje
+            max_mensajes_por_segundo: Tope de 'nuevos_datos' por sala cada segundo (alarga la ventana)
+        """
+        self.socketio = socketio
+        self.ventana = max(ventana, 1.0 / max_mensajes_por_segundo) if max_mensajes_por_segundo else ventana
+        self.max_filas = max_filas
+        self._lock = threading.Lock()
+        self._datos = {}        # sala -> lista de payloads
+        self._ubicaciones = {}  # salas -> {nodeId: payload} (solo la última por nodo)
+        self._tarea = None
+
+    def publicar(self, payload, salas):
+        """Encola una lectura (dict de to_dict) para las salas indicadas."""
+        with self._lock:
+            for sala in salas:
+                self._datos.setdefault(sala, []).append(payload)
+            self._arrancar()
+
+    def publicar_ubicacion(self, payload, salas):
+        """Encola una ubicación; dentro de una ventana solo se envía la última de cada nodo."""
+        with self._lock:
+            # Se agrupa por conjunto de salas: así el gestor no la envía dos veces a un mismo cliente
+            self._ubicaciones.setdefault(tuple(salas), {})[payload['nodeId']] = payload
+            self._arrancar()
+
+    def _arrancar(self):
+        # Se llama con el lock tomado; la tarea se crea al publicar por primera vez
+        if self._tarea is None:
+            self._tarea = self.socketio.start_background_task(self._bucle)
+
+    def _bucle(self):
+        while True:
+            self.socketio.sleep(self.ventana)
+            try:
+                self.vaciar()
+            except Exception as e:
+                log.warning('No se pudo emitir el lote de datos: %s', e)
+
+    def vaciar(self):
+        """Emite lo acumulado (una vez por sala) y deja los buffers vacíos."""
+        with self._lock:
+            datos, self._datos = self._datos, {}
+            ubicaciones, self._ubicaciones = self._ubicaciones, {}
+        for sala, lista in datos.items():
+            omitidos = max(len(lista) - self.max_filas, 0)
+            self.socketio.emit('nuevos_datos', {
+                'datos': lista[omitidos:],
+                'omitidos': omitidos
+            }, to=sala)
+        for salas, por_nodo in ubicaciones.items():
+            for payload in por_nodo.values():
+                self.socketio.emit('ubicacion_nodo', payload, to=list(salas))
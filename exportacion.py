@@ -0,0 +1,132 @@
+"""
+Exportación en streaming del histórico de sensores para AgroLink
+Convierte los bloques de database.iterar_datos en CSV, NDJSON o Parquet
+sin acumular el resultado completo en memoria.
+"""
+import csv
+import io
+import json
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet es opcional
+    pa = None
+    pq = None
+
+# Columnas fijas de cada fila de iterar_datos (los campos de sensor van a continuación)
+COLUMNAS_BASE = ('id', 'nodeId', 'timestamp', 'fecha_creacion', 'lat', 'lon')
+
+TIPOS_CONTENIDO = {
+    # Sin charset: Werkzeug agrega '; charset=utf-8' a los tipos text/*
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def formatos_disponibles():
+    """Formatos de exportación soportados en este entorno."""
+    return [f for f in TIPOS_CONTENIDO if f != 'parquet' or pa is not None]
+
+
+def _fecha_texto(fecha):
+    return fecha.isoformat(sep=' ', timespec='seconds') if fecha else None
+
+
+def exportar_csv(bloques, campos):
+    """Genera el CSV por partes: la cabecera y luego un fragmento por bloque."""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(COLUMNAS_BASE + tuple(campos))
+    yield buffer.getvalue()
+    for bloque in bloques:
+        buffer.seek(0)
+        buffer.truncate()
+        escritor.writerows(
+            (f[0], f[1], f[2], _fecha_texto(f[3])) + tuple(f[4:]) for f in bloque
+        )
+        yield buffer.getvalue()
+
+
+def exportar_ndjson(bloques, campos):
+    """Genera un objeto JSON por línea (omite los campos nulos, como DatosSensor.to_dict)."""
+    nombres = COLUMNAS_BASE + tuple(campos)
+    for bloque in bloques:
+        lineas = []
+        for fila in bloque:
+            registro = {k: v for k, v in zip(nombres, fila) if v is not None}
+            registro['fecha_creacion'] = _fecha_texto(fila[3])
+            lineas.append(json.dumps(registro, ensure_ascii=False))
+        if lineas:
+            yield '\n'.join(lineas) + '\n'
+
+
+class _SalidaEnMemoria:
+    """Destino tipo archivo para ParquetWriter: acumula lo escrito hasta que se retira."""
+
+    def __init__(self):
+        self._partes = []
+        self._posicion = 0
+        self.closed = False
+
+    def write(self, datos):
+        self._partes.append(bytes(datos))
+        self._posicion += len(datos)
+        return len(datos)
+
+    def tell(self):
+        return self._posicion
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def retirar(self):
+        datos = b''.join(self._partes)
+        self._partes = []
+        return datos
+
+
+_INDICE_TIMESTAMP = COLUMNAS_BASE.index('timestamp')
+
+
+def _entero_o_nulo(valor):
+    return valor if type(valor) is int else None
+
+
+def exportar_parquet(bloques, campos):
+    """Genera un archivo Parquet con un row group por bloque (requiere pyarrow)."""
+    if pa is None:
+        raise RuntimeError('Exportar a Parquet requiere pyarrow')
+    esquema = pa.schema(
+        [('id', pa.int64()), ('nodeId', pa.string()), ('timestamp', pa.int64()),
+         ('fecha_creacion', pa.timestamp('us', tz='UTC')), ('lat', pa.float64()), ('lon', pa.float64())]
+        + [(c, pa.float64()) for c in campos]
+    )
+    salida = _SalidaEnMemoria()
+    escritor = pq.ParquetWriter(salida, esquema, compression='zstd')
+    try:
+        for bloque in bloques:
+            columnas = list(zip(*bloque)) if bloque else [[] for _ in esquema]
+            # timestamp llega tal cual del payload: lo que no es entero (p. ej. "abc") va como nulo,
+            # porque un error aquí cortaría el archivo con la respuesta 200 ya enviada
+            columnas[_INDICE_TIMESTAMP] = [_entero_o_nulo(v) for v in columnas[_INDICE_TIMESTAMP]]
+            escritor.write_table(pa.Table.from_arrays(
+                [pa.array(col, type=campo.type) for col, campo in zip(columnas, esquema)], schema=esquema
+            ))
+            datos = salida.retirar()
+            if datos:
+                yield datos
+    finally:
+        escritor.close()
+    yield salida.retirar()
+
+
+EXPORTADORES = {
+    'csv': exportar_csv,
+    'ndjson': exportar_ndjson,
+    'parquet': exportar_parquet,
+}
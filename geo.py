@@ -0,0 +1,209 @@
+"""
+Utilidades geoespaciales de AgroLink
+Geohash de las ubicaciones (una columna indexada en datos_sensor y estado_nodo) y
+traducción de cajas del mapa y radios a rangos de geohash: una caja se cubre con
+unas pocas celdas y cada racha de celdas contiguas es un rango geohash >= desde
+AND geohash < hasta que recorre el índice. Funciona igual en SQLite y PostgreSQL.
+"""
+import math
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+# Precisión guardada: 9 caracteres son celdas de ~4.8 m x 4.8 m
+PRECISION = 9
+RADIO_TIERRA_M = 6371008.8
+METROS_POR_GRADO = math.pi * RADIO_TIERRA_M / 180
+
+
+# Bits de un byte separados por un cero (abcdefgh -> 0a0b0c0d0e0f0g0h) para intercalar
+_SEPARADOS = [sum(((b >> i) & 1) << (2 * i) for i in range(8)) for b in range(256)]
+
+
+def _separar(x):
+    return _SEPARADOS[x & 255] | _SEPARADOS[(x >> 8) & 255] << 16 | _SEPARADOS[(x >> 16) & 255] << 32
+
+
+def geohash(lat, lon, precision=PRECISION):
+    """
+    Geohash de un punto
+
+    Cuantiza latitud y longitud a enteros de la mitad de los bits cada una e intercala
+    sus bits (empezando por la longitud), en lugar de bisecar bit a bit.
+
+    Args:
+        lat: Latitud en grados
+        lon: Longitud en grados
+        precision: Número de caracteres (máximo 9)
+
+    Returns:
+        str: Geohash en base 32
+    """
+    bits = 5 * precision
+    bits_lon, bits_lat = (bits + 1) // 2, bits // 2
+    x = min(max(int((lon + 180.0) / 360.0 * (1 << bits_lon)), 0), (1 << bits_lon) - 1)
+    y = min(max(int((lat + 90.0) / 180.0 * (1 << bits_lat)), 0), (1 << bits_lat) - 1)
+    # Con un número impar de bits la longitud ocupa también el bit menos significativo
+    valor = (_separar(x) | _separar(y) << 1) if bits % 2 else (_separar(x) << 1 | _separar(y))
+    return ''.join(_BASE32[(valor >> desplazamiento) & 31] for desplazamiento in range(bits - 5, -1, -5))
+
+
+def _tamano_celda(precision):
+    """(alto, ancho) en grados de una celda: la longitud se lleva el bit impar."""
+    bits = 5 * precision
+    return 180.0 / (1 << (bits // 2)), 360.0 / (1 << ((bits + 1) // 2))
+
+
+def _indices(minimo, maximo, origen, paso, total):
+    desde = min(max(int((minimo - origen) // paso), 0), total - 1)
+    hasta = min(max(int((maximo - origen) // paso), 0), total - 1)
+    return desde, hasta
+
+
+def celdas_caja(sur, oeste, norte, este, max_celdas=32):
+    """
+    Celdas geohash que cubren una caja (oeste <= este), con la mayor precisión que no pase de max_celdas
+
+    Returns:
+        list: Geohashes de las celdas (todas de la misma longitud)
+    """
+    elegida = None
+    for precision in range(1, PRECISION + 1):
+        alto, ancho = _tamano_celda(precision)
+        filas = _indices(sur, norte, -90.0, alto, round(180.0 / alto))
+        columnas = _indices(oeste, este, -180.0, ancho, round(360.0 / ancho))
+        if elegida is not None and (filas[1] - filas[0] + 1) * (columnas[1] - columnas[0] + 1) > max_celdas:
+            break
+        elegida = (precision, alto, ancho, filas, columnas)
+    precision, alto, ancho, filas, columnas = elegida
+    # El centro de cada celda da su geohash sin ambigüedad en los bordes
+    return [geohash(-90.0 + (i + 0.5) * alto, -180.0 + (j + 0.5) * ancho, precision)
+            for i in range(filas[0], filas[1] + 1) for j in range(columnas[0], columnas[1] + 1)]
+
+
+def _siguiente(prefijo):
+    """Primer geohash mayor que todos los que empiezan por prefijo (None si no hay)."""
+    prefijo = prefijo.rstrip(_BASE32[-1])
+    if not prefijo:
+        return None
+    return prefijo[:-1] + _BASE32[_BASE32.index(prefijo[-1]) + 1]
+
+
+def rangos_caja(sur, oeste, norte, este, max_celdas=32):
+    """
+    Rangos [desde, hasta) de geohash que cubren una caja (oeste <= este)
+
+    El alfabeto base 32 está en orden ASCII, así que un prefijo equivale a un rango de
+    texto y las celdas contiguas en ese orden se juntan en un solo rango.
+
+    Returns:
+        list: Tuplas (desde, hasta); hasta None = sin límite superior
+    """
+    rangos = []
+    for celda in sorted(set(celdas_caja(sur, oeste, norte, este, max_celdas))):
+        if rangos and rangos[-1][1] == celda:
+            rangos[-1][1] = _siguiente(celda)
+        else:
+            rangos.append([celda, _siguiente(celda)])
+    return [tuple(r) for r in rangos]
+
+
+def _envolver(lon):
+    return lon if -180.0 <= lon <= 180.0 else (lon + 180.0) % 360.0 - 180.0
+
+
+def normalizar_caja(sur, oeste, norte, este):
+    """
+    Caja del mapa (p. ej. la de Leaflet, que pasa de ±180 al dar la vuelta al mundo) como
+    una o dos cajas dentro de [-90, 90] x [-180, 180]: dos si cruza el antimeridiano
+
+    Returns:
+        list: Tuplas (sur, oeste, norte, este) con oeste <= este
+
+    Raises:
+        ValueError: Si sur > norte
+    """
+    if sur > norte:
+        raise ValueError("Caja inválida: el sur está al norte del norte")
+    sur, norte = max(sur, -90.0), min(norte, 90.0)
+    if este - oeste >= 360.0:
+        return [(sur, -180.0, norte, 180.0)]
+    oeste, este = _envolver(oeste), _envolver(este)
+    if oeste <= este:
+        return [(sur, oeste, norte, este)]
+    return [(sur, oeste, norte, 180.0), (sur, -180.0, norte, este)]
+
+
+def caja_radio(lat, lon, radio_m):
+    """
+    Cajas que contienen el círculo de radio_m metros alrededor de (lat, lon)
+
+    Returns:
+        list: Como normalizar_caja (dos cajas si el círculo cruza el antimeridiano)
+    """
+    dlat = radio_m / METROS_POR_GRADO
+    sur, norte = lat - dlat, lat + dlat
+    # El círculo es más ancho en grados de longitud en su borde más cercano al polo
+    coseno = math.cos(math.radians(min(abs(lat) + dlat, 90.0)))
+    if sur <= -90.0 or norte >= 90.0 or coseno < 1e-9 or dlat / coseno >= 180.0:
+        return normalizar_caja(sur, -180.0, norte, 180.0)
+    dlon = dlat / coseno
+    return normalizar_caja(sur, lon - dlon, norte, lon + dlon)
+
+
+def distancia_m(lat1, lon1, lat2, lon2):
+    """Distancia en metros sobre la esfera (haversine)."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * RADIO_TIERRA_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def metros_por_pixel(zoom, lat=0.0):
+    """Metros que cubre un pixel de un mapa web (Web Mercator, teselas de 256 px) en un zoom y latitud."""
+    return 156543.03392 * math.cos(math.radians(lat)) / (2 ** zoom)
+
+
+def simplificar(puntos, tolerancia_m):
+    """
+    Douglas–Peucker: índices de los puntos de un trayecto que hay que conservar para que
+    ninguno de los descartados quede a más de tolerancia_m metros de la línea simplificada
+
+    Proyecta los puntos a metros en un plano local (equirectangular), que basta para las
+    distancias cortas de un trayecto. Iterativo: no tiene límite de recursión.
+
+    Args:
+        puntos: Secuencia de (lat, lon) en orden
+        tolerancia_m: Distancia máxima en metros (0 = conservar todos)
+
+    Returns:
+        list: Índices conservados en orden (siempre el primero y el último)
+    """
+    n = len(puntos)
+    if n < 3 or tolerancia_m <= 0:
+        return list(range(n))
+    lat0 = puntos[0][0]
+    escala = math.cos(math.radians(lat0)) * METROS_POR_GRADO
+    xs = [(lon - puntos[0][1]) * escala for _, lon in puntos]
+    ys = [(lat - lat0) * METROS_POR_GRADO for lat, _ in puntos]
+    conservar = [False] * n
+    conservar[0] = conservar[-1] = True
+    tolerancia2 = tolerancia_m * tolerancia_m
+    pendientes = [(0, n - 1)]
+    while pendientes:
+        inicio, fin = pendientes.pop()
+        ax, ay = xs[inicio], ys[inicio]
+        dx, dy = xs[fin] - ax, ys[fin] - ay
+        largo2 = dx * dx + dy * dy
+        peor, peor_d2 = None, tolerancia2
+        for i in range(inicio + 1, fin):
+            px, py = xs[i] - ax, ys[i] - ay
+            if largo2:
+                # Distancia al segmento (no a la recta): los trayectos pueden volver sobre sí mismos
+                t = min(max((px * dx + py * dy) / largo2, 0.0), 1.0)
+                px, py = px - t * dx, py - t * dy
+            d2 = px * px + py * py
+            if d2 > peor_d2:
+                peor, peor_d2 = i, d2
+        if peor is not None:
+            conservar[peor] = True
+            pendientes.append((inicio, peor))
+            pendientes.append((peor, fin))
+    return [i for i in range(n) if conservar[i]]
@@ -0,0 +1,191 @@
+"""
+Cola de ingesta asíncrona (write-behind) para AgroLink
+Desacopla la respuesta HTTP de /datos de la escritura en la base de datos:
+las lecturas normalizadas se encolan y un hilo escritor las guarda en lotes.
+Un lote que falla se reintenta con espera creciente; si sigue fallando, sus lecturas
+van a un archivo de descartes (una línea JSON por lectura) en lugar de perderse.
+"""
+import json
+import os
+import queue
+import threading
+import time
+
+from bitacora import obtener_logger
+
+log = obtener_logger('ingesta')
+
+
+class ColaIngesta:
+    """
+    Cola acotada de lecturas pendientes de guardar, drenada por un único hilo escritor
+
+    El escritor agrupa lecturas y hace un commit por lote: guarda cuando el lote
+    alcanza max_lote o cuando pasa intervalo segundos desde la primera lectura del lote.
+    Los clientes ya recibieron un 202, así que un lote fallido (p. ej. "database is
+    locked") se reintenta y, agotados los reintentos, se escribe en archivo_descartes.
+    """
+
+    def __init__(self, app, guardar_lote, al_guardar=None, capacidad=10000, max_lote=500, intervalo=0.25,
+                 reintentos=3, espera_reintento=0.5, archivo_descartes=None):
+        """
+        Args:
+            app: Aplicación Flask (el escritor trabaja dentro de su app_context)
+            guardar_lote: Función que recibe una lista de kwargs y devuelve los objetos guardados
+            al_guardar: Función opcional llamada con los objetos guardados (p. ej. emitir por SocketIO)
+            capacidad: Número máximo de lecturas en espera antes de rechazar nuevas
+            max_lote: Número máximo de lecturas por commit
+            intervalo: Segundos máximos que una lectura espera antes de forzar el commit
+            reintentos: Reintentos de un lote que falla antes de descartarlo
+            espera_reintento: Segundos antes del primer reintento (se duplica en cada uno)
+            archivo_descartes: Archivo JSON Lines donde se guardan los lotes que no se
+                pudieron guardar (None = solo se registran en la bitácora)
+        """
+        self.app = app
+        self.guardar_lote = guardar_lote
+        self.al_guardar = al_guardar
+        self.capacidad = capacidad
+        self.max_lote = max_lote
+        self.intervalo = intervalo
+        self.reintentos = reintentos
+        self.espera_reintento = espera_reintento
+        self.archivo_descartes = archivo_descartes
+        self._cola = queue.Queue(maxsize=capacidad)
+        self._detener = threading.Event()
+        self._hilo = None
+        self._lock = threading.Lock()
+        # Contadores
+        self.encolados = 0
+        self.rechazados = 0
+        self.guardados = 0
+        self.fallidos = 0  # lecturas que no se pudieron guardar tras los reintentos (van a descartes)
+        self.lotes_reintentados = 0
+        self.commits = 0
+        self.ultimo_lote = 0
+        self.lote_maximo = 0
+
+    def iniciar(self):
+        """Arranca el hilo escritor (idempotente)."""
+        if self._hilo and self._hilo.is_alive():
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._bucle, name='agrolink-ingesta', daemon=True)
+        self._hilo.start()
+
+    def encolar(self, registro):
+        """
+        Encola una lectura sin bloquear
+
+        Args:
+            registro: dict con los argumentos de guardar_dato_sensor
+
+        Returns:
+            bool: True si se encoló, False si la cola está llena o detenida
+        """
+        if self._detener.is_set():
+            return False
+        try:
+            self._cola.put_nowait(registro)
+        except queue.Full:
+            with self._lock:
+                self.rechazados += 1
+            return False
+        with self._lock:
+            self.encolados += 1
+        return True
+
+    def detener(self, timeout=10):
+        """Deja de aceptar lecturas y espera a que el escritor guarde lo pendiente."""
+        self._detener.set()
+        if self._hilo and self._hilo.is_alive():
+            self._hilo.join(timeout)
+
+    def metricas(self):
+        """Devuelve los contadores de la cola."""
+        with self._lock:
+            return {
+                'profundidad': self._cola.qsize(),
+                'capacidad': self.capacidad,
+                'encolados': self.encolados,
+                'rechazados': self.rechazados,
+                'guardados': self.guardados,
+                'fallidos': self.fallidos,
+                'lotes_reintentados': self.lotes_reintentados,
+                'commits': self.commits,
+                'ultimo_lote': self.ultimo_lote,
+                'lote_maximo': self.lote_maximo,
+                'lote_promedio': (self.guardados / self.commits) if self.commits else 0
+            }
+
+    def _tomar_lote(self):
+        """Espera la primera lectura y agrupa las siguientes hasta max_lote o intervalo."""
+        try:
+            primero = self._cola.get(timeout=self.intervalo)
+        except queue.Empty:
+            return []
+        lote = [primero]
+        limite = time.monotonic() + self.intervalo
+        while len(lote) < self.max_lote:
+            restante = limite - time.monotonic()
+            try:
+                if restante <= 0 or self._detener.is_set():
+                    lote.append(self._cola.get_nowait())
+                else:
+                    lote.append(self._cola.get(timeout=restante))
+            except queue.Empty:
+                break
+        return lote
+
+    def _bucle(self):
+        while not (self._detener.is_set() and self._cola.empty()):
+            lote = self._tomar_lote()
+            if lote:
+                self._guardar(lote)
+
+    def _guardar(self, lote):
+        espera = self.espera_reintento
+        for intento in range(self.reintentos + 1):
+            try:
+                with self.app.app_context():
+                    guardados = self.guardar_lote(lote)
+                break
+            except Exception as e:
+                if intento == self.reintentos:
+                    log.error('Error guardando lote de la cola de ingesta (%d filas), se descarta: %s', len(lote), e)
+                    self._descartar(lote, e)
+                    return
+                log.warning('Error guardando lote de la cola de ingesta (%d filas), reintento en %g s: %s',
+                            len(lote), espera, e)
+                with self._lock:
+                    self.lotes_reintentados += 1
+                # Al detener se espera igual: el proceso no termina hasta guardar o descartar
+                time.sleep(espera)
+                espera *= 2
+        with self._lock:
+            self.guardados += len(guardados)
+            self.commits += 1
+            self.ultimo_lote = len(guardados)
+            self.lote_maximo = max(self.lote_maximo, len(guardados))
+        if self.al_guardar:
+            try:
+                self.al_guardar(guardados)
+            except Exception as e:
+                log.warning('No se pudo notificar el lote guardado: %s', e)
+
+    def _descartar(self, lote, error):
+        """Escribe las lecturas de un lote fallido en el archivo de descartes (JSON Lines)."""
+        with self._lock:
+            self.fallidos += len(lote)
+        if not self.archivo_descartes:
+            log.error('Lecturas descartadas sin archivo de descartes: %s', json.dumps(lote, default=str))
+            return
+        try:
+            directorio = os.path.dirname(self.archivo_descartes)
+            if directorio:
+                os.makedirs(directorio, exist_ok=True)
+            with open(self.archivo_descartes, 'a', encoding='utf-8') as archivo:
+                for registro in lote:
+                    archivo.write(json.dumps({'lectura': registro, 'error': str(error)}, default=str) + '\n')
+        except OSError as e:
+            log.error('No se pudo escribir el archivo de descartes %s: %s; lecturas: %s',
+                      self.archivo_descartes, e, json.dumps(lote, default=str))
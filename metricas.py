@@ -0,0 +1,387 @@
+"""
+Métricas de AgroLink en formato de texto de Prometheus (/metrics)
+Contadores, medidores e histogramas en memoria, sin dependencias, con un lock por
+métrica: registrar una observación cuesta unos microsegundos, así que quedan activas
+en producción (AGROLINK_METRICAS=0 las desactiva; benchmarks/bench_metricas.py compara ambos).
+
+Instrumentacion mide:
+  - peticiones HTTP por ruta (la regla, no la URL), método y código, y su duración
+  - eventos de Socket.IO por nombre y resultado, y su duración
+  - consultas SQL por función de database.py que las lanzó, y su duración
+  - duración de los commits
+  - clientes Socket.IO conectados y filas ingeridas (total y por segundo)
+Las emisiones por sala, la cola de ingesta, etc. se agregan con recolectores que leen
+los contadores que ya llevan esos módulos al generar /metrics.
+
+Cada proceso lleva sus propios contadores: con varios procesos (serve.py --procesos)
+cada lectura de /metrics la responde uno de ellos.
+"""
+import bisect
+import inspect
+import sys
+import threading
+import time
+from collections import deque
+from functools import wraps
+
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# Límites superiores (segundos) de las cubetas de los histogramas
+CUBETAS_HTTP = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CUBETAS_BD = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _etiquetas(nombres, valores, extra=''):
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+
+def _numero(valor):
+    if valor == float('inf'):
+        return '+Inf'
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+def funcion_llamadora(globales):
+    """
+    Nombre de la función más externa del módulo con estos globales en la pila actual
+
+    Recorre la pila desde quien llama hacia afuera y se queda con el último marco
+    contiguo del módulo (p. ej. la función pública de database.py, no su helper).
+
+    Returns:
+        str o None si la pila no pasa por el módulo
+    """
+    nombre = None
+    marco = sys._getframe(1)
+    while marco is not None:
+        if marco.f_globals is globales:
+            nombre = marco.f_code.co_name
+        elif nombre is not None:
+            break
+        marco = marco.f_back
+    return nombre
+
+
+class _Metrica:
+    tipo = None
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._lock = threading.Lock()
+        self._valores = {}  # tupla de valores de etiquetas -> valor
+
+    def _encabezado(self):
+        return [f'# HELP {self.nombre} {self.ayuda}', f'# TYPE {self.nombre} {self.tipo}']
+
+    def exponer(self):
+        with self._lock:
+            valores = sorted(self._valores.items())
+        lineas = self._encabezado()
+        for clave, valor in valores:
+            lineas.append(f'{self.nombre}{_etiquetas(self.etiquetas, clave)} {_numero(valor)}')
+        return lineas
+
+
+class Contador(_Metrica):
+    """Valor que solo crece (peticiones, filas, consultas)."""
+    tipo = 'counter'
+
+    def inc(self, cantidad=1, *etiquetas):
+        with self._lock:
+            self._valores[etiquetas] = self._valores.get(etiquetas, 0) + cantidad
+
+
+class Medidor(_Metrica):
+    """
+    Valor que sube y baja (clientes conectados)
+
+    Con `funcion` el valor se lee al exponer en lugar de llevarse a mano.
+    """
+    tipo = 'gauge'
+
+    def __init__(self, nombre, ayuda, etiquetas=(), funcion=None):
+        super().__init__(nombre, ayuda, etiquetas)
+        self._funcion = funcion
+
+    def fijar(self, valor, *etiquetas):
+        with self._lock:
+            self._valores[etiquetas] = valor
+
+    def inc(self, cantidad=1, *etiquetas):
+        with self._lock:
+            self._valores[etiquetas] = self._valores.get(etiquetas, 0) + cantidad
+
+    def dec(self, cantidad=1, *etiquetas):
+        self.inc(-cantidad, *etiquetas)
+
+    def exponer(self):
+        if self._funcion is not None:
+            return self._encabezado() + [f'{self.nombre} {_numero(self._funcion())}']
+        return super().exponer()
+
+
+class Histograma(_Metrica):
+    """Distribución de duraciones en cubetas acumuladas, con suma y cantidad."""
+    tipo = 'histogram'
+
+    def __init__(self, nombre, ayuda, etiquetas=(), cubetas=CUBETAS_HTTP):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.cubetas = tuple(sorted(cubetas))
+
+    def observar(self, valor, *etiquetas):
+        # Índice de la primera cubeta con límite >= valor (la última es +Inf)
+        i = bisect.bisect_left(self.cubetas, valor)
+        with self._lock:
+            serie = self._valores.get(etiquetas)
+            if serie is None:
+                serie = self._valores[etiquetas] = [[0] * (len(self.cubetas) + 1), 0.0, 0]
+            serie[0][i] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def exponer(self):
+        with self._lock:
+            valores = sorted((clave, (list(c), s, n)) for clave, (c, s, n) in self._valores.items())
+        lineas = self._encabezado()
+        limites = self.cubetas + (float('inf'),)
+        for clave, (cuentas, suma, cantidad) in valores:
+            acumulado = 0
+            for limite, cuenta in zip(limites, cuentas):
+                acumulado += cuenta
+                etiquetas = _etiquetas(self.etiquetas, clave, f'le="{_numero(limite)}"')
+                lineas.append(f'{self.nombre}_bucket{etiquetas} {acumulado}')
+            etiquetas = _etiquetas(self.etiquetas, clave)
+            lineas.append(f'{self.nombre}_sum{etiquetas} {_numero(suma)}')
+            lineas.append(f'{self.nombre}_count{etiquetas} {cantidad}')
+        return lineas
+
+
+class RegistroMetricas:
+    """Conjunto de métricas y recolectores que forman la respuesta de /metrics."""
+
+    def __init__(self):
+        self._metricas = []
+        self._recolectores = []
+
+    def _agregar(self, metrica):
+        self._metricas.append(metrica)
+        return metrica
+
+    def contador(self, nombre, ayuda, etiquetas=()):
+        return self._agregar(Contador(nombre, ayuda, etiquetas))
+
+    def medidor(self, nombre, ayuda, etiquetas=(), funcion=None):
+        return self._agregar(Medidor(nombre, ayuda, etiquetas, funcion))
+
+    def histograma(self, nombre, ayuda, etiquetas=(), cubetas=CUBETAS_HTTP):
+        return self._agregar(Histograma(nombre, ayuda, etiquetas, cubetas))
+
+    def recolector(self, funcion):
+        """
+        Registra una función que devuelve métricas calculadas al exponer
+
+        Args:
+            funcion: Sin argumentos; devuelve una lista de (nombre, tipo, ayuda, muestras)
+                     con muestras = [(dict de etiquetas, valor), ...]
+        """
+        self._recolectores.append(funcion)
+        return funcion
+
+    def exponer(self):
+        """Texto de todas las métricas en el formato de exposición de Prometheus 0.0.4."""
+        lineas = []
+        for metrica in self._metricas:
+            lineas.extend(metrica.exponer())
+        for recolector in self._recolectores:
+            for nombre, tipo, ayuda, muestras in recolector():
+                lineas.append(f'# HELP {nombre} {ayuda}')
+                lineas.append(f'# TYPE {nombre} {tipo}')
+                for etiquetas, valor in muestras:
+                    lineas.append(f'{nombre}{_etiquetas(etiquetas.keys(), etiquetas.values())} {_numero(valor)}')
+        return '\n'.join(lineas) + '\n'
+
+
+class TasaVentana:
+    """Cantidad por segundo en los últimos `ventana` segundos (p. ej. filas ingeridas)."""
+
+    def __init__(self, ventana=60):
+        self.ventana = ventana
+        self._lock = threading.Lock()
+        self._segundos = deque()  # [segundo, cantidad] del más viejo al más nuevo
+
+    def registrar(self, cantidad):
+        segundo = int(time.monotonic())
+        with self._lock:
+            if self._segundos and self._segundos[-1][0] == segundo:
+                self._segundos[-1][1] += cantidad
+            else:
+                self._segundos.append([segundo, cantidad])
+                self._podar(segundo)
+
+    def _podar(self, ahora):
+        while self._segundos and self._segundos[0][0] <= ahora - self.ventana:
+            self._segundos.popleft()
+
+    def por_segundo(self):
+        with self._lock:
+            self._podar(int(time.monotonic()))
+            return sum(cantidad for _, cantidad in self._segundos) / self.ventana
+
+
+class Instrumentacion:
+    """
+    Métricas de la app: HTTP, Socket.IO, base de datos, commits, clientes e ingesta
+
+    Con activa=False los decoradores devuelven la función sin envolver y instrumentar_*
+    no registra nada, así que no queda ningún costo en el camino de las peticiones.
+    """
+
+    def __init__(self, activa=True):
+        self.activa = activa
+        self.registro = r = RegistroMetricas()
+        self.peticiones = r.contador('agrolink_http_peticiones_total', 'Peticiones HTTP atendidas',
+                                     ('ruta', 'metodo', 'codigo'))
+        self.duracion_peticiones = r.histograma('agrolink_http_duracion_segundos', 'Duración de las peticiones HTTP',
+                                                ('ruta', 'metodo'))
+        self.eventos = r.contador('agrolink_socketio_eventos_total', 'Eventos de Socket.IO recibidos',
+                                  ('evento', 'resultado'))
+        self.duracion_eventos = r.histograma('agrolink_socketio_duracion_segundos',
+                                             'Duración de los manejadores de eventos de Socket.IO', ('evento',))
+        self.clientes = r.medidor('agrolink_socketio_clientes_conectados', 'Clientes de Socket.IO conectados')
+        self.consultas = r.contador('agrolink_bd_consultas_total', 'Consultas SQL por función de database.py',
+                                    ('funcion',))
+        self.duracion_consultas = r.histograma('agrolink_bd_consulta_duracion_segundos',
+                                               'Duración de las consultas SQL por función de database.py',
+                                               ('funcion',), CUBETAS_BD)
+        self.duracion_commits = r.histograma('agrolink_bd_commit_duracion_segundos',
+                                             'Duración de los commits (incluye el flush)', (), CUBETAS_BD)
+        self.filas_ingeridas = r.contador('agrolink_ingesta_filas_total', 'Lecturas guardadas')
+        self.tasa_ingesta = TasaVentana(60)
+        r.medidor('agrolink_ingesta_filas_por_segundo', 'Lecturas guardadas por segundo (último minuto)',
+                  funcion=self.tasa_ingesta.por_segundo)
+
+    # ---- HTTP ----
+
+    def instrumentar_app(self, app):
+        """Mide cada petición con before_request/after_request (la ruta es la regla de URL)."""
+        if not self.activa:
+            return
+
+        @app.before_request
+        def _inicio_peticion():
+            request.environ['agrolink.inicio'] = time.perf_counter()
+
+        @app.after_request
+        def _fin_peticion(respuesta):
+            peticion = request._get_current_object()
+            inicio = peticion.environ.get('agrolink.inicio')
+            if inicio is not None:
+                # Las URL sin ruta (404) se agrupan para no crear una serie por URL
+                ruta = peticion.url_rule.rule if peticion.url_rule is not None else 'sin_ruta'
+                self.peticiones.inc(1, ruta, peticion.method, str(respuesta.status_code))
+                self.duracion_peticiones.observar(time.perf_counter() - inicio, ruta, peticion.method)
+            return respuesta
+
+    # ---- Socket.IO ----
+
+    def evento(self, nombre):
+        """
+        Decorador de manejadores de Socket.IO (debajo de @socketio.on)
+
+        Llama al manejador con tantos argumentos como acepte: Flask-SocketIO pasa `auth`
+        a 'connect' y reintenta sin él si el manejador no lo recibe.
+        """
+        def decorador(manejador):
+            if not self.activa:
+                return manejador
+            parametros = inspect.signature(manejador).parameters.values()
+            variadico = any(p.kind == p.VAR_POSITIONAL for p in parametros)
+            n_args = len([p for p in parametros if p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD)])
+
+            @wraps(manejador)
+            def envoltura(*args):
+                inicio = time.perf_counter()
+                resultado = 'ok'
+                try:
+                    return manejador(*(args if variadico else args[:n_args]))
+                except Exception:
+                    resultado = 'error'
+                    raise
+                finally:
+                    self.eventos.inc(1, nombre, resultado)
+                    self.duracion_eventos.observar(time.perf_counter() - inicio, nombre)
+            return envoltura
+        return decorador
+
+    def cliente_conectado(self):
+        if self.activa:
+            self.clientes.inc()
+
+    def cliente_desconectado(self):
+        if self.activa:
+            self.clientes.dec()
+
+    # ---- Base de datos ----
+
+    def instrumentar_bd(self, motor, modulo):
+        """
+        Cuenta y mide las consultas de `motor` y los commits de las sesiones
+
+        Cada consulta se atribuye a la función más externa de `modulo` (database.py) en la
+        pila de llamadas: la función pública que llamó la app, no el helper interno. Las
+        que no salen de ese módulo (cargas perezosas desde las vistas, etc.) van a 'otro'.
+        """
+        if not self.activa:
+            return
+        globales = vars(modulo)
+
+        @event.listens_for(motor, 'before_cursor_execute')
+        def _antes_consulta(conexion, cursor, sentencia, parametros, contexto, varias):
+            if contexto is not None:
+                contexto._inicio_metricas = time.perf_counter()
+
+        @event.listens_for(motor, 'after_cursor_execute')
+        def _despues_consulta(conexion, cursor, sentencia, parametros, contexto, varias):
+            inicio = getattr(contexto, '_inicio_metricas', None)
+            if inicio is None:
+                return
+            duracion = time.perf_counter() - inicio
+            funcion = funcion_llamadora(globales) or 'otro'
+            self.consultas.inc(1, funcion)
+            self.duracion_consultas.observar(duracion, funcion)
+
+        @event.listens_for(Session, 'before_commit')
+        def _antes_commit(sesion):
+            sesion.info['inicio_commit'] = time.perf_counter()
+
+        @event.listens_for(Session, 'after_commit')
+        def _despues_commit(sesion):
+            inicio = sesion.info.pop('inicio_commit', None)
+            if inicio is not None:
+                self.duracion_commits.observar(time.perf_counter() - inicio)
+
+        @event.listens_for(Session, 'after_rollback')
+        def _despues_rollback(sesion):
+            sesion.info.pop('inicio_commit', None)
+
+    # ---- Ingesta ----
+
+    def registrar_ingesta(self, filas):
+        """Suma `filas` lecturas guardadas al total y a la tasa por segundo."""
+        if self.activa and filas:
+            self.filas_ingeridas.inc(filas)
+            self.tasa_ingesta.registrar(filas)
+
+    def exponer(self):
+        return self.registro.exponer()
@@ -0,0 +1,134 @@
+"""
+Normalización de payloads de sensores para AgroLink
+Traduce los alias que envían los distintos firmwares a los nombres canónicos
+de DatosSensor. Las tablas de alias se construyen una sola vez al importar.
+"""
+from typing import NamedTuple, Optional
+
+
+class Lectura(NamedTuple):
+    """Lectura normalizada, con los mismos nombres que los argumentos de guardar_dato_sensor"""
+    temperatura: Optional[float] = None
+    humedad: Optional[float] = None
+    soil_moisture: Optional[float] = None
+    light: Optional[float] = None
+    percentage: Optional[float] = None
+    lat: Optional[float] = None
+    lon: Optional[float] = None
+    node_id: str = 'unknown'
+    timestamp: Optional[int] = None
+
+
+# Nombre canónico -> alias aceptados, en orden de preferencia
+CAMPOS_ALIAS = {
+    'temperatura': ('temperature', 'temp', 't'),
+    'humedad': ('humidity', 'hum', 'h'),
+    'soil_moisture': (),
+    'light': ('luz', 'lux', 'l'),
+    'percentage': ('luz_porcentaje', 'light_percentage', 'porcentaje', 'pct'),
+    'lat': ('latitude', 'latitud', 'y'),
+    'lon': ('longitude', 'longitud', 'lng', 'x')
+}
+
+# Clave recibida -> (índice del campo en Lectura, prioridad). El canónico tiene prioridad 0
+_TABLA_ALIAS = {}
+for _canon, _aliases in CAMPOS_ALIAS.items():
+    _indice = Lectura._fields.index(_canon)
+    for _prioridad, _clave in enumerate((_canon,) + _aliases):
+        _TABLA_ALIAS[_clave] = (_indice, _prioridad)
+
+# Claves cuya presencia indica que el payload trae lecturas (un mensaje de gateway no las trae)
+CLAVES_SENSOR = frozenset([
+    'temperatura', 'temperature', 'temp', 't', 'humedad', 'humidity', 'hum', 'h', 'soil_moisture',
+    'light', 'luz', 'lux', 'l', 'percentage', 'luz_porcentaje', 'light_percentage', 'porcentaje', 'pct',
+    'lat', 'latitude', 'latitud', 'lon', 'longitude', 'longitud', 'lng'
+])
+
+_VALORES_NULOS = frozenset(('no data', 'nodata', 'none', '', 'null'))
+_CLAVES_IP = ('gateway_ip', 'ip', 'gatewayIP')
+_NUM_CAMPOS = len(CAMPOS_ALIAS)
+_nueva_lectura = tuple.__new__
+# Enteros mayores no caben en un float (float() lanzaría OverflowError)
+_INT_MAX = 2 ** 1023
+
+
+def parse_maybe_float(val):
+    """
+    Convierte a float si es posible.
+    Si el valor es None devuelve None.
+    Si el valor es una cadena que equivale a "no data", "none", "", "null" devuelve None.
+    Si la cadena puede convertirse a float, devuelve el float.
+    En cualquier otro caso devuelve None.
+    """
+    # Camino rápido: la mayoría de firmwares ya envían números
+    if type(val) is float:
+        return val
+    if val is None:
+        return None
+    if isinstance(val, str):
+        s = val.strip().lower()
+        if s in _VALORES_NULOS:
+            return None
+        try:
+            return float(s)
+        except ValueError:
+            return None
+    if isinstance(val, (int, float)):
+        try:
+            return float(val)
+        except OverflowError:
+            return None
+    return None
+
+
+def normalizar_payload(data):
+    """
+    Normaliza un payload recibido en /datos
+
+    Args:
+        data: dict recibido del nodo o gateway (no se modifica)
+
+    Returns:
+        tuple: ('gateway', ip) si el payload solo actualiza la IP de la gateway (ip puede ser None si vino vacía)
+               ('dato', Lectura) con la lectura normalizada
+    """
+    # Si es un mensaje de gateway con IP y sin sensores, manejar primero
+    if 'ip' in data and str(data.get('nodeId') or '').lower() == 'gateway' and CLAVES_SENSOR.isdisjoint(data):
+        return 'gateway', (str(data['ip']) if data['ip'] else None)
+
+    # Una sola pasada por las claves recibidas: quedarse con la de mayor prioridad por campo
+    valores = [None] * _NUM_CAMPOS
+    prioridades = [99] * _NUM_CAMPOS
+    hay_campos = False
+    tabla = _TABLA_ALIAS
+    for clave in data:
+        destino = tabla.get(clave)
+        if destino is None:
+            continue
+        indice, prioridad = destino
+        if prioridad > prioridades[indice]:
+            continue
+        prioridades[indice] = prioridad
+        valor = data[clave]
+        # Camino rápido: valores ya numéricos no pasan por parse_maybe_float
+        tipo = type(valor)
+        if tipo is float:
+            valores[indice] = valor
+        elif tipo is int:
+            valores[indice] = float(valor) if -_INT_MAX < valor < _INT_MAX else None
+        else:
+            valores[indice] = parse_maybe_float(valor)
+        hay_campos = True
+
+    timestamp = data.get('timestamp')
+
+    # Si el payload es solo para actualizar IP de gateway
+    if timestamp is None and not (hay_campos and any(v is not None for v in valores)):
+        for k in _CLAVES_IP:
+            if data.get(k):
+                return 'gateway', str(data[k])
+
+    valores.append(data.get('nodeId') or data.get('node_id') or 'unknown')
+    valores.append(timestamp)
+    lectura = _nueva_lectura(Lectura, valores)
+    return 'dato', lectura
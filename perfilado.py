@@ -0,0 +1,390 @@
+"""
+Perfilado por petición y registro de consultas lentas de AgroLink
+Un perfil muestrea la pila del hilo que atiende la petición (o el evento de Socket.IO)
+cada PERFIL_INTERVALO_MS y cuenta las consultas SQL que hizo cada función de
+database.py: un bucle N+1 aparece como cientos de consultas de la misma función.
+
+Se activa para todo con PERFILAR=1, o para una petición con la cabecera
+X-AgroLink-Perfil desde un host de PERFIL_HOSTS:
+    X-AgroLink-Perfil: 1           guarda el perfil (cabecera X-AgroLink-Perfil-Id en la respuesta)
+    X-AgroLink-Perfil: respuesta   devuelve el informe en lugar de la respuesta
+Los perfiles guardados se leen en /api/perfiles y se escriben en PERFIL_DIRECTORIO si
+está configurado (informe .txt y pilas .folded para flamegraph.pl o speedscope).
+
+Las consultas de database.py que pasan de CONSULTA_LENTA_MS se registran en la bitácora
+y en /api/consultas-lentas junto con su plan (explicar_consulta).
+"""
+import _thread
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import request
+from sqlalchemy import event
+
+from bitacora import campos, obtener_logger
+from metricas import funcion_llamadora
+
+log = obtener_logger('perfilado')
+
+CABECERA = 'X-AgroLink-Perfil'
+CABECERA_ID = 'X-AgroLink-Perfil-Id'
+# Planes guardados por sentencia (se recalculan al llenarse)
+MAX_PLANES = 256
+# Archivos de AgroLink (para separar sus funciones de las de Flask, SQLAlchemy, etc.)
+DIRECTORIO_APP = os.path.dirname(os.path.abspath(__file__))
+
+
+def _primitivas_sistema():
+    """
+    start_new_thread, get_ident y sleep del sistema operativo
+
+    Con eventlet o gevent los módulos están parcheados y un hilo sería un greenlet que no
+    corre mientras la petición no ceda: el muestreador necesita un hilo real. En ese caso
+    las muestras son del hilo del hub, es decir, del greenlet que esté corriendo.
+    """
+    try:
+        from gevent import monkey
+        if monkey.is_module_patched('threading'):
+            return (monkey.get_original('_thread', 'start_new_thread'),
+                    monkey.get_original('_thread', 'get_ident'), monkey.get_original('time', 'sleep'))
+    except ImportError:
+        pass
+    try:
+        from eventlet import patcher
+        if patcher.is_monkey_patched('thread'):
+            hilo = patcher.original('_thread')
+            return hilo.start_new_thread, hilo.get_ident, patcher.original('time').sleep
+    except ImportError:
+        pass
+    return _thread.start_new_thread, _thread.get_ident, time.sleep
+
+
+class Muestreador:
+    """Hilo que guarda la pila de otro hilo cada `intervalo` segundos mientras corre."""
+
+    def __init__(self, intervalo=0.001):
+        self.intervalo = intervalo
+        self.pilas = {}  # tupla de (archivo, línea de la función, nombre) de raíz a hoja -> muestras
+        self.duracion = 0.0
+        self._detener = False
+        self._terminado = False
+
+    def iniciar(self):
+        iniciar_hilo, identificador, self._dormir = _primitivas_sistema()
+        self._objetivo = identificador()
+        self._inicio = time.perf_counter()
+        iniciar_hilo(self._bucle, ())
+        return self
+
+    def _bucle(self):
+        try:
+            while not self._detener:
+                marco = sys._current_frames().get(self._objetivo)
+                pila = []
+                while marco is not None:
+                    codigo = marco.f_code
+                    pila.append((codigo.co_filename, codigo.co_firstlineno, codigo.co_name))
+                    marco = marco.f_back
+                if pila:
+                    pila = tuple(reversed(pila))
+                    self.pilas[pila] = self.pilas.get(pila, 0) + 1
+                self._dormir(self.intervalo)
+        finally:
+            self._terminado = True
+
+    def detener(self):
+        """Detiene el muestreo y espera a que el hilo termine (a lo sumo un intervalo)."""
+        self.duracion = time.perf_counter() - self._inicio
+        self._detener = True
+        while not self._terminado:
+            self._dormir(self.intervalo / 4)
+        return self.pilas
+
+
+def _nombre_marco(marco):
+    archivo, linea, nombre = marco
+    return f'{os.path.basename(archivo)}:{nombre}:{linea}'
+
+
+class Perfil:
+    """Resultado de perfilar una petición o un evento: pilas muestreadas y consultas por función."""
+
+    def __init__(self, origen, pilas, duracion, intervalo, consultas):
+        self.id = uuid.uuid4().hex[:12]
+        self.origen = origen
+        self.fecha = datetime.now(timezone.utc)
+        self.pilas = pilas
+        self.duracion = duracion
+        self.intervalo = intervalo
+        self.consultas = consultas  # función de database.py -> [cantidad, segundos]
+
+    @property
+    def muestras(self):
+        return sum(self.pilas.values())
+
+    def resumen(self):
+        return {
+            'id': self.id,
+            'origen': self.origen,
+            'fecha': self.fecha.isoformat(timespec='seconds'),
+            'duracion_ms': round(self.duracion * 1000, 2),
+            'muestras': self.muestras,
+            'consultas': sum(n for n, _ in self.consultas.values()),
+            'consultas_ms': round(sum(s for _, s in self.consultas.values()) * 1000, 2)
+        }
+
+    def funciones(self):
+        """Muestras propias (la función en la cima de la pila) y totales (en cualquier nivel) por función."""
+        propias, totales = {}, {}
+        for pila, n in self.pilas.items():
+            propias[pila[-1]] = propias.get(pila[-1], 0) + n
+            for marco in set(pila):
+                totales[marco] = totales.get(marco, 0) + n
+        return propias, totales
+
+    def texto(self, limite=30):
+        """Informe legible: consultas por función y funciones con más muestras."""
+        r = self.resumen()
+        lineas = [f"{self.origen}  {r['duracion_ms']} ms, {r['muestras']} muestras cada "
+                  f"{self.intervalo * 1000:g} ms  (perfil {self.id}, {r['fecha']})", '',
+                  f"Consultas: {r['consultas']} ({r['consultas_ms']} ms)"]
+        for funcion, (n, segundos) in sorted(self.consultas.items(), key=lambda x: -x[1][1]):
+            lineas.append(f"  {n:>6}  {segundos * 1000:>9.2f} ms  {funcion}")
+        total = self.muestras or 1
+        propias, totales = self.funciones()
+        lineas += ['', 'Funciones (propio: muestras en la propia función; total: incluyendo lo que llama)',
+                   f"  {'propio':>7} {'total':>7}  función"]
+        for marco, n in sorted(propias.items(), key=lambda x: -x[1])[:limite]:
+            lineas.append(f"  {n / total:>7.1%} {totales[marco] / total:>7.1%}  {_nombre_marco(marco)}")
+        propios_app = [(m, n) for m, n in totales.items() if os.path.dirname(m[0]) == DIRECTORIO_APP]
+        if propios_app:
+            lineas += ['', 'Funciones de AgroLink por total', f"  {'total':>7}  función"]
+            for marco, n in sorted(propios_app, key=lambda x: -x[1])[:limite]:
+                lineas.append(f"  {n / total:>7.1%}  {_nombre_marco(marco)}")
+        return '\n'.join(lineas) + '\n'
+
+    def colapsado(self):
+        """Pilas en formato 'raíz;...;hoja muestras' (flamegraph.pl, speedscope)."""
+        return ''.join(f"{';'.join(_nombre_marco(m) for m in pila)} {n}\n"
+                       for pila, n in sorted(self.pilas.items(), key=lambda x: -x[1]))
+
+
+class Perfilador:
+    """
+    Perfiles por petición o evento, y registro de consultas lentas
+
+    Sin PERFILAR ni PERFIL_HOSTS ni CONSULTA_LENTA_MS no registra ningún hook.
+    """
+
+    def __init__(self, siempre=False, hosts=(), intervalo_ms=1.0, max_perfiles=50, directorio=None,
+                 lenta_ms=0, max_lentas=100):
+        """
+        Args:
+            siempre: Perfilar todas las peticiones y eventos de Socket.IO
+            hosts: Direcciones que pueden pedir un perfil con la cabecera y leer /api/perfiles
+            intervalo_ms: Milisegundos entre muestras
+            max_perfiles: Perfiles guardados en memoria (los más viejos se descartan)
+            directorio: Carpeta donde escribir cada perfil (None = solo en memoria)
+            lenta_ms: Umbral de consulta lenta (0 = no registrar)
+            max_lentas: Consultas lentas guardadas en memoria
+        """
+        self.siempre = siempre
+        self.hosts = frozenset(hosts)
+        self.intervalo = intervalo_ms / 1000.0
+        self.max_perfiles = max_perfiles
+        self.directorio = directorio
+        self.lenta = lenta_ms / 1000.0
+        self._lock = threading.Lock()
+        self._perfiles = OrderedDict()  # id -> Perfil
+        self._lentas = deque(maxlen=max_lentas)
+        self._planes = {}  # sentencia -> plan
+        self._activos = {}  # hilo (o greenlet) -> consultas del perfil en curso
+        self._intervalo_gil = None  # sys.getswitchinterval() de antes del primer perfil en curso
+
+    @property
+    def activo(self):
+        return self.siempre or bool(self.hosts)
+
+    def confiable(self, direccion):
+        """Si la dirección puede pedir perfiles y leerlos."""
+        return direccion in self.hosts
+
+    # ---- Perfiles ----
+
+    def _iniciar(self):
+        consultas = {}
+        with self._lock:
+            if not self._activos:
+                # El muestreador solo corre cuando el GIL cambia de hilo (cada 5 ms por defecto):
+                # mientras haya perfiles en curso se cambia al menos una vez por intervalo
+                self._intervalo_gil = sys.getswitchinterval()
+                sys.setswitchinterval(min(self._intervalo_gil, self.intervalo / 20))
+            self._activos[threading.get_ident()] = consultas
+        return Muestreador(self.intervalo).iniciar(), consultas
+
+    def _terminar(self, activo, origen):
+        muestreador, consultas = activo
+        pilas = muestreador.detener()
+        with self._lock:
+            self._activos.pop(threading.get_ident(), None)
+            if not self._activos and self._intervalo_gil is not None:
+                sys.setswitchinterval(self._intervalo_gil)
+                self._intervalo_gil = None
+        perfil = Perfil(origen, pilas, muestreador.duracion, self.intervalo, consultas)
+        with self._lock:
+            self._perfiles[perfil.id] = perfil
+            while len(self._perfiles) > self.max_perfiles:
+                self._perfiles.popitem(last=False)
+        if self.directorio:
+            self._escribir(perfil)
+        return perfil
+
+    def _escribir(self, perfil):
+        base = os.path.join(self.directorio, f"{perfil.fecha.strftime('%Y%m%dT%H%M%S')}-{perfil.id}")
+        try:
+            os.makedirs(self.directorio, exist_ok=True)
+            with open(base + '.txt', 'w', encoding='utf-8') as f:
+                f.write(perfil.texto())
+            with open(base + '.folded', 'w', encoding='utf-8') as f:
+                f.write(perfil.colapsado())
+        except OSError as e:
+            log.warning('No se pudo escribir el perfil %s: %s', perfil.id, e)
+
+    def perfiles(self):
+        """Resumen de los perfiles guardados, del más nuevo al más viejo."""
+        with self._lock:
+            return [p.resumen() for p in reversed(self._perfiles.values())]
+
+    def perfil(self, id_perfil):
+        with self._lock:
+            return self._perfiles.get(id_perfil)
+
+    def instrumentar_app(self, app):
+        """Perfila las peticiones con PERFILAR o con la cabecera desde un host de confianza."""
+        if not self.activo:
+            return
+
+        @app.before_request
+        def _iniciar_perfil():
+            modo = request.headers.get(CABECERA)
+            if self.siempre or (modo and self.confiable(request.remote_addr)):
+                request.environ['agrolink.perfil'] = (self._iniciar(), modo)
+
+        @app.after_request
+        def _terminar_perfil(respuesta):
+            en_curso = request.environ.pop('agrolink.perfil', None)
+            if en_curso is None:
+                return respuesta
+            activo, modo = en_curso
+            perfil = self._terminar(activo, f'{request.method} {request.full_path.rstrip("?")}')
+            if modo == 'respuesta':
+                informe = app.response_class(perfil.texto(), mimetype='text/plain')
+                informe.headers['X-AgroLink-Estado-Original'] = str(respuesta.status_code)
+                respuesta = informe
+            respuesta.headers[CABECERA_ID] = perfil.id
+            return respuesta
+
+        @app.teardown_request
+        def _cerrar_perfil(error):
+            # Excepción sin manejar: after_request no corrió, pero el perfil sirve igual
+            en_curso = request.environ.pop('agrolink.perfil', None)
+            if en_curso is not None:
+                self._terminar(en_curso[0], f'{request.method} {request.full_path.rstrip("?")} (error)')
+
+    def evento(self, nombre):
+        """Decorador de manejadores de Socket.IO: los perfila con PERFILAR (no hay cabeceras por evento)."""
+        def decorador(manejador):
+            if not self.siempre:
+                return manejador
+
+            @wraps(manejador)
+            def envoltura(*args):
+                activo = self._iniciar()
+                try:
+                    return manejador(*args)
+                finally:
+                    self._terminar(activo, f'socketio {nombre}')
+            return envoltura
+        return decorador
+
+    # ---- Consultas ----
+
+    def instrumentar_bd(self, motor, modulo, explicar):
+        """
+        Cuenta las consultas de cada perfil en curso y registra las lentas de `modulo`
+
+        Args:
+            motor: Engine de SQLAlchemy
+            modulo: Módulo cuyas funciones se registran (database)
+            explicar: Función (sql, parametros) -> lista con el plan (database.explicar_consulta)
+        """
+        if not (self.activo or self.lenta):
+            return
+        globales = vars(modulo)
+
+        @event.listens_for(motor, 'before_cursor_execute')
+        def _antes_consulta(conexion, cursor, sentencia, parametros, contexto, varias):
+            if contexto is not None:
+                contexto._inicio_perfil = time.perf_counter()
+
+        @event.listens_for(motor, 'after_cursor_execute')
+        def _despues_consulta(conexion, cursor, sentencia, parametros, contexto, varias):
+            inicio = getattr(contexto, '_inicio_perfil', None)
+            if inicio is None:
+                return
+            duracion = time.perf_counter() - inicio
+            consultas = self._activos.get(threading.get_ident())
+            lenta = self.lenta and duracion >= self.lenta
+            if consultas is None and not lenta:
+                return
+            funcion = funcion_llamadora(globales)
+            if consultas is not None:
+                total = consultas.setdefault(funcion or 'otro', [0, 0.0])
+                total[0] += 1
+                total[1] += duracion
+            if lenta and funcion is not None:
+                # El plan sale de la misma conexión DBAPI, sin pasar por los eventos de SQLAlchemy
+                self._registrar_lenta(funcion, duracion, sentencia, parametros, varias,
+                                      lambda sql, p: explicar(sql, p, conexion=conexion.connection.dbapi_connection))
+
+    def _plan(self, sentencia, parametros, varias, explicar):
+        plan = self._planes.get(sentencia)
+        if plan is not None:
+            return plan
+        if varias:
+            parametros = parametros[0] if parametros else ()
+        try:
+            plan = explicar(sentencia, parametros)
+        except Exception as e:
+            plan = [f'sin plan: {e}']
+        if len(self._planes) >= MAX_PLANES:
+            self._planes.clear()
+        self._planes[sentencia] = plan
+        return plan
+
+    def _registrar_lenta(self, funcion, duracion, sentencia, parametros, varias, explicar):
+        plan = self._plan(sentencia, parametros, varias, explicar)
+        registro = {
+            'fecha': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'funcion': funcion,
+            'duracion_ms': round(duracion * 1000, 2),
+            'sql': sentencia,
+            'parametros': repr(parametros)[:500],
+            'plan': plan
+        }
+        with self._lock:
+            self._lentas.append(registro)
+        log.warning('Consulta lenta en %s', funcion,
+                    extra=campos(ms=registro['duracion_ms'], sql=' '.join(sentencia.split())[:300],
+                                 plan=' | '.join(plan)))
+
+    def consultas_lentas(self):
+        """Consultas lentas registradas, de la más nueva a la más vieja."""
+        with self._lock:
+            return list(reversed(self._lentas))
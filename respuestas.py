@@ -0,0 +1,142 @@
+"""
+Respuestas HTTP condicionales y comprimidas de AgroLink
+Las rutas de lectura marcadas con condicional() llevan ETag (y Last-Modified, una vez
+cerrado el segundo de la versión) según la versión de los datos y responden 304 sin
+ejecutar la vista (ni consultar la base de datos) mientras no haya escrituras.
+Las respuestas JSON y HTML se comprimen con brotli, si está instalado, o gzip; los
+estáticos se sirven con caché larga y la URL cambia con el archivo.
+"""
+import gzip
+import os
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+
+from flask import current_app, make_response, request
+from werkzeug.http import is_resource_modified
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional: sin él se comprime solo con gzip
+    brotli = None
+
+TIPOS_COMPRIMIBLES = frozenset({'application/json', 'text/html'})
+NIVEL_GZIP = 6
+CALIDAD_BROTLI = 5
+
+
+def condicional(version, variante=None):
+    """
+    Decorador de vistas GET cuyo contenido solo depende de los datos guardados
+
+    Args:
+        version: función sin argumentos que devuelve (etag, fecha de última modificación)
+        variante: función opcional (dentro de la petición) que devuelve lo que, además de
+            los datos, cambia la respuesta (p. ej. el final de una ventana que termina
+            "ahora"), o None si nada; se agrega al ETag y entonces no se usa Last-Modified
+
+    La versión se lee antes de ejecutar la vista: si una escritura se cruza con ella, la
+    respuesta queda marcada con la versión anterior y la siguiente petición la regenera.
+    Una vista puede devolver una respuesta con Cache-Control: no-store para que no se marque.
+
+    Last-Modified tiene resolución de un segundo y el ETag cambia con cada escritura: otra
+    escritura en el mismo segundo tendría la misma fecha, así que mientras ese segundo no
+    termina no se envía Last-Modified ni se evalúa If-Modified-Since (solo el ETag).
+    """
+    def decorador(vista):
+        @wraps(vista)
+        def envoltura(*args, **kwargs):
+            etag, modificado = version()
+            extra = variante() if variante else None
+            if extra is not None:
+                # La fecha de los datos no refleja que la ventana avanzó
+                etag, modificado = f'{etag}-{extra}', None
+            if modificado is not None and datetime.now(timezone.utc) < modificado + timedelta(seconds=1):
+                modificado = None
+            if not is_resource_modified(request.environ, etag=etag, last_modified=modificado):
+                respuesta = current_app.response_class(status=304)
+            else:
+                respuesta = make_response(vista(*args, **kwargs))
+                # Los errores no se marcan: se regeneran siempre; tampoco lo que la vista
+                # marcó no-store (p. ej. un esqueleto que todavía no refleja la versión)
+                if respuesta.status_code != 200 or respuesta.cache_control.no_store:
+                    return respuesta
+            # Débil: la misma versión vale comprimida o sin comprimir
+            respuesta.set_etag(etag, weak=True)
+            if modificado is not None:
+                respuesta.last_modified = modificado
+            max_age = current_app.config.get('HTTP_MAX_AGE', 0)
+            if max_age:
+                respuesta.cache_control.public = True
+                respuesta.cache_control.max_age = max_age
+            else:
+                # Los navegadores y proxies pueden guardarla pero revalidan cada vez (304 si no cambió)
+                respuesta.cache_control.no_cache = True
+            respuesta.vary.add('Accept-Encoding')
+            return respuesta
+        return envoltura
+    return decorador
+
+
+def _codificacion_aceptada():
+    """'br', 'gzip' o None según Accept-Encoding."""
+    aceptadas = request.accept_encodings
+    if brotli is not None and aceptadas['br']:
+        return 'br'
+    if aceptadas['gzip']:
+        return 'gzip'
+    return None
+
+
+def comprimir(respuesta):
+    """
+    after_request: comprime respuestas JSON y HTML desde COMPRESION_MINIMO bytes
+
+    No toca las respuestas en streaming (exportaciones), los archivos (estáticos) ni las
+    que ya traen Content-Encoding.
+    """
+    minimo = current_app.config.get('COMPRESION_MINIMO', 1024)
+    if (not minimo or respuesta.status_code != 200 or respuesta.mimetype not in TIPOS_COMPRIMIBLES
+            or respuesta.direct_passthrough or respuesta.is_streamed or 'Content-Encoding' in respuesta.headers):
+        return respuesta
+    respuesta.vary.add('Accept-Encoding')
+    cuerpo = respuesta.get_data()
+    if len(cuerpo) < minimo:
+        return respuesta
+    codificacion = _codificacion_aceptada()
+    if codificacion == 'br':
+        respuesta.set_data(brotli.compress(cuerpo, quality=CALIDAD_BROTLI))
+    elif codificacion == 'gzip':
+        respuesta.set_data(gzip.compress(cuerpo, compresslevel=NIVEL_GZIP, mtime=0))
+    else:
+        return respuesta
+    respuesta.headers['Content-Encoding'] = codificacion
+    return respuesta
+
+
+def versionar_estaticos(app):
+    """
+    Agrega ?v=<fecha de modificación> a url_for('static', ...)
+
+    Con eso los estáticos pueden cachearse por mucho tiempo (SEND_FILE_MAX_AGE_DEFAULT):
+    al cambiar un archivo cambia su URL. La fecha se lee una vez por archivo y proceso.
+    """
+    versiones = {}
+
+    @app.url_defaults
+    def agregar_version(endpoint, valores):
+        if endpoint != 'static' or 'v' in valores or 'filename' not in valores:
+            return
+        nombre = valores['filename']
+        if nombre not in versiones:
+            try:
+                versiones[nombre] = int(os.path.getmtime(os.path.join(app.static_folder, nombre)))
+            except OSError:
+                versiones[nombre] = None
+        if versiones[nombre] is not None:
+            valores['v'] = versiones[nombre]
+
+
+def configurar_respuestas(app):
+    """Registra la compresión y el versionado de estáticos en la app."""
+    app.after_request(comprimir)
+    versionar_estaticos(app)
@@ -0,0 +1,87 @@
+"""
+Tarea periódica de retención para AgroLink
+Un hilo en segundo plano aplica la política de retención (archivar lecturas
+antiguas, borrar archivos vencidos, podar resúmenes, vacuum incremental)
+cada cierto intervalo, fuera del camino de las peticiones.
+"""
+import threading
+import time
+
+from bitacora import obtener_logger
+
+log = obtener_logger('retencion')
+
+
+class TareaRetencion:
+    """Hilo que llama a aplicar() cada intervalo segundos dentro del app_context."""
+
+    def __init__(self, app, aplicar, intervalo=3600):
+        """
+        Args:
+            app: Aplicación Flask (la tarea trabaja dentro de su app_context)
+            aplicar: Función sin argumentos que aplica la retención y devuelve un dict con el resultado
+            intervalo: Segundos entre pasadas (la primera se hace al arrancar)
+        """
+        self.app = app
+        self.aplicar = aplicar
+        self.intervalo = intervalo
+        self._detener = threading.Event()
+        self._hilo = None
+        self._lock = threading.Lock()
+        # Contadores
+        self.pasadas = 0
+        self.fallidas = 0
+        self.ultima_duracion = 0
+        self.ultimo_resultado = None
+        self.ultimo_error = None
+
+    def iniciar(self):
+        """Arranca el hilo (idempotente)."""
+        if self._hilo and self._hilo.is_alive():
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._bucle, name='agrolink-retencion', daemon=True)
+        self._hilo.start()
+
+    def detener(self, timeout=10):
+        """Pide al hilo que termine y espera a que acabe la pasada en curso."""
+        self._detener.set()
+        if self._hilo and self._hilo.is_alive():
+            self._hilo.join(timeout)
+
+    def ejecutar(self):
+        """Hace una pasada ahora y registra su resultado."""
+        inicio = time.perf_counter()
+        try:
+            with self.app.app_context():
+                resultado = self.aplicar()
+            with self._lock:
+                self.pasadas += 1
+                self.ultimo_resultado = resultado
+                self.ultimo_error = None
+            return resultado
+        except Exception as e:
+            with self._lock:
+                self.fallidas += 1
+                self.ultimo_error = str(e)
+            log.warning('No se pudo aplicar la retención: %s', e)
+            return None
+        finally:
+            self.ultima_duracion = time.perf_counter() - inicio
+
+    def metricas(self):
+        """Devuelve los contadores y el resultado de la última pasada."""
+        with self._lock:
+            return {
+                'intervalo': self.intervalo,
+                'pasadas': self.pasadas,
+                'fallidas': self.fallidas,
+                'ultima_duracion': self.ultima_duracion,
+                'ultimo_resultado': self.ultimo_resultado,
+                'ultimo_error': self.ultimo_error
+            }
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            self.ejecutar()
+            self._detener.wait(self.intervalo)
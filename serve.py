@@ -0,0 +1,119 @@
+"""
+Punto de entrada de producción de AgroLink
+Ejecuta la app bajo eventlet o gevent (WebSocket real, un greenlet por conexión)
+en lugar del servidor de desarrollo de Werkzeug.
+
+    python serve.py                                   # un proceso eventlet en :5000
+    python serve.py --procesos 4 --cola redis://redis:6379/0
+
+Con varios procesos todos escuchan en el mismo puerto (SO_REUSEPORT) y las
+emisiones de Socket.IO se reparten por la cola de mensajes; los navegadores
+usan solo el transporte websocket para no necesitar afinidad de sesión.
+"""
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import click
+
+MODOS = ('eventlet', 'gevent')
+
+
+def _parchear(modo):
+    """Monkey patching del modo asíncrono; debe hacerse antes de importar la app."""
+    if modo == 'eventlet':
+        import eventlet
+        eventlet.monkey_patch()
+    else:
+        from gevent import monkey
+        monkey.patch_all()
+
+
+def _servir(modo, host, port, conexiones, cola):
+    os.environ['AGROLINK_ASYNC_MODE'] = modo
+    if cola:
+        os.environ['AGROLINK_MESSAGE_QUEUE'] = cola
+    _parchear(modo)
+
+    from app import app, socketio
+    from bitacora import obtener_logger
+    log = obtener_logger('serve')
+
+    # SIGTERM (docker stop) debe pasar por atexit para vaciar la cola de ingesta
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    log.info('AgroLink sirviendo en %s:%s (%s, pid %d, hasta %d conexiones)', host, port, modo, os.getpid(), conexiones)
+    opciones = {'max_size': conexiones} if modo == 'eventlet' else {'spawn': conexiones}
+    socketio.run(app, host=host, port=port, debug=False, log_output=False, use_reloader=False, **opciones)
+
+
+def _esperar_puerto(host, port, timeout):
+    """Espera a que el primer proceso escuche (y haya inicializado la base de datos)."""
+    destino = '127.0.0.1' if host in ('0.0.0.0', '') else host
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        try:
+            with socket.create_connection((destino, port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def _lanzar_procesos(procesos, modo, host, port, conexiones, cola):
+    entorno = dict(os.environ)
+    # Sin afinidad de sesión el polling de un cliente podría caer en otro proceso
+    entorno.setdefault('AGROLINK_SOCKETIO_TRANSPORTES', 'websocket')
+    # Cada proceso cachea solo sus escrituras: recargar de la BD cada pocos segundos
+    entorno.setdefault('AGROLINK_CACHE_TTL', '2')
+    comando = [sys.executable, os.path.abspath(__file__), '--modo', modo, '--host', host, '--port', str(port),
+               '--conexiones', str(conexiones), '--cola', cola, '--procesos', '1']
+    hijos = [subprocess.Popen(comando, env=entorno)]
+    if not _esperar_puerto(host, port, timeout=60):
+        hijos[0].terminate()
+        raise click.ClickException('El primer proceso no llegó a escuchar en el puerto')
+    # Solo el primer proceso ejecuta la tarea de retención
+    entorno['AGROLINK_RETENCION_INTERVALO'] = '0'
+    hijos += [subprocess.Popen(comando, env=entorno) for _ in range(procesos - 1)]
+
+    def terminar(*_):
+        for hijo in hijos:
+            if hijo.poll() is None:
+                hijo.terminate()
+
+    signal.signal(signal.SIGTERM, terminar)
+    signal.signal(signal.SIGINT, terminar)
+    codigo = 0
+    for hijo in hijos:
+        codigo = hijo.wait() or codigo
+    sys.exit(codigo)
+
+
+@click.command()
+@click.option('--modo', type=click.Choice(MODOS), default=lambda: os.environ.get('AGROLINK_ASYNC_MODE', 'eventlet'),
+              help='Servidor asíncrono (AGROLINK_ASYNC_MODE)')
+@click.option('--host', default=lambda: os.environ.get('AGROLINK_HOST', '0.0.0.0'))
+@click.option('--port', type=int, default=lambda: int(os.environ.get('AGROLINK_PORT', 5000)))
+@click.option('--procesos', type=click.IntRange(min=1), default=lambda: int(os.environ.get('AGROLINK_PROCESOS', 1)),
+              help='Procesos que comparten el puerto (AGROLINK_PROCESOS)')
+@click.option('--conexiones', type=click.IntRange(min=1),
+              default=lambda: int(os.environ.get('AGROLINK_CONEXIONES', 10000)),
+              help='Greenlets (conexiones simultáneas) por proceso (AGROLINK_CONEXIONES)')
+@click.option('--cola', default=lambda: os.environ.get('AGROLINK_MESSAGE_QUEUE', ''),
+              help='Cola de mensajes de Socket.IO: redis://, amqp://... (AGROLINK_MESSAGE_QUEUE)')
+def main(modo, host, port, procesos, conexiones, cola):
+    """Sirve AgroLink con eventlet/gevent."""
+    if procesos > 1:
+        if not cola or cola.startswith('memoria://'):
+            raise click.UsageError('Con varios procesos hace falta una cola de mensajes compartida (--cola redis://...)')
+        if modo != 'eventlet':
+            raise click.UsageError('Varios procesos en el mismo puerto solo están soportados con eventlet')
+        _lanzar_procesos(procesos, modo, host, port, conexiones, cola)
+    else:
+        _servir(modo, host, port, conexiones, cola)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,12 @@
 // Lógica de la página principal (gateway IP + mapa de nodos + promedios acumulados)
 (function(){
   const ipEl = document.getElementById('gatewayIP');
-  const socket = io(window.location.origin, { transports: ['polling'] });
+  const socket = io(window.location.origin, { transports: window.SOCKETIO_TRANSPORTES || ['polling', 'websocket'] });
   const pageData = window.PAGE_DATA || {};
-  const ubicacionesTodos = pageData.ubicacionesTodos || {};
+  let ubicacionesTodos = pageData.ubicacionesTodos || {};
   let centroLat = pageData.centroLat || 0;
   let centroLon = pageData.centroLon || 0;
-  const nodos = pageData.nodos || [];
+  let nodos = pageData.nodos || [];
 
   // Si centroLat/Lon son 0 y hay ubicaciones, tomar la primera
   if((!centroLat && !centroLon) && ubicacionesTodos && Object.keys(ubicacionesTodos).length){
@@ -54,7 +54,8 @@
   const markers = {}; // nodeId -> marker
   const colorCycle = ['red','blue','green','orange','violet','grey','black','gold'];
   const colorsByNode = {};
-  (Array.isArray(nodos)?nodos:[]).forEach((nid,idx)=>{ colorsByNode[nid] = colorCycle[idx % colorCycle.length]; });
+  function asignarColores(lista){ (Array.isArray(lista)?lista:[]).forEach((nid,idx)=>{ colorsByNode[nid] = colorCycle[idx % colorCycle.length]; }); }
+  asignarColores(nodos);
   function coloredIcon(color){
     const base='https://raw.githubusercontent.com/pointhi/leaflet-color-markers/master/img/';
     return L.icon({
@@ -68,15 +69,31 @@
     if(!mapDiv || !window.L) return;
     map = L.map(mapDiv).setView([centroLat, centroLon], 17);
     L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png',{ maxZoom:19, attribution:'&copy; OpenStreetMap' }).addTo(map);
+    pintarUbicaciones(ubicacionesTodos);
+    map.on('moveend', programarVisibles);
+  }
+  // Al mover el mapa: pedir solo los nodos dentro de la vista y quitar los que salieron
+  let temporizadorVisibles = null, pedidoVisibles = 0;
+  function programarVisibles(){ clearTimeout(temporizadorVisibles); temporizadorVisibles = setTimeout(cargarVisibles, 250); }
+  function cargarVisibles(){
+    if(!map) return;
+    const pedido = ++pedidoVisibles;
+    fetch((pageData.urlUbicaciones || '/api/ubicaciones') + '?bbox=' + map.getBounds().toBBoxString())
+      .then(r => { if(!r.ok) throw new Error('HTTP '+r.status); return r.json(); })
+      .then(visibles => {
+        if(pedido !== pedidoVisibles) return; // llegó tarde: ya hay un pedido más nuevo
+        Object.keys(markers).forEach(nid => { if(!(nid in visibles)){ map.removeLayer(markers[nid]); delete markers[nid]; } });
+        Object.keys(visibles).forEach(nid => updateMarker(nid, Number(visibles[nid].lat), Number(visibles[nid].lon)));
+      })
+      .catch(err => console.warn('No se pudieron cargar las ubicaciones visibles', err));
+  }
+  function pintarUbicaciones(ubicaciones){
+    if(!map) return;
     // Crear marcadores iniciales
-    Object.keys(ubicacionesTodos).forEach(nid => {
-      const loc = ubicacionesTodos[nid];
+    Object.keys(ubicaciones).forEach(nid => {
+      const loc = ubicaciones[nid];
       if(!loc || loc.lat==null || loc.lon==null) return;
-      const icon = coloredIcon(colorsByNode[nid] || 'red');
-      const m = L.marker([loc.lat, loc.lon], { icon })
-        .bindPopup('Nodo '+nid+'<br>lat: '+Number(loc.lat).toFixed(6)+'<br>lon: '+Number(loc.lon).toFixed(6));
-      m.addTo(map);
-      markers[nid] = m;
+      updateMarker(nid, Number(loc.lat), Number(loc.lon));
     });
     // Ajustar vista si hay varios nodos
     const ids = Object.keys(markers);
@@ -130,10 +147,27 @@
   socket.on('ubicacion_nodo', data => {
     if(!data || !data.nodeId) return;
     const lat = Number(data.lat), lon = Number(data.lon);
-    if(!Number.isNaN(lat) && !Number.isNaN(lon)) updateMarker(String(data.nodeId), lat, lon);
+    if(Number.isNaN(lat) || Number.isNaN(lon)) return;
+    const nid = String(data.nodeId);
+    // Nodos fuera de la vista no se dibujan hasta que el mapa llegue a ellos
+    if(map && !markers[nid] && !map.getBounds().contains([lat, lon])) return;
+    updateMarker(nid, lat, lon);
   });
   socket.on('nuevo_dato', dato => {
     if(!dato) return;
+    acumularDato(dato);
+    mostrarUltimo(dato);
+    recalcAverages(); updateSparklines();
+  });
+  // Lote agrupado por el servidor: acumular todo y refrescar la vista una sola vez
+  socket.on('nuevos_datos', lote => {
+    if(!lote || !Array.isArray(lote.datos) || !lote.datos.length) return;
+    lote.datos.forEach(acumularDato);
+    mostrarUltimo(lote.datos[lote.datos.length-1]);
+    recalcAverages(); updateSparklines();
+  });
+
+  function mostrarUltimo(dato){
     // Actualizar hora último dato
     if(ultimoDatoHoraEl && dato.fecha_creacion){ ultimoDatoHoraEl.setAttribute('data-ts', dato.fecha_creacion); ultimoDatoHoraEl.textContent = toLocalTime(dato.fecha_creacion); }
     // Actualizar fila de tabla (reemplazar única fila)
@@ -149,6 +183,10 @@
         `<td class="time-local" data-ts="${dato.fecha_creacion??''}">${dato.fecha_creacion?toLocalTime(dato.fecha_creacion):'-'}</td>`;
       ultimosTbody.appendChild(tr);
     }
+  }
+
+  function acumularDato(dato){
+    if(!dato) return;
     // Acumular para promedios globales (toma todos los datos de todos los nodos)
     safePush(seriesTemp, dato.temperatura); clamp(seriesTemp);
     safePush(seriesHum, dato.humedad); clamp(seriesHum);
@@ -160,12 +198,56 @@
     labelsHum.push(lbl); clamp(labelsHum);
     labelsLight.push(lbl); clamp(labelsLight);
     labelsSoil.push(lbl); clamp(labelsSoil);
-    // Recalcular y refrescar sparklines
-    recalcAverages(); updateSparklines();
-  });
+  }
+
+  // ================= Hidratación (esqueleto + /api/dashboard) =================
+  function esc(v){ return String(v).replace(/[&<>"']/g, c => ({'&':'&amp;','<':'&lt;','>':'&gt;','"':'&quot;',"'":'&#39;'}[c])); }
+  function urlNodo(nid){ return (pageData.urlNodo || '/nodo/__nodo__').replace('__nodo__', encodeURIComponent(nid)); }
+  function hidratar(t){
+    nodos = t.nodos || [];
+    ubicacionesTodos = t.ubicaciones_todos || {};
+    asignarColores(nodos);
+    const submenu = document.getElementById('submenuNodos');
+    if(submenu){
+      submenu.innerHTML = nodos.length
+        ? nodos.map(nid => `<li><a href="${esc(urlNodo(nid))}">${esc(nid)}</a></li>`).join('')
+        : '<li><span>Sin nodos</span></li>';
+    }
+    const nodosTbody = document.getElementById('nodosTbody');
+    if(nodosTbody){
+      const sensores = t.nodos_sensores || {};
+      nodosTbody.innerHTML = nodos.length
+        ? nodos.map((nid, i) => {
+            const lista = sensores[nid] || [];
+            const badges = lista.length
+              ? lista.map(s => `<span class="sensor-badge">${esc(s)}</span>`).join('')
+              : '<span class="sensor-badge sensor-empty">Sin datos</span>';
+            return `<tr><td>${i+1}</td><td><a href="${esc(urlNodo(nid))}" class="link-nodo">${esc(nid)}</a></td><td>${badges}</td></tr>`;
+          }).join('')
+        : '<tr><td colspan="3" style="text-align:center">Sin nodos registrados</td></tr>';
+    }
+    const registrosEl = document.querySelector('#metricRegistros .value');
+    if(registrosEl) registrosEl.textContent = t.total_registros || 0;
+    const nodosEl = document.querySelector('#metricNodos .value');
+    if(nodosEl) nodosEl.textContent = nodos.length;
+    if(ipEl) ipEl.textContent = t.gateway_ip || '—';
+    if(t.ultimo_dato){ mostrarUltimo(t.ultimo_dato); }
+    else if(ultimosTbody){ ultimosTbody.innerHTML = '<tr><td colspan="7">No hay datos aún</td></tr>'; }
+    if(map && t.centro_lat!=null && t.centro_lon!=null){ map.setView([t.centro_lat, t.centro_lon]); }
+    pintarUbicaciones(ubicacionesTodos);
+  }
+  function cargarTablero(){
+    fetch(pageData.urlDashboard || '/api/dashboard')
+      .then(r => { if(!r.ok) throw new Error('HTTP '+r.status); return r.json(); })
+      .then(hidratar)
+      .catch(err => {
+        console.error('No se pudo cargar el tablero', err);
+        if(ultimosTbody) ultimosTbody.innerHTML = '<tr><td colspan="7">No se pudo cargar el tablero</td></tr>';
+      });
+  }
 
   // ================= Init =================
-  function init(){ refreshLocalTimes(); initMap(); initSparklines(); recalcAverages(); }
+  function init(){ refreshLocalTimes(); initMap(); initSparklines(); recalcAverages(); if(pageData.cargando) cargarTablero(); }
   if(document.readyState==='loading'){ document.addEventListener('DOMContentLoaded', init); } else { init(); }
   setInterval(refreshLocalTimes, 60000);
 })();
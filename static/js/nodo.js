@@ -43,6 +43,44 @@
     if(ubicacionInicial && ubicacionInicial.lat && ubicacionInicial.lon){
       actualizarUbicacionNodoGeneric(thisNodeId, ubicacionInicial.lat, ubicacionInicial.lon, true);
     }
+    map.on('moveend', programarVisibles);
+    map.on('zoomend', cargarTrayecto);
+    cargarTrayecto();
+  }
+
+  // Trayecto de este nodo (últimas 24 h), simplificado por el servidor a un pixel del zoom actual
+  let trayectoLinea=null, pedidoTrayecto=0;
+  function cargarTrayecto(){
+    if(!map || !window.PAGE_DATA.urlTrayecto) return;
+    const pedido=++pedidoTrayecto;
+    fetch(window.PAGE_DATA.urlTrayecto+'?zoom='+map.getZoom())
+      .then(r=>{ if(!r.ok) throw new Error('HTTP '+r.status); return r.json(); })
+      .then(t=>{
+        if(pedido!==pedidoTrayecto) return;
+        const latlngs=(t.puntos||[]).map(p=>[p.lat,p.lon]);
+        if(trayectoLinea){ trayectoLinea.setLatLngs(latlngs); return; }
+        const g=ensureGrupo(thisNodeId); g.addTo(map);
+        trayectoLinea=L.polyline(latlngs,{color:getColor(thisNodeId),weight:3,opacity:0.7}).addTo(g);
+      })
+      .catch(err=>console.warn('No se pudo cargar el trayecto',err));
+  }
+
+  // Al mover el mapa: pedir solo los nodos dentro de la vista (este nodo siempre queda)
+  let temporizadorVisibles=null, pedidoVisibles=0;
+  function programarVisibles(){ clearTimeout(temporizadorVisibles); temporizadorVisibles=setTimeout(cargarVisibles,250); }
+  function cargarVisibles(){
+    if(!map) return;
+    const pedido=++pedidoVisibles;
+    fetch((window.PAGE_DATA.urlUbicaciones||'/api/ubicaciones')+'?bbox='+map.getBounds().toBBoxString())
+      .then(r=>{ if(!r.ok) throw new Error('HTTP '+r.status); return r.json(); })
+      .then(visibles=>{
+        if(pedido!==pedidoVisibles) return;
+        Object.keys(markersByNode).forEach(nid=>{
+          if(nid!==thisNodeId && !(nid in visibles)){ grupos[nid].removeLayer(markersByNode[nid]); delete markersByNode[nid]; }
+        });
+        Object.keys(visibles).forEach(nid=>{ if(nid!==thisNodeId) actualizarUbicacionNodoGeneric(nid, Number(visibles[nid].lat), Number(visibles[nid].lon), false); });
+      })
+      .catch(err=>console.warn('No se pudieron cargar las ubicaciones visibles',err));
   }
 
   function actualizarUbicacionNodoGeneric(nid, lat, lon, pan){
@@ -58,15 +96,21 @@
   }
 
   // ========== SOCKET + TABLA + GRÁFICAS ==========
-  const socket=io(window.location.origin,{transports:['polling']});
+  const socket=io(window.location.origin,{transports:window.SOCKETIO_TRANSPORTES||['polling','websocket']});
   const ubicacionEl=document.getElementById('ubicacionNodo');
   const statusDiv=document.getElementById('status');
+  // Solo recibir lecturas de este nodo (y las ubicaciones de todos para el mapa)
+  socket.on('connect',()=>{ socket.emit('suscribir',{nodeId:thisNodeId}); });
   socket.on('connect',()=>{ if(statusDiv){ statusDiv.textContent='Conectado al servidor WebSocket'; statusDiv.style.background='#d1e7dd'; statusDiv.style.color='#0f5132'; } });
   socket.on('ubicacion_nodo', data=>{
     if(!data || !data.nodeId) return;
     const nid=String(data.nodeId); const lat=Number(data.lat); const lon=Number(data.lon);
     const isCurrent=nid===thisNodeId;
+    // Otros nodos fuera de la vista no se dibujan hasta que el mapa llegue a ellos
+    if(!isCurrent && map && !markersByNode[nid] && !map.getBounds().contains([lat,lon])) return;
     actualizarUbicacionNodoGeneric(nid, lat, lon, isCurrent);
+    // El servidor solo emite cuando el nodo se movió: cada ubicación es un punto nuevo del trayecto
+    if(isCurrent && trayectoLinea && !Number.isNaN(lat) && !Number.isNaN(lon)) trayectoLinea.addLatLng([lat,lon]);
     if(isCurrent && ubicacionEl && !Number.isNaN(lat) && !Number.isNaN(lon)){
       ubicacionEl.textContent=`lat: ${lat.toFixed(6)}, lon: ${lon.toFixed(6)}`;
     }
@@ -76,12 +120,9 @@
   function pushIfDefined(arr,v){ arr.push((v==null)?null:Number(v)); }
 
   // Preparar datos para gráficas
-  const sorted = Array.isArray(initialData) ? [...initialData].sort((a,b)=>{
-    const ta=a.timestamp || (a.fecha_creacion? Date.parse(a.fecha_creacion)/1000:0);
-    const tb=b.timestamp || (b.fecha_creacion? Date.parse(b.fecha_creacion)/1000:0);
-    return ta-tb;
-  }) : [];
-  const labels = sorted.map(d=> d.fecha_creacion || (d.timestamp? new Date(d.timestamp*1000).toISOString():'') );
+  function marcaTiempo(d){ return d.timestamp || (d.fecha_creacion? Date.parse(d.fecha_creacion)/1000:0); }
+  const sorted = Array.isArray(initialData) ? [...initialData].sort((a,b)=>marcaTiempo(a)-marcaTiempo(b)) : [];
+  const labels = sorted.map(etiquetaGrafica);
 
   let chartTemperatura, chartHumedad, chartSoil, chartLight;
   try{
@@ -104,17 +145,71 @@
     }
   }catch(e){ console.error('Error creando gráficas:',e); }
 
+  function etiquetaGrafica(d){ return d.fecha_creacion || (d.timestamp? new Date(d.timestamp*1000).toISOString(): ''); }
+  function agregarAGraficas(dato){
+    const label = etiquetaGrafica(dato);
+    if(chartTemperatura){ chartTemperatura.data.labels.push(label); clampLen(chartTemperatura.data.labels); pushIfDefined(chartTemperatura.data.datasets[0].data,dato.temperatura); clampLen(chartTemperatura.data.datasets[0].data); }
+    if(chartHumedad){ chartHumedad.data.labels.push(label); clampLen(chartHumedad.data.labels); pushIfDefined(chartHumedad.data.datasets[0].data,dato.humedad); clampLen(chartHumedad.data.datasets[0].data); }
+    if(chartSoil){ chartSoil.data.labels.push(label); clampLen(chartSoil.data.labels); pushIfDefined(chartSoil.data.datasets[0].data,dato.soil_moisture); clampLen(chartSoil.data.datasets[0].data); }
+    if(chartLight){ chartLight.data.labels.push(label); clampLen(chartLight.data.labels); pushIfDefined(chartLight.data.datasets[0].data,dato.light); pushIfDefined(chartLight.data.datasets[1].data,dato.percentage); clampLen(chartLight.data.datasets[0].data); clampLen(chartLight.data.datasets[1].data); }
+  }
+  function redibujarGraficas(){
+    [chartTemperatura, chartHumedad, chartSoil, chartLight].forEach(c=>{ if(c) c.update('none'); });
+  }
+  // Reemplaza en las gráficas el tramo que cubre una página de datos (p. ej. tras un lote recortado)
+  function fusionarEnGraficas(datos){
+    const orden=datos.filter(Boolean).sort((a,b)=>marcaTiempo(a)-marcaTiempo(b));
+    if(!orden.length) return;
+    const fechas=orden.map(d=>Date.parse(etiquetaGrafica(d))).filter(f=>!Number.isNaN(f));
+    const desde=fechas.length? Math.min(...fechas): -Infinity;
+    [chartTemperatura, chartHumedad, chartSoil, chartLight].forEach(c=>{
+      if(!c) return;
+      // Conservar solo los puntos anteriores a la página; el resto se reemplaza por ella
+      let k=c.data.labels.findIndex(l=>Date.parse(l)>=desde);
+      if(k<0) k=c.data.labels.length;
+      c.data.labels.length=k;
+      c.data.datasets.forEach(ds=>{ ds.data.length=Math.min(ds.data.length,k); });
+    });
+    orden.forEach(agregarAGraficas);
+    redibujarGraficas();
+  }
+
   socket.on('nuevo_dato', dato => {
     if(!dato || dato.nodeId !== thisNodeId) return;
-    insertarFila(dato);
-    const label = dato.fecha_creacion || (dato.timestamp? new Date(dato.timestamp*1000).toISOString(): '');
-    if(chartTemperatura){ chartTemperatura.data.labels.push(label); clampLen(chartTemperatura.data.labels); pushIfDefined(chartTemperatura.data.datasets[0].data,dato.temperatura); clampLen(chartTemperatura.data.datasets[0].data); chartTemperatura.update('none'); }
-    if(chartHumedad){ chartHumedad.data.labels.push(label); clampLen(chartHumedad.data.labels); pushIfDefined(chartHumedad.data.datasets[0].data,dato.humedad); clampLen(chartHumedad.data.datasets[0].data); chartHumedad.update('none'); }
-    if(chartSoil){ chartSoil.data.labels.push(label); clampLen(chartSoil.data.labels); pushIfDefined(chartSoil.data.datasets[0].data,dato.soil_moisture); clampLen(chartSoil.data.datasets[0].data); chartSoil.update('none'); }
-    if(chartLight){ chartLight.data.labels.push(label); clampLen(chartLight.data.labels); pushIfDefined(chartLight.data.datasets[0].data,dato.light); pushIfDefined(chartLight.data.datasets[1].data,dato.percentage); clampLen(chartLight.data.datasets[0].data); clampLen(chartLight.data.datasets[1].data); chartLight.update('none'); }
+    insertarFila(dato, true);
+    agregarAGraficas(dato);
+    redibujarGraficas();
+  });
+  // Lote agrupado por el servidor: redibujar las gráficas una vez por lote
+  socket.on('nuevos_datos', lote => {
+    if(!lote || !Array.isArray(lote.datos)) return;
+    const propios = lote.datos.filter(d => d && d.nodeId === thisNodeId);
+    propios.forEach(d => { insertarFila(d, true); agregarAGraficas(d); });
+    if(propios.length) redibujarGraficas();
+    // El servidor recortó el lote (descarta las más antiguas): pedir de nuevo los últimos registros de este nodo
+    if(lote.omitidos > 0){
+      sumarTotal(lote.omitidos);
+      socket.emit('solicitar_datos', { limit: 100, nodeId: thisNodeId });
+    }
+  });
+  // Página de los últimos registros (de la más reciente a la más antigua): reconstruir tabla y gráficas
+  socket.on('resultado_datos', payload => {
+    const tbody=document.querySelector('#tabla-datos tbody');
+    if(!payload || !Array.isArray(payload.datos)) return;
+    const propios=payload.datos.filter(d => d && d.nodeId === thisNodeId);
+    if(tbody){
+      tbody.innerHTML='';
+      propios.forEach(d => insertarFila(d, false));
+    }
+    fusionarEnGraficas(propios);
   });
 
-  function insertarFila(d){
+  function sumarTotal(n){
+    const totalEl=document.getElementById('total');
+    if(totalEl){ const m=totalEl.textContent.match(/\d+/); const current=m?parseInt(m[0]):0; totalEl.textContent='Total de registros: '+(current+n); }
+  }
+
+  function insertarFila(d, alFrente){
     if(!d) return;
     const tbody=document.querySelector('#tabla-datos tbody');
     if(!tbody) return;
@@ -124,7 +219,7 @@
         if(c && c.textContent==d.id) return;
       }
     }
-    const fila=tbody.insertRow(0); fila.className='nuevo';
+    const fila=alFrente ? tbody.insertRow(0) : tbody.insertRow(-1); fila.className='nuevo';
     fila.insertCell(-1).textContent=d.id ?? '-';
     if(camposNode.temperatura) fila.insertCell(-1).textContent=d.temperatura!=null? Number(d.temperatura).toFixed(1):'-';
     if(camposNode.humedad) fila.insertCell(-1).textContent=d.humedad!=null? Number(d.humedad).toFixed(1):'-';
@@ -138,8 +233,7 @@
     }
     fila.insertCell(-1).textContent=d.timestamp ?? '-';
     fila.insertCell(-1).textContent=d.fecha_creacion ?? '-';
-    const totalEl=document.getElementById('total');
-    if(totalEl){ const m=totalEl.textContent.match(/\d+/); const current=m?parseInt(m[0]):0; totalEl.textContent='Total de registros: '+(current+1); }
+    if(alFrente) sumarTotal(1);
     while(tbody.rows.length>100) tbody.deleteRow(tbody.rows.length-1);
   }
 
@@ -3,7 +3,7 @@
   const statusDiv = document.getElementById('status');
   const ipEl = document.getElementById('gatewayIP');
   const totalEl = document.getElementById('total');
-  const socket = io(window.location.origin, { transports: ['polling'] });
+  const socket = io(window.location.origin, { transports: window.SOCKETIO_TRANSPORTES || ['polling', 'websocket'] });
 
   socket.on('connect', () => {
     if(statusDiv){
@@ -43,6 +43,29 @@
   socket.on('reconnect', () => { if(statusDiv) statusDiv.textContent='Reconectado'; });
 
   socket.on('nuevo_dato', (dato) => { agregarFila(dato, true); });
+  // Lote agrupado por el servidor (en orden cronológico): una sola pasada por el DOM
+  socket.on('nuevos_datos', (lote) => {
+    if(!lote || !Array.isArray(lote.datos)) return;
+    lote.datos.forEach(d => agregarFila(d, true));
+    // El servidor recortó el lote: pedir de nuevo los últimos registros
+    if(lote.omitidos > 0){
+      sumarTotal(lote.omitidos);
+      socket.emit('solicitar_datos', { limit: 100 });
+    }
+  });
+  socket.on('resultado_datos', (payload) => {
+    const tbody = document.querySelector('#tabla-datos tbody');
+    if(!tbody || !payload || !Array.isArray(payload.datos)) return;
+    tbody.innerHTML = '';
+    payload.datos.forEach(d => agregarFila(d, false));
+  });
+
+  function sumarTotal(n){
+    if(!totalEl) return;
+    const m = totalEl.textContent.match(/\d+/);
+    const current = m?parseInt(m[0]):0;
+    totalEl.textContent = 'Total de registros: ' + (current+n);
+  }
 
   function agregarFila(dato, alFrente){
     if(!dato) return;
@@ -61,11 +84,7 @@
     else if(dato.percentage!=null) luz=`${Number(dato.percentage).toFixed(0)}%`;
     fila.insertCell(-1).textContent = luz;
     fila.insertCell(-1).textContent = dato.fecha_creacion ?? '-';
-    if(alFrente && totalEl){
-      const m = totalEl.textContent.match(/\d+/);
-      const current = m?parseInt(m[0]):0;
-      totalEl.textContent = 'Total de registros: ' + (current+1);
-    }
+    if(alFrente) sumarTotal(1);
     while(tbody.rows.length>100) tbody.deleteRow(tbody.rows.length-1);
   }
 })();
@@ -0,0 +1,139 @@
+"""
+Resumen del tablero (página principal) de AgroLink
+Arma de una vez todo lo que muestra "/" (nodos, sensores por nodo, ubicaciones, centro
+del mapa, totales, último dato e IP de la gateway) a partir del resumen de nodos
+mantenido en cada inserción, y lo guarda hasta que cambie la versión de los datos.
+Lo usan la página (render en el servidor) y /api/dashboard (hidratación en el navegador).
+"""
+import threading
+
+from database import (
+    contar_registros,
+    get_gateway_ip,
+    obtener_resumen_nodos,
+    obtener_ultimo_dato
+)
+from serializacion import FilaDato, texto_fecha
+
+# Centro del mapa cuando ningún nodo tiene ubicación
+CENTRO_POR_DEFECTO = (4.660753, -74.059945)
+
+
+def etiquetas_sensores(campos):
+    """
+    Etiquetas de los sensores que reportó un nodo, para la tabla de nodos
+
+    Args:
+        campos: dict {campo: bool} como el de obtener_resumen_nodos
+
+    Returns:
+        list: p. ej. ['Temperatura', 'Humedad', 'Luz (lux, %)']
+    """
+    etiquetas = []
+    if campos.get('temperatura'): etiquetas.append('Temperatura')
+    if campos.get('humedad'): etiquetas.append('Humedad')
+    if campos.get('soil_moisture'): etiquetas.append('Suelo')
+    if campos.get('light') and campos.get('percentage'):
+        etiquetas.append('Luz (lux, %)')
+    else:
+        if campos.get('light'): etiquetas.append('Luz')
+        elif campos.get('percentage'): etiquetas.append('Luz (%)')
+    return etiquetas
+
+
+def _ultimo_dato_dict(dato):
+    """Último dato con todas las columnas (None incluidos), como lo usa la plantilla."""
+    if dato is None:
+        return None
+    valores = {campo: getattr(dato, campo) for campo in FilaDato._fields}
+    valores['fecha_creacion'] = texto_fecha(valores['fecha_creacion'])
+    return valores
+
+
+def construir_tablero():
+    """
+    Contenido completo de la página principal
+
+    Sale de las cachés de database.py (resumen de nodos, total, último dato, IP de la
+    gateway): sin consultas si están cargadas, y unas pocas si no, nunca una por nodo.
+
+    Returns:
+        dict: con las mismas claves que las variables de index.html
+    """
+    resumen = obtener_resumen_nodos()
+    nodos_sensores = {}
+    ubicaciones_todos = {}
+    for node_id, estado in resumen.items():
+        nodos_sensores[node_id] = etiquetas_sensores(estado['campos'])
+        ubicacion = estado['ubicacion']
+        if ubicacion and ubicacion.get('lat') is not None and ubicacion.get('lon') is not None:
+            ubicaciones_todos[node_id] = ubicacion
+    # Centro del mapa: primera ubicación válida o el centro por defecto
+    if ubicaciones_todos:
+        primero = next(iter(ubicaciones_todos.values()))
+        centro_lat, centro_lon = primero['lat'], primero['lon']
+    else:
+        centro_lat, centro_lon = CENTRO_POR_DEFECTO
+    return {
+        'total_registros': contar_registros(),
+        'ultimo_dato': _ultimo_dato_dict(obtener_ultimo_dato()),
+        'nodos': list(resumen),
+        'gateway_ip': get_gateway_ip(),
+        'nodos_sensores': nodos_sensores,
+        'ubicaciones_todos': ubicaciones_todos,
+        'centro_lat': centro_lat,
+        'centro_lon': centro_lon
+    }
+
+
+class ResumenTablero:
+    """
+    Guarda el último contenido de construir_tablero() junto con la versión de los datos
+
+    Las entradas (guardar_dato_sensor, eliminar_dato, etc.) suben la versión, y con eso
+    el contenido guardado deja de valer: se vuelve a armar en la siguiente petición.
+    El dict devuelto se comparte entre peticiones y no debe modificarse.
+    """
+
+    def __init__(self, version):
+        """
+        Args:
+            version: Función sin argumentos que devuelve (etag, fecha), p. ej. version_datos.actual
+        """
+        self._version = version
+        self._lock = threading.Lock()
+        self._etag = None
+        self._contenido = None
+        # Contadores
+        self.aciertos = 0
+        self.construcciones = 0
+
+    def vigente(self):
+        """El contenido si ya está armado para la versión actual, o None (sin consultar nada)."""
+        etag, _ = self._version()
+        with self._lock:
+            if self._etag == etag:
+                self.aciertos += 1
+                return self._contenido
+            return None
+
+    def obtener(self):
+        """Contenido para la versión actual, armándolo si hace falta (necesita app_context)."""
+        contenido = self.vigente()
+        if contenido is not None:
+            return contenido
+        # La versión se lee antes de armar: si una escritura se cruza, se vuelve a armar la próxima vez
+        etag, _ = self._version()
+        contenido = construir_tablero()
+        with self._lock:
+            self._etag, self._contenido = etag, contenido
+            self.construcciones += 1
+        return contenido
+
+    def metricas(self):
+        with self._lock:
+            return {
+                'aciertos': self.aciertos,
+                'construcciones': self.construcciones,
+                'nodos': len(self._contenido['nodos']) if self._contenido else 0
+            }